@@ -1,41 +1,32 @@
 import os
 import sys
 import json
+import threading
 from dotenv import load_dotenv
 from SimilarProduct import analyze_products 
 import FileSearch as fs
+import Telemetry as tm
+from PdfIngest import DEFAULT_STORE_DIR, ingest_folder
+from ResultLog import follow, new_run_id
 
-# ====== 載入 .env 設定 ======
+# ====== 預設路徑 ======
 env_path = r'D:\CYCU\113_WebCrawler\CODE\.env'
-if not os.path.exists(env_path):
-    sys.exit(f"找不到環境變數檔案：{env_path}")
-load_dotenv(dotenv_path=env_path)
+CSV_FILE_PATH = r"D:\CYCU\113_WebCrawler\CODE\data\format_clean.csv"
+OUTPUT_TXT = "D:\\CYCU\\113_WebCrawler\\CODE\\data\\final_answer.txt"
 
-def main():
-    # ---------------------------
-    # 1. 呼叫 SimilarProduct 模組處理產品分析
-    # ---------------------------
-    csv_file_path = r"D:\CYCU\113_WebCrawler\CODE\data\format_clean.csv"
-    api_key_input = os.getenv("OPENAI_API_KEY")
-    if not api_key_input:
-        print("環境變數中找不到 OPENAI_API_KEY")
-        return
+# 送給 gpt-4o 的上下文 token 上限 (合併重疊 chunk、移除近似重複後依相關度放入)
+CONTEXT_TOKEN_BUDGET = 6000
 
-    print("開始使用 SimilarProduct 進行產品分析...")
-    analyze_products(csv_file_path, api_key_input)
 
-    # ---------------------------
-    # 2. 讀取 SimilarProduct 模組產生的 JSON 結果
-    # ---------------------------
-    similar_product_json_path = os.getenv("SimilarProduct_JSON_PATH")
-    if not os.path.exists(similar_product_json_path):
-        print(f"找不到 SimilarProduct JSON 檔案：{similar_product_json_path}")
-        return
+def load_env(path=env_path):
+    """載入 .env 設定；找不到檔案時結束程式。"""
+    if not os.path.exists(path):
+        sys.exit(f"找不到環境變數檔案：{path}")
+    load_dotenv(dotenv_path=path)
 
-    with open(similar_product_json_path, "r", encoding="utf-8") as f:
-        product_data = json.load(f)
 
-    # 解析並整合所有關鍵字下的「相關產品」
+def parse_products(product_data):
+    """從 SimilarProduct 的結果 ({關鍵字: API 回應}) 取出所有「相關產品」。"""
     all_products = []
     for keyword, content in product_data.items():
         if "choices" in content and len(content["choices"]) > 0:
@@ -47,59 +38,112 @@ def main():
                 all_products.extend(prods)
             except json.JSONDecodeError:
                 all_products.append(content_str_clean)
+    return all_products
 
-    if not all_products:
-        print("未能從 SimilarProduct 結果中取得任何產品資訊。")
-        return
 
+def build_question(all_products):
     # 將產品列表合併成一個字串，並形成使用者問題
     product_list_str = "\n".join(all_products)
-    user_question = (
+    return (
         f"以下是多個產品列表(依關鍵字分類後再合併):\n{product_list_str}\n"
         "請問在現有的資料庫中相關或相似的功能類別(5碼)中文名稱有哪些？"
     )
-    print("使用者問題:\n", user_question)
 
+
+def answer_from_index(product_data, all_products, chunk_index, context_token_budget=CONTEXT_TOKEN_BUDGET):
+    """以關鍵字與產品名稱搜尋 chunk_index 並請 gpt-4o 回答；回傳 (答案, 使用的 chunk)。"""
+    # 每個關鍵字與產品名稱各自作為一個查詢 (一次批次向量化)，排名以 RRF 合併，
+    # 不再把整份產品清單當成單一查詢
+    retrieval_queries = list(product_data) + all_products
+    print(f"以 {len(retrieval_queries)} 個關鍵字 / 產品名稱搜尋最相似的 chunk (top_k=20) ...")
+    top_chunks = fs.search_multi_query(retrieval_queries, chunk_index, top_k=20, with_metadata=True)
+
+    print("使用 ChatCompletion 模組回應，整合相似 chunk 作為上下文提示 ...")
+    answer = fs.answer_with_context(
+        build_question(all_products), top_chunks, model="gpt-4o", max_context_tokens=context_token_budget
+    )
+    return answer, top_chunks
+
+
+def main(
+    csv_file_path=CSV_FILE_PATH,
+    keywords=None,
+    output_txt=OUTPUT_TXT,
+    store_dir=DEFAULT_STORE_DIR,
+    context_token_budget=CONTEXT_TOKEN_BUDGET,
+    resume=False,
+):
+    """
+    keywords 為 None 時由使用者輸入；store_dir 為 PDF 索引的存放位置。
+    context_token_budget 為回答時上下文的 token 上限 (None 表示不做組裝，送出全部 chunk)。
+    SimilarProduct 在背景執行緒執行，結果逐一寫入 SimilarProduct_JSON_PATH 旁的 .jsonl 紀錄檔，
+    本函式一邊同步 PDF 索引、一邊讀取已完成的關鍵字；resume=True 時略過上次已完成的關鍵字。
+    其餘設定 (API key、JSON 與 PDF 路徑) 由環境變數提供，見 load_env()。
+    設定 TELEMETRY_PATH 時會記錄各階段與 API 呼叫的耗時、token 與費用 (見 Telemetry.py)。
+    """
     # ---------------------------
-    # 3. 呼叫 FileSearch 模組進行 PDF 內容查找
+    # 1. 在背景執行 SimilarProduct 產品分析 (每完成一個關鍵字就寫入紀錄檔)
     # ---------------------------
+    api_key_input = os.getenv("OPENAI_API_KEY")
+    if not api_key_input:
+        print("環境變數中找不到 OPENAI_API_KEY")
+        return
     pdf_folder = os.getenv("PDFfloder_PATH")
     if not os.path.isdir(pdf_folder):
         print(f"找不到 PDF 資料夾：{pdf_folder}")
         return
 
-    pdf_files = [
-        os.path.join(pdf_folder, f)
-        for f in os.listdir(pdf_folder)
-        if f.lower().endswith(".pdf")
-    ]
-    if not pdf_files:
-        print(f"在資料夾中找不到 PDF 檔案：{pdf_folder}")
-        return
+    if keywords is None:
+        input_keywords = input("請輸入關鍵字（以逗號分隔）：")
+        keywords = [k.strip() for k in input_keywords.split(",") if k.strip()]
 
-    all_chunks = []
-    for pdf_file in pdf_files:
-        print(f"正在讀取與切分 PDF：{pdf_file}")
-        chunks = fs.pdf_to_chunks(pdf_file)
-        all_chunks.extend(chunks)
+    similar_product_json_path = os.getenv("SimilarProduct_JSON_PATH")
+    log_path = os.path.splitext(similar_product_json_path)[0] + ".jsonl"
+    run_id = new_run_id()
+    print(f"開始使用 SimilarProduct 進行產品分析 (結果逐一寫入 {log_path}) ...")
+    analysis = threading.Thread(
+        target=analyze_products,
+        args=(csv_file_path, api_key_input, keywords),
+        kwargs={"log_path": log_path, "resume": resume, "run_id": run_id},
+        daemon=True,
+    )
+    analysis.start()
 
-    if not all_chunks:
-        print("未能從 PDF 中擷取任何文字區塊。")
+    # ---------------------------
+    # 2. 等待產品分析的同時同步 PDF 索引 (FileSearch)
+    # ---------------------------
+    print("同步 PDF 索引 (只處理新增或變動的檔案) ...")
+    chunk_index = ingest_folder(pdf_folder, store_dir)
+    if len(chunk_index) == 0:
+        print(f"未能從 PDF 資料夾中擷取任何文字區塊：{pdf_folder}")
+        analysis.join()  # 產品分析仍會完成並寫入紀錄檔
         return
+    cache_stats = fs.get_default_cache().stats()
+    print(f"Embedding 快取命中 {cache_stats['hits']} 次，未命中 {cache_stats['misses']} 次")
 
-    print("對所有 chunk 進行 Embedding ...")
-    embedded_chunks = fs.get_embeddings_for_chunks(all_chunks, model="text-embedding-ada-002")
-
-    print("根據使用者問題搜尋最相似的 chunk (top_k=20) ...")
-    top_chunks = fs.search_relevant_chunks(user_question, embedded_chunks, top_k=20)
+    # ---------------------------
+    # 3. 逐一讀取紀錄檔中已完成的關鍵字，並整合所有「相關產品」
+    # ---------------------------
+    product_data = {}
+    for record in follow(log_path, run_id, is_running=analysis.is_alive):
+        product_data[record["keyword"]] = record["result"]
+        found = parse_products({record["keyword"]: record["result"]})
+        print(f"關鍵字 {record['keyword']} 完成 ({record['source']})：{len(found)} 項相關產品")
+    analysis.join()
+    # 並行模式下完成順序與輸入不同，依輸入順序排列
+    product_data = {keyword: product_data[keyword] for keyword in keywords if keyword in product_data}
+
+    all_products = parse_products(product_data)
+    if not all_products:
+        print("未能從 SimilarProduct 結果中取得任何產品資訊。")
+        return
+    print("使用者問題:\n", build_question(all_products))
 
-    print("使用 ChatCompletion 模組回應，整合相似 chunk 作為上下文提示 ...")
-    answer = fs.answer_with_context(user_question, top_chunks, model="gpt-4o")
+    answer, _ = answer_from_index(product_data, all_products, chunk_index, context_token_budget)
 
     # ---------------------------
     # 4. 將最終答案寫入指定的文字檔中
     # ---------------------------
-    output_txt = "D:\\CYCU\\113_WebCrawler\\CODE\\data\\final_answer.txt"
     try:
         with open(output_txt, "w", encoding="utf-8") as f:
             f.write(answer)
@@ -110,4 +154,11 @@ def main():
         print(f"寫入最終答案時發生錯誤：{e}")
 
 if __name__ == "__main__":
-    main()
+    load_env()
+    if os.getenv("TELEMETRY_PATH") and not tm.enabled():
+        tm.enable(os.getenv("TELEMETRY_PATH"))
+    try:
+        # python Assistant_api.py --resume：沿用上次中斷前已完成的關鍵字
+        main(resume="--resume" in sys.argv)
+    finally:
+        tm.print_summary()
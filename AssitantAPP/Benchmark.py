@@ -0,0 +1,1356 @@
+import io
+import os
+import ssl
+import sys
+import socket
+import json
+import time
+import random
+import asyncio
+import shutil
+import argparse
+import subprocess
+import datetime
+import tempfile
+import threading
+import contextlib
+import numpy as np
+import openai
+import requests
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import Assistant_api
+import OpenAIClient as oc
+import CompletionCache
+import EmbeddingCache
+import FileSearch as fs
+import FileSearch_VectorStore as fsv
+import SimilarProduct as sp
+import Telemetry as tm
+from CatalogIndex import CatalogIndex
+from CatalogSearch import CatalogSearch
+from DataStore import load_dataset
+from EmbeddingIndex import EmbeddingIndex
+from KeywordMatcher import KeywordYearIndex
+from LocalVectorStore import LocalVectorStore
+from PriceStats import PriceStats
+from QuantizedIndex import QUANTIZATIONS, QuantizedIndex, TextBuffer
+from DaemonClient import DaemonClient
+from ResultLog import ResultLog, follow, new_run_id, read_records
+from MockOpenAIServer import MockOpenAIServer, fake_embedding
+
+##############################################################################
+# 效能量測工具 (全部對本機替身伺服器執行，不會呼叫真正的 OpenAI API)
+#   python Benchmark.py embeddings --chunks 500 --latency 0.02
+#   python Benchmark.py index --sizes 10000 100000 1000000
+#   python Benchmark.py quantized --chunks 100000 --top-k 20
+#   python Benchmark.py extract --workers 1 2 4 8
+#   python Benchmark.py chat --keywords 30 --concurrency 1 4 8 16
+#   python Benchmark.py years --keywords 300
+#   python Benchmark.py startup --scale 1 10 50
+#   python Benchmark.py stats --scale 1 10
+#   python Benchmark.py search --scale 1 10 --queries 200
+#   python Benchmark.py retrieval --chunks 5000 --queries 100
+#   python Benchmark.py multiquery --chunks 5000 --queries 300
+#   python Benchmark.py vectorstore --docs 20000 --latency 0.05
+#   python Benchmark.py http --calls 200 --threads 8 --tls
+#   python Benchmark.py daemon --questions 20 --clients 4
+#   python Benchmark.py checkpoint --keywords 50 --kill-after 40
+#   python Benchmark.py suite --pdfs 20 --pages 10 --latency 0.05 --error-rate 0.02
+##############################################################################
+
+_WORDS = [
+    "多路連接頭", "人工髖關節", "脊椎內固定系統", "血管支架", "引流管", "骨水泥",
+    "PTCA BALLOON CATHETER", "MANIFOLDS", "STOPCOCK", "HIP CUP", "INSERT", "SCREW",
+    "特材代碼", "支付點數", "許可證字號", "核價類別", "功能類別", "費用年",
+]
+
+
+def synthetic_chunks(n: int, size: int = 800, seed: int = 0) -> List[str]:
+    """產生中英混合、長度約 size 字元的假 chunk。"""
+    rng = random.Random(seed)
+    chunks = []
+    for i in range(n):
+        parts = [f"#{i}"]
+        length = 0
+        while length < size:
+            word = rng.choice(_WORDS)
+            parts.append(word)
+            length += len(word) + 1
+        chunks.append(" ".join(parts)[:size])
+    return chunks
+
+
+def use_mock_server(server: MockOpenAIServer) -> None:
+    oc.API_BASE = server.url
+    oc.API_KEY = "sk-mock"
+    sp.API_URL = f"{server.url}/chat/completions"
+    fsv.VECTOR_STORE_URL = f"{server.url}/vector-stores"
+
+
+##############################################################################
+# Embedding 吞吐量：逐一請求 vs 批次 vs 批次 + 並行
+##############################################################################
+def bench_embeddings(args) -> None:
+    server = MockOpenAIServer(latency=args.latency, error_rate=args.error_rate, dim=args.dim).start()
+    use_mock_server(server)
+    chunks = synthetic_chunks(args.chunks)
+
+    configs = [
+        ("sequential", 1, 1),
+        ("batched", args.batch_size, 1),
+        ("batched+concurrent", args.batch_size, args.workers),
+    ]
+    print(f"chunks={len(chunks)} latency={args.latency}s error_rate={args.error_rate}")
+    print(f"{'mode':<20}{'batch':>7}{'workers':>9}{'seconds':>10}{'chunks/s':>12}{'requests':>10}{'429s':>7}")
+    try:
+        for name, batch_size, workers in configs:
+            if name == "sequential" and args.skip_sequential:
+                continue
+            requests_before = server.request_count
+            limited_before = server.rate_limited_count
+            start = time.perf_counter()
+            embedded = fs.get_embeddings_for_chunks(
+                chunks, use_cache=False, batch_size=batch_size, max_workers=workers
+            )
+            elapsed = time.perf_counter() - start
+
+            # 確認順序沒有被打亂
+            for text, vec in embedded[:: max(1, len(embedded) // 20)]:
+                assert np.allclose(vec, fake_embedding(text, args.dim)), "chunk order mismatch"
+
+            print(
+                f"{name:<20}{batch_size:>7}{workers:>9}{elapsed:>10.3f}{len(chunks) / elapsed:>12.1f}"
+                f"{server.request_count - requests_before:>10}{server.rate_limited_count - limited_before:>7}"
+            )
+    finally:
+        server.stop()
+
+
+##############################################################################
+# 向量搜尋延遲：EmbeddingIndex (矩陣運算) vs 舊的逐 chunk cosine 迴圈
+##############################################################################
+def _random_unit_matrix(rows: int, dim: int, rng: np.random.Generator, block: int = 100_000) -> np.ndarray:
+    matrix = np.empty((rows, dim), dtype=np.float32)
+    for start in range(0, rows, block):
+        matrix[start:start + block] = rng.standard_normal((min(block, rows - start), dim), dtype=np.float32)
+    return matrix
+
+
+def _loop_search(query_vec, embedded_chunks, top_k):
+    scores = [(text, fs.cosine_similarity(query_vec, vec)) for text, vec in embedded_chunks]
+    scores.sort(key=lambda x: x[1], reverse=True)
+    return [item[0] for item in scores[:top_k]]
+
+
+def _median_ms(func, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return float(np.median(times))
+
+
+def bench_index(args) -> None:
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((args.batch, args.dim), dtype=np.float32)
+    print(f"dim={args.dim} top_k={args.top_k} batch={args.batch} (median of {args.repeat} runs)")
+    print(f"{'chunks':>10}{'MB':>9}{'loop ms':>10}{'index ms':>10}{'batch ms':>10}{'ms/query':>10}")
+
+    for size in args.sizes:
+        vectors = _random_unit_matrix(size, args.dim, rng)
+        index = EmbeddingIndex([""] * size, vectors)
+        del vectors
+
+        loop_ms = float("nan")
+        if size <= args.loop_max:
+            embedded = list(zip(index.texts, index.matrix))
+            loop_ms = _median_ms(lambda: _loop_search(queries[0], embedded, args.top_k), 1)
+            del embedded
+
+        single_ms = _median_ms(lambda: index.search(queries[0], args.top_k), args.repeat)
+        batch_ms = _median_ms(lambda: index.search_batch(queries, args.top_k), args.repeat)
+        mb = index.matrix.nbytes / 1024 ** 2
+        print(f"{size:>10}{mb:>9.0f}{loop_ms:>10.1f}{single_ms:>10.2f}{batch_ms:>10.1f}{batch_ms / args.batch:>10.2f}")
+        del index
+
+
+##############################################################################
+# 量化索引：每百萬 chunk 的記憶體與相對於 float32 精確搜尋的 recall@k
+#   - 向量以低秩結構 + 雜訊產生 (與真實 embedding 一樣有明顯的群聚)，
+#     查詢為隨機 chunk 的潛在向量加上擾動
+#   - 原始向量存到暫存目錄後以記憶體映射載入，重新排序時只讀取候選列
+#   - 舊格式：get_embeddings_for_chunks 早期的 [(str, float64 陣列)] 列表
+##############################################################################
+def _latent_vectors(rows: int, dim: int, rng: np.random.Generator, rank: int = 64, noise: float = 2.0):
+    basis = rng.standard_normal((rank, dim), dtype=np.float32)
+    latent = rng.standard_normal((rows, rank), dtype=np.float32)
+    matrix = np.empty((rows, dim), dtype=np.float32)
+    for start in range(0, rows, 100_000):
+        end = min(start + 100_000, rows)
+        matrix[start:end] = latent[start:end] @ basis + noise * rng.standard_normal((end - start, dim), dtype=np.float32)
+    return matrix, latent, basis
+
+
+def _recall(exact, approx) -> float:
+    found = sum(len({i for i, _ in e} & {i for i, _ in a}) for e, a in zip(exact, approx))
+    return found / max(1, sum(len(e) for e in exact))
+
+
+def bench_quantized(args) -> None:
+    rng = np.random.default_rng(args.seed)
+    matrix, latent, basis = _latent_vectors(args.chunks, args.dim, rng)
+    rows = rng.integers(0, args.chunks, args.queries)
+    queries = (latent[rows] + 0.5 * rng.standard_normal((args.queries, latent.shape[1]), dtype=np.float32)) @ basis
+    texts = synthetic_chunks(args.chunks, args.chunk_size)
+    per_million = 1_000_000 / args.chunks
+
+    # 文字：Python 字串列表 vs 連續緩衝區；舊格式另外以 1000 筆實際建立後推估
+    sample = 1000
+    legacy_tuples = [(t, np.asarray(v, dtype=np.float64)) for t, v in zip(texts[:sample], matrix[:sample])]
+    legacy_bytes = sum(
+        8 + sys.getsizeof(item) + sys.getsizeof(item[0]) + sys.getsizeof(item[1]) for item in legacy_tuples
+    ) / sample * 1_000_000
+    del legacy_tuples
+    str_bytes = (8 * len(texts) + sum(sys.getsizeof(t) for t in texts)) * per_million
+    buffer = TextBuffer(texts)
+    print(f"chunks={args.chunks} dim={args.dim} chunk_size={args.chunk_size} top_k={args.top_k} queries={args.queries}")
+    print(f"texts per 1M chunks: list[str] {str_bytes / 1024 ** 2:,.0f} MB, "
+          f"TextBuffer ({buffer.encoding}) {buffer.nbytes * per_million / 1024 ** 2:,.0f} MB")
+    print(f"legacy [(str, float64 array)] per 1M chunks: {legacy_bytes / 1024 ** 2:,.0f} MB")
+    del buffer
+
+    workdir = tempfile.mkdtemp(prefix="bench_quantized_")
+    try:
+        exact_index = EmbeddingIndex(texts, matrix, [{"row": i} for i in range(len(texts))])
+        del matrix
+        exact_index.save(workdir)
+        start = time.perf_counter()
+        exact = exact_index.search_batch(queries, args.top_k)
+        exact_ms = (time.perf_counter() - start) * 1000 / args.queries
+        # 查詢向量預先放進 Embedding 快取，search_relevant_chunks 不需呼叫 API
+        query_texts = [f"quantized query {i}" for i in range(args.queries)]
+        query_cache = EmbeddingCache.EmbeddingCache(os.path.join(workdir, "query_cache.sqlite"))
+        query_cache.put_many("text-embedding-ada-002", list(zip(query_texts, queries)))
+
+        def via_search_chunks(index) -> List[List[tuple]]:
+            hits = []
+            for text in query_texts:
+                records = fs.search_relevant_chunks(text, index, args.top_k, cache=query_cache, with_metadata=True)
+                hits.append([(r["row"], r["score"]) for r in records])
+            return hits
+        vectors_mb = exact_index.matrix.nbytes * per_million / 1024 ** 2
+        print(f"{'index':<18}{'rerank':>7}{'MB/1M vec':>11}{'MB/1M all':>11}{'build s':>9}{'ms/query':>10}{'recall@k':>10}"
+              f"{'via search_relevant_chunks':>28}")
+        print(f"{'float32 (exact)':<18}{'-':>7}{vectors_mb:>11,.0f}{vectors_mb + str_bytes / 1024 ** 2:>11,.0f}"
+              f"{'-':>9}{exact_ms:>10.2f}{1.0:>10.4f}{_recall(exact, via_search_chunks(exact_index)):>28.4f}")
+        del exact_index
+
+        for quantization in QUANTIZATIONS:
+            start = time.perf_counter()
+            index = QuantizedIndex.load(workdir, mmap=True, quantization=quantization)
+            build = time.perf_counter() - start
+            memory = index.memory_bytes()
+            codes_mb = memory["codes"] * per_million / 1024 ** 2
+            total_mb = (memory["codes"] + memory["texts"]) * per_million / 1024 ** 2
+            for rerank in (0, index.rerank):
+                index.rerank = rerank
+                start = time.perf_counter()
+                approx = index.search_batch(queries, args.top_k)
+                query_ms = (time.perf_counter() - start) * 1000 / args.queries
+                print(f"{quantization:<18}{rerank:>7}{codes_mb:>11,.0f}{total_mb:>11,.0f}{build:>9.2f}"
+                      f"{query_ms:>10.2f}{_recall(exact, approx):>10.4f}"
+                      f"{_recall(exact, via_search_chunks(index)):>28.4f}")
+            del index
+        query_cache.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+##############################################################################
+# PDF 解析：不同行程數的總耗時與每個檔案的解析時間
+##############################################################################
+DEFAULT_PDF_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "PDFfloder")
+
+
+def bench_extract(args) -> None:
+    pdf_paths = sorted(
+        os.path.join(args.folder, name) for name in os.listdir(args.folder) if name.lower().endswith(".pdf")
+    )
+    print(f"{len(pdf_paths)} PDFs in {args.folder}")
+    print(f"{'workers':>8}{'seconds':>10}{'speedup':>9}{'chunks':>9}")
+
+    baseline = None
+    file_seconds = {}
+    for workers in args.workers:
+        start = time.perf_counter()
+        chunk_count = 0
+        for path, chunks, seconds in fs.iter_pdf_chunks_parallel(pdf_paths, max_workers=workers):
+            chunk_count += len(chunks)
+            file_seconds[path] = seconds
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"{workers:>8}{elapsed:>10.2f}{baseline / elapsed:>9.2f}{chunk_count:>9}")
+
+    print("\n最慢的檔案：")
+    for path, seconds in sorted(file_seconds.items(), key=lambda x: -x[1])[:5]:
+        print(f"  {seconds:>7.2f}s  {os.path.basename(path)}")
+
+
+##############################################################################
+# analyze_products：關鍵字並行數與吞吐量
+##############################################################################
+DEFAULT_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "format_clean.csv")
+
+
+def bench_chat(args) -> None:
+    server = MockOpenAIServer(latency=args.latency, error_rate=args.error_rate).start()
+    keywords = [f"{random.Random(i).choice(_WORDS)}{i}" for i in range(args.keywords)]
+    workdir = tempfile.mkdtemp()
+    csv_file = os.path.join(workdir, os.path.basename(args.csv))
+    shutil.copy(args.csv, csv_file)
+
+    print(f"keywords={len(keywords)} latency={args.latency}s error_rate={args.error_rate}")
+    print(f"{'concurrency':>12}{'seconds':>10}{'keywords/s':>12}{'requests':>10}{'429s':>7}{'errors':>8}")
+    try:
+        for concurrency in args.concurrency:
+            requests_before = server.request_count
+            limited_before = server.rate_limited_count
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                sp.analyze_products(
+                    csv_file, "sk-mock", keywords,
+                    concurrency=concurrency, rpm_limit=args.rpm, tpm_limit=args.tpm,
+                    api_url=f"{server.url}/chat/completions", use_cache=False,
+                )
+            elapsed = time.perf_counter() - start
+
+            with open(os.path.join(workdir, "SimilarProduct_Output.json"), "r", encoding="utf-8") as f:
+                output = json.load(f)
+            assert list(output) == keywords, "keyword order mismatch"
+            errors = sum(1 for result in output.values() if "error" in result)
+            print(
+                f"{concurrency:>12}{elapsed:>10.2f}{len(keywords) / elapsed:>12.2f}"
+                f"{server.request_count - requests_before:>10}{server.rate_limited_count - limited_before:>7}{errors:>8}"
+            )
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+##############################################################################
+# 關鍵字出現年度：逐關鍵字 DataFrame 掃描 vs KeywordYearIndex 單次掃描
+##############################################################################
+DEFAULT_SURVEY_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "價量調查品項111-112.csv")
+
+
+def bench_years(args) -> None:
+    df = pd.read_csv(args.csv)
+    names = list(df.iloc[:, -1].dropna().astype(str).unique())
+    if "核價類別名稱" in df.columns:
+        names = list(df["核價類別名稱"].dropna().astype(str).str.strip().unique())
+    rng = random.Random(0)
+    keywords = []
+    for _ in range(args.keywords):
+        name = rng.choice(names)
+        start = rng.randrange(max(1, len(name) - 2))
+        keywords.append(name[start:start + rng.randint(2, 4)])
+
+    sample = keywords[: args.scan_sample]
+    start = time.perf_counter()
+    for keyword in sample:
+        df.columns[df.apply(lambda col: col.astype(str).str.contains(keyword, na=False, regex=False)).any()]
+    per_keyword = (time.perf_counter() - start) / len(sample)
+
+    start = time.perf_counter()
+    index = KeywordYearIndex(df)
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    index.lookup(keywords)
+    lookup = time.perf_counter() - start
+
+    print(f"rows={len(df)} keywords={len(keywords)} distinct texts={len(index.texts)}")
+    print(f"per-keyword DataFrame scan : {per_keyword * 1000:.1f} ms/keyword -> {per_keyword * len(keywords):.2f} s total (estimated)")
+    print(f"KeywordYearIndex build     : {build * 1000:.1f} ms")
+    print(f"KeywordYearIndex lookup    : {lookup * 1000:.1f} ms total for all keywords")
+
+
+##############################################################################
+# GUI 啟動資料載入：CSV 解析 (舊) vs 第一次載入 (CSV + 建立快取) vs 讀取二進位快取
+##############################################################################
+def bench_startup(args) -> None:
+    source = pd.read_csv(args.csv)
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    try:
+        for scale in args.scale:
+            csv_path = os.path.join(workdir, f"survey_x{scale}.csv")
+            cache_path = os.path.join(workdir, f"survey_x{scale}.pkb")
+            pd.concat([source] * scale, ignore_index=True).to_csv(csv_path, index=False)
+
+            start = time.perf_counter()
+            legacy = pd.read_csv(csv_path)
+            legacy["特材代碼前五碼"] = legacy["特材代碼前五碼"].astype(str)
+            CatalogIndex(legacy)
+            legacy_s = time.perf_counter() - start
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                CatalogIndex(load_dataset(csv_path, cache_path))
+                cold_s = time.perf_counter() - start
+
+                warm = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    CatalogIndex(load_dataset(csv_path, cache_path))
+                    warm.append(time.perf_counter() - start)
+
+            print(
+                f"rows={len(legacy):>8}  csv={os.path.getsize(csv_path) / 1e6:6.1f} MB  "
+                f"cache={os.path.getsize(cache_path) / 1e6:6.1f} MB  "
+                f"legacy read_csv={legacy_s * 1000:7.1f} ms  cold(+cache)={cold_s * 1000:7.1f} ms  "
+                f"warm={float(np.median(warm)) * 1000:7.1f} ms"
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+##############################################################################
+# 支付點數統計：每次點選時過濾整張表再計算 vs PriceStats 預先計算
+##############################################################################
+def bench_stats(args) -> None:
+    source = pd.read_csv(args.csv)
+    for scale in args.scale:
+        df = pd.concat([source] * scale, ignore_index=True)
+        df["特材代碼前五碼"] = df["特材代碼前五碼"].astype(str)
+        catalog = CatalogIndex(df)
+        groups = [(code, category) for code in catalog.codes for category in catalog.categories(code)]
+
+        start = time.perf_counter()
+        for code, category in groups:
+            filtered = df[(df["特材代碼前五碼"] == code) & (df["核價類別名稱"] == category)]
+            filtered.groupby("年份")["支付點數"].describe(percentiles=[0.1, 0.25, 0.5, 0.75, 0.9])
+            filtered.groupby(["申請者簡稱", "年份"]).size()
+        per_click = (time.perf_counter() - start) / len(groups)
+
+        start = time.perf_counter()
+        stats = PriceStats(df)
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        for code, category in groups:
+            stats.summary(code, category)
+            stats.applicants(code, category)
+        per_query = (time.perf_counter() - start) / len(groups)
+
+        print(
+            f"rows={len(df):>8}  groups={len(groups)}  per-click filter+describe={per_click * 1000:6.2f} ms "
+            f"(all groups {per_click * len(groups):6.2f} s)  PriceStats build={build * 1000:7.1f} ms  "
+            f"query={per_query * 1000:5.2f} ms"
+        )
+
+
+##############################################################################
+# GUI 搜尋框：索引建立時間與每次按鍵的查詢延遲
+##############################################################################
+def bench_search(args) -> None:
+    source = pd.read_csv(args.csv)
+    rng = random.Random(0)
+    for scale in args.scale:
+        df = pd.concat([source] * scale, ignore_index=True)
+        if scale > 1:
+            # 複製的列加上編號，避免全部被合併成同一份文件
+            df["產品型號/規格"] = df["產品型號/規格"].astype(str) + " #" + (df.index // len(source)).astype(str)
+
+        start = time.perf_counter()
+        search = CatalogSearch(df)
+        build = time.perf_counter() - start
+
+        # 模擬逐字輸入：取品名的片段，每多打一個字查詢一次
+        names = df["中英文品名"].dropna().astype(str).str.strip().tolist()
+        keystrokes = []
+        for _ in range(args.queries):
+            name = rng.choice(names)
+            begin = rng.randrange(max(1, len(name) - 8))
+            typed = name[begin:begin + rng.randint(3, 10)]
+            keystrokes.extend(typed[:i] for i in range(1, len(typed) + 1))
+
+        latencies = []
+        for query in keystrokes:
+            start = time.perf_counter()
+            search.search_positions(query, top_n=20)
+            latencies.append(time.perf_counter() - start)
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+
+        print(
+            f"rows={len(df):>8}  docs={len(search.index):>8}  build={build:6.2f} s  "
+            f"keystrokes={len(keystrokes)}  p50={p50:5.2f} ms  p99={p99:5.2f} ms"
+        )
+
+
+##############################################################################
+# 檢索模式：特材代碼 / 許可證字號等精確字串的查詢延遲與命中率
+#   - dense(openai)：每次查詢都要對替身伺服器取 query embedding (不使用快取)
+#   - dense(hashing) / lexical / hybrid(hashing)：本機計算，不需網路
+#   - hit@1：第一名的 chunk 是否包含查詢的代碼
+##############################################################################
+def _code_corpus(n: int, codes: int, seed: int = 0):
+    rng = random.Random(seed)
+    chunks = synthetic_chunks(n, size=400, seed=seed)
+    letters = "ABCDEFGHJKLMNPQRSTUVWXYZ"
+    code_list = []
+    for i in rng.sample(range(n), codes):
+        code = "".join(rng.choice(letters) for _ in range(3)) + f"{rng.randrange(10**9):09d}"
+        chunks[i] = f"{chunks[i][:200]} 特材代碼 {code} {chunks[i][200:]}"
+        code_list.append(code)
+    return chunks, code_list
+
+
+def bench_retrieval(args) -> None:
+    server = MockOpenAIServer(latency=args.latency, dim=args.dim).start()
+    use_mock_server(server)
+    try:
+        chunks, codes = _code_corpus(args.chunks, args.queries)
+        embedded = fs.get_embeddings_for_chunks(chunks, use_cache=False)
+        index = EmbeddingIndex.from_embedded_chunks(embedded)
+
+        configs = [
+            ("dense(openai)", "dense", None),
+            ("dense(hashing)", "dense", "hashing"),
+            ("lexical", "lexical", None),
+            ("hybrid(openai)", "hybrid", None),
+            ("hybrid(hashing)", "hybrid", "hashing"),
+        ]
+        print(f"chunks={len(chunks)} queries={len(codes)} latency={args.latency}s")
+        print(f"{'mode':<18}{'build s':>9}{'p50 ms':>9}{'p99 ms':>9}{'hit@1':>8}")
+        for name, mode, backend in configs:
+            # 第一次查詢會建立本機索引 (BM25 / hashing 向量)，分開計時
+            start = time.perf_counter()
+            fs.search_relevant_chunks(codes[0], index, top_k=1, mode=mode, backend=backend, use_cache=False)
+            build = time.perf_counter() - start
+
+            latencies, hits = [], 0
+            for code in codes:
+                start = time.perf_counter()
+                top = fs.search_relevant_chunks(code, index, top_k=1, mode=mode, backend=backend, use_cache=False)
+                latencies.append(time.perf_counter() - start)
+                hits += bool(top) and code in top[0]
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+            print(f"{name:<18}{build:>9.3f}{p50:>9.3f}{p99:>9.3f}{hits / len(codes):>8.0%}")
+    finally:
+        server.stop()
+
+
+##############################################################################
+# 多查詢檢索：整份產品清單合併成一個查詢 vs 每個產品各自查詢後以 RRF 合併
+#   - 耗時與請求數：對替身伺服器 (OpenAI 向量)
+#   - recall：以 hashing 後端檢查，被埋入產品名稱的 chunk 有多少進入前 (查詢數) 名
+##############################################################################
+def bench_multiquery(args) -> None:
+    rng = random.Random(args.seed)
+    chunks = synthetic_chunks(args.chunks, size=400, seed=args.seed)
+    letters = "ABCDEFGHJKLMNPQRSTUVWXYZ"
+    products = [
+        "".join(rng.choice(letters) for _ in range(8)) + f" {rng.choice(_WORDS)}" for _ in range(args.queries)
+    ]
+    planted = set()
+    for product, i in zip(products, rng.sample(range(len(chunks)), len(products))):
+        chunks[i] = f"{chunks[i][:200]} {product} {chunks[i][200:]}"
+        planted.add(i)
+    merged_query = "以下是多個產品列表:\n" + "\n".join(products)
+
+    server = MockOpenAIServer(latency=args.latency, dim=args.dim).start()
+    use_mock_server(server)
+    try:
+        index = EmbeddingIndex.from_embedded_chunks(fs.get_embeddings_for_chunks(chunks, use_cache=False))
+        top_k = args.top_k
+        runs = [
+            ("merged", lambda: fs.search_relevant_chunks(merged_query, index, top_k=top_k, use_cache=False)),
+            ("per-query loop", lambda: [
+                fs.search_relevant_chunks(q, index, top_k=top_k, use_cache=False) for q in products
+            ]),
+            ("multi-query RRF", lambda: fs.search_multi_query(products, index, top_k=top_k, use_cache=False)),
+        ]
+        print(f"chunks={len(chunks)} queries={len(products)} top_k={top_k} latency={args.latency}s")
+        print(f"{'mode':<18}{'seconds':>9}{'requests':>10}")
+        for name, run in runs:
+            requests_before = server.request_count
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            print(f"{name:<18}{elapsed:>9.3f}{server.request_count - requests_before:>10}")
+
+        # 只量測索引計分 (不含向量化)：逐一 search vs 一次 search_fused
+        query_matrix = np.stack([fake_embedding(q, args.dim) for q in products])
+        loop_ms = _median_ms(lambda: [index.search(q, top_k) for q in query_matrix], 5)
+        fused_ms = _median_ms(lambda: index.search_fused(query_matrix, top_k), 5)
+        print(f"index scoring only: loop {loop_ms:.1f} ms, search_fused {fused_ms:.1f} ms")
+    finally:
+        server.stop()
+
+    # 取與查詢數相同的 k，理想上每個產品的 chunk 都應該被找到
+    k = len(products)
+    merged_hits = fs.search_relevant_chunks(merged_query, index, top_k=k, backend="hashing", with_metadata=True)
+    multi_hits = fs.search_multi_query(products, index, top_k=k, backend="hashing", with_metadata=True)
+    text_rows = {text: i for i, text in enumerate(index.texts)}
+    for name, hits in (("merged", merged_hits), ("multi-query RRF", multi_hits)):
+        found = sum(text_rows[hit["text"]] in planted for hit in hits)
+        print(f"recall@{k} (hashing) {name:<16} {found}/{len(planted)}")
+
+
+##############################################################################
+# 向量庫查詢：遠端 (替身伺服器模擬 OpenAI vector store) vs 本機 LocalVectorStore
+#   - remote：每次查詢一個 HTTP 往返 (--latency 模擬網路延遲)
+#   - local+embed：查詢文字仍需向 embeddings API 取向量 (不使用快取)
+#   - local+cached：相同查詢的向量已在 EmbeddingCache 中
+#   - local search：只計算本機向量庫的檢索 (已有查詢向量)
+##############################################################################
+def bench_vectorstore(args) -> None:
+    docs = synthetic_chunks(args.docs, size=400, seed=args.seed)
+    rng = random.Random(args.seed)
+    queries = [" ".join(rng.sample(_WORDS, 3)) for _ in range(args.queries)]
+
+    server = MockOpenAIServer(latency=args.latency, dim=args.dim, documents=docs).start()
+    use_mock_server(server)
+    with tempfile.TemporaryDirectory() as tmp, isolated_caches(tmp):
+        try:
+            start = time.perf_counter()
+            store = LocalVectorStore(os.path.join(tmp, "store"), fs.OpenAIEmbeddingBackend(use_cache=False))
+            store.add(docs, vectors=np.stack([fake_embedding(d, args.dim) for d in docs]))
+            build = time.perf_counter() - start
+            start = time.perf_counter()
+            reopened = LocalVectorStore(os.path.join(tmp, "store"), fs.OpenAIEmbeddingBackend(use_cache=False))
+            reopened.search(fake_embedding(queries[0], args.dim), 5)
+            reopen = time.perf_counter() - start
+            print(
+                f"docs={len(docs)} dim={args.dim} latency={args.latency}s  "
+                f"build={build:.2f} s  reopen+first query={reopen * 1000:.1f} ms"
+            )
+
+            remote_url = f"{fsv.VECTOR_STORE_URL}/{fsv.VECTOR_STORE_ID}"
+            cached_store = LocalVectorStore(os.path.join(tmp, "store"), fs.OpenAIEmbeddingBackend())
+            for q in queries:
+                cached_store.query({"queries": [{"query": q, "top_k": 5}]})
+            query_vecs = [fake_embedding(q, args.dim) for q in queries]
+
+            def payload(q):
+                return {"queries": [{"query": q, "top_k": 5}]}
+
+            runs = [
+                ("remote", lambda i: oc.post_json(remote_url, payload(queries[i]))),
+                ("local+embed", lambda i: reopened.query(payload(queries[i]))),
+                ("local+cached", lambda i: cached_store.query(payload(queries[i]))),
+                ("local search", lambda i: reopened.search(query_vecs[i], 5)),
+            ]
+            print(f"{'path':<14}{'p50 ms':>9}{'p99 ms':>9}")
+            for name, run in runs:
+                latencies = []
+                for i in range(len(queries)):
+                    start = time.perf_counter()
+                    run(i)
+                    latencies.append(time.perf_counter() - start)
+                p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+                print(f"{name:<14}{p50:>9.2f}{p99:>9.2f}")
+
+            # 與替身伺服器的排名一致 (同樣的假向量)
+            remote_top = oc.post_json(remote_url, payload(queries[0]))["results"][0]["matches"]
+            local_top = reopened.query(payload(queries[0]))["results"][0]["matches"]
+            same = [m["metadata"]["text"] for m in remote_top] == [m["metadata"]["text"] for m in local_top]
+            print(f"top-5 identical to remote: {same}")
+            for opened in (store, reopened, cached_store):
+                opened.close()
+        finally:
+            server.stop()
+
+
+##############################################################################
+# HTTP 連線：每次請求建立新連線 vs 共用連線池 (OpenAIClient)
+#   - requests.post / openai 0.28：改用 OpenAIClient 之前的呼叫方式
+#   - fresh：OpenAIClient 但每次建立新的 httpx.Client (pooled=False)
+#   - pooled：OpenAIClient 的共用連線池 (同步與非同步)
+#   - --tls 以 openssl 產生自簽憑證，讓替身伺服器以 HTTPS 服務，量測 TLS 交握成本
+##############################################################################
+def _self_signed_cert(directory: str):
+    certfile, keyfile = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-keyout", keyfile, "-out", certfile, "-subj", "/CN=127.0.0.1",
+            "-addext", "subjectAltName=IP:127.0.0.1",
+        ],
+        check=True, capture_output=True,
+    )
+    return certfile, keyfile
+
+
+def bench_http(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        certfile = keyfile = None
+        if args.tls:
+            certfile, keyfile = _self_signed_cert(tmp)
+            os.environ["REQUESTS_CA_BUNDLE"] = certfile  # requests / openai 0.28 信任自簽憑證
+            oc.configure(verify=ssl.create_default_context(cafile=certfile))
+        server = MockOpenAIServer(latency=args.latency, dim=args.dim, certfile=certfile, keyfile=keyfile).start()
+        use_mock_server(server)
+        openai.api_base, openai.api_key = server.url, "sk-mock"
+        url = oc.api_url("embeddings")
+        payload = {"model": "text-embedding-ada-002", "input": ["多路連接頭 MANIFOLD"]}
+
+        def legacy_requests(u, p):
+            response = requests.post(u, headers=oc.auth_headers(), json=p)
+            response.raise_for_status()
+            return response.json()
+
+        def legacy_openai(u, p):
+            return openai.Embedding.create(**p)
+
+        def client(pooled):
+            oc.configure(pooled=pooled)
+            return oc.post_json
+
+        modes = [
+            ("requests.post", lambda: legacy_requests),
+            ("openai 0.28", lambda: legacy_openai),
+            ("fresh", lambda: client(False)),
+            ("pooled", lambda: client(True)),
+        ]
+        print(f"{server.url}  latency={args.latency}s  calls={args.calls}  threads={args.threads}")
+        print(f"{'mode':<16}{'p50 ms':>9}{'p99 ms':>9}{'threads':>9}{'calls/s':>10}")
+        try:
+            for name, setup in modes:
+                call = setup()
+                call(url, payload)  # 暖機 (pooled 會先建立連線)
+                latencies = []
+                for _ in range(args.calls):
+                    start = time.perf_counter()
+                    call(url, payload)
+                    latencies.append(time.perf_counter() - start)
+                p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.threads) as executor:
+                    list(executor.map(lambda _: call(url, payload), range(args.calls)))
+                throughput = args.calls / (time.perf_counter() - start)
+                print(f"{name:<16}{p50:>9.2f}{p99:>9.2f}{args.threads:>9}{throughput:>10.1f}")
+
+            # 非同步：同一個 event loop 內共用 AsyncClient
+            oc.configure(pooled=True)
+
+            async def run_async():
+                try:
+                    await oc.apost_json(url, payload)
+                    start = time.perf_counter()
+                    await asyncio.gather(*(oc.apost_json(url, payload) for _ in range(args.calls)))
+                    return args.calls / (time.perf_counter() - start)
+                finally:
+                    await oc.aclose()
+
+            print(f"{'pooled async':<16}{'':>9}{'':>9}{oc.MAX_CONCURRENCY:>9}{asyncio.run(run_async()):>10.1f}")
+        finally:
+            server.stop()
+            oc.configure(pooled=True, verify=True)
+            os.environ.pop("REQUESTS_CA_BUNDLE", None)
+
+
+##############################################################################
+# 完整流程量測：各階段與 Assistant_api.main，全部對本機替身伺服器執行
+#   - 合成 PDF (純 ASCII 文字，不需字型) 與查詢，規模由 --pdfs / --pages 控制
+#   - 每個階段記錄：耗時、吞吐量、單次操作延遲百分位數、峰值記憶體 (本行程的 RSS
+#     高水位；PDF 解析的子行程不計)、對替身伺服器的請求數與 429 次數
+#   - 結果以一行 JSON 附加到 --output，方便比較不同版本
+##############################################################################
+_PDF_WORDS = [
+    "MANIFOLD", "STOPCOCK", "CATHETER", "BALLOON", "STENT", "HIP CUP", "INSERT", "SCREW",
+    "ACM01", "ACP01", "CBP02", "FBHS1", "TKP05", "port", "pressure", "psi", "sterile", "single use",
+]
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_synthetic_pdf(path: str, pages: List[List[str]]) -> None:
+    """寫出最小的 PDF：每頁為多行 Helvetica 文字 (PyPDF2 可直接擷取)。"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        text = " ".join(f"({_pdf_escape(line)}) '" for line in lines)
+        stream = f"BT /F1 9 Tf 11 TL 40 800 Td {text} ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        " ".join(f"{k} 0 R" for k in kids).encode("ascii"), len(kids)
+    )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def synthetic_corpus(folder: str, pdfs: int, pages: int, lines: int = 60, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(pdfs):
+        content = [
+            [" ".join(rng.choice(_PDF_WORDS) for _ in range(12)) + f" {i}-{p}-{l}" for l in range(lines)]
+            for p in range(pages)
+        ]
+        path = os.path.join(folder, f"synthetic_{i:04d}.pdf")
+        write_synthetic_pdf(path, content)
+        paths.append(path)
+    return paths
+
+
+@contextlib.contextmanager
+def isolated_caches(directory: str):
+    """暫時以 directory 下的空快取取代預設的 embedding / completion 快取。"""
+    saved = (EmbeddingCache._default_cache, CompletionCache._default_cache)
+    EmbeddingCache._default_cache = EmbeddingCache.EmbeddingCache(os.path.join(directory, "embeddings.sqlite"))
+    CompletionCache._default_cache = CompletionCache.CompletionCache(os.path.join(directory, "completions.sqlite"))
+    try:
+        yield
+    finally:
+        EmbeddingCache._default_cache.close()
+        CompletionCache._default_cache.close()
+        EmbeddingCache._default_cache, CompletionCache._default_cache = saved
+
+
+def _reset_peak_rss() -> None:
+    """Linux 可重設 RSS 高水位，讓每個階段分別量測；其他平台為整個行程的峰值。"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        return None
+
+
+class _Stage:
+    def __init__(self, name: str, server: MockOpenAIServer):
+        self.name = name
+        self.server = server
+        self.ops = 0
+        self.errors = 0
+        self.latencies: List[float] = []
+
+    def time(self, func, *args, **kwargs):
+        """執行一次操作並記錄延遲；失敗 (例如沒有重試的 429) 只計數，不中斷量測。"""
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.errors += 1
+            result = None
+        self.latencies.append(time.perf_counter() - start)
+        self.ops += 1
+        return result
+
+    def __enter__(self) -> "_Stage":
+        self._requests = self.server.request_count
+        self._limited = self.server.rate_limited_count
+        _reset_peak_rss()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.seconds = time.perf_counter() - self._start
+        self.requests = self.server.request_count - self._requests
+        self.rate_limited = self.server.rate_limited_count - self._limited
+        self.peak_mb = _peak_rss_mb()
+
+    def result(self) -> dict:
+        result = {
+            "stage": self.name,
+            "ops": self.ops,
+            "seconds": round(self.seconds, 4),
+            "ops_per_s": round(self.ops / self.seconds, 2) if self.seconds else None,
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+            "errors": self.errors,
+            "peak_mb": round(self.peak_mb, 1) if self.peak_mb is not None else None,
+        }
+        if self.latencies:
+            p50, p95, p99 = np.percentile(self.latencies, [50, 95, 99]) * 1000
+            result.update(p50_ms=round(p50, 2), p95_ms=round(p95, 2), p99_ms=round(p99, 2))
+        return result
+
+
+def bench_suite(args) -> None:
+    workdir = tempfile.mkdtemp(prefix="bench_suite_")
+    rng = random.Random(args.seed)
+    queries = [" ".join(rng.choice(_PDF_WORDS) for _ in range(4)) for _ in range(args.queries)]
+    keywords = [f"{rng.choice(_WORDS)}{i}" for i in range(args.keywords)]
+    csv_file = os.path.join(workdir, os.path.basename(args.csv))
+    shutil.copy(args.csv, csv_file)
+
+    server = MockOpenAIServer(latency=args.latency, error_rate=args.error_rate, dim=args.dim, seed=args.seed).start()
+    use_mock_server(server)
+    stages = []
+    if args.telemetry:
+        tm.enable(args.telemetry)
+
+    def stage(name):
+        stages.append(_Stage(name, server))
+        return stages[-1]
+
+    quiet = contextlib.redirect_stdout(io.StringIO())
+    try:
+        with isolated_caches(workdir), quiet:
+            pdf_folder = os.path.join(workdir, "pdfs")
+            pdf_paths = synthetic_corpus(pdf_folder, args.pdfs, args.pages, seed=args.seed)
+
+            texts = []
+            with stage("extract") as s:
+                for _, chunks, seconds in fs.iter_pdf_chunks_parallel(pdf_paths, max_workers=args.workers):
+                    texts.extend(chunk.text for chunk in chunks)
+                    s.latencies.append(seconds)
+                    s.ops += 1
+
+            with stage("embed") as s:
+                embedded = fs.get_embeddings_for_chunks(texts, use_cache=False)
+                s.ops = len(texts)
+            index = EmbeddingIndex.from_embedded_chunks(embedded)
+            server.set_documents(texts[: args.vector_store_docs])
+
+            top_chunks = {}
+            with stage("search") as s:
+                for query in queries:
+                    top_chunks[query] = s.time(
+                        fs.search_relevant_chunks, query, index, top_k=20, use_cache=False, with_metadata=True
+                    ) or []
+
+            with stage("answer") as s:
+                for query in queries[: args.answers]:
+                    s.time(fs.answer_with_context, query, top_chunks[query], use_cache=False)
+
+            with stage("vector_store") as s:
+                for query in queries[: args.answers]:
+                    s.time(fsv.search_similar_keywords, query.split(), use_cache=False)
+
+            with stage("analyze_products") as s:
+                sp.analyze_products(
+                    csv_file, "sk-mock", keywords, concurrency=args.concurrency,
+                    tpm_limit=10_000_000, use_cache=False,
+                )
+                s.ops = len(keywords)
+
+            os.environ.update({
+                "OPENAI_API_KEY": "sk-mock",
+                "SimilarProduct_JSON_PATH": os.path.join(workdir, "SimilarProduct_Output.json"),
+                "PDFfloder_PATH": pdf_folder,
+            })
+            # 第一次為冷啟動 (空快取、空索引)，第二次所有結果都來自快取與既有索引
+            for name in ("full_cold", "full_warm"):
+                with stage(name) as s:
+                    s.time(
+                        Assistant_api.main, csv_file, keywords,
+                        output_txt=os.path.join(workdir, "final_answer.txt"),
+                        store_dir=os.path.join(workdir, "pdf_index"),
+                    )
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = [s.result() for s in stages]
+    columns = ["stage", "ops", "seconds", "ops_per_s", "p50_ms", "p95_ms", "p99_ms", "peak_mb", "requests", "rate_limited", "errors"]
+    print(f"pdfs={args.pdfs} pages={args.pages} chunks={len(texts)} latency={args.latency}s error_rate={args.error_rate}")
+    print("".join(f"{c:>14}" for c in columns))
+    for result in results:
+        print("".join(f"{str(result.get(c, '-')):>14}" for c in columns))
+
+    params = {k: v for k, v in vars(args).items() if k != "func"}
+    record = {"timestamp": datetime.datetime.now().isoformat(timespec="seconds"), "params": params, "stages": results}
+    with open(args.output, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    print(f"結果已附加至 {args.output}")
+    tm.print_summary()
+
+
+##############################################################################
+# analyze_products 的結果紀錄與續跑
+#   - 子行程執行到第 --kill-after 個關鍵字寫入紀錄後強制結束 (模擬當機)，
+#     再以 resume=True 續跑，比較兩次送到替身伺服器的請求數
+#   - 另外量測每筆紀錄的寫入成本 (fsync 開 / 關)，以及 follow() 讀到第一個結果的時間
+##############################################################################
+_ANALYZE_SNIPPET = """
+import sys, json
+import SimilarProduct as sp
+sp.analyze_products(sys.argv[1], None, json.loads(sys.argv[2]), use_cache=False, log_path=sys.argv[3])
+"""
+
+
+def bench_checkpoint(args) -> None:
+    workdir = tempfile.mkdtemp(prefix="bench_checkpoint_")
+    csv_file = os.path.join(workdir, os.path.basename(args.csv))
+    shutil.copy(args.csv, csv_file)
+    log_path = os.path.join(workdir, "SimilarProduct_Output.jsonl")
+    keywords = [f"{_WORDS[i % len(_WORDS)]}{i}" for i in range(args.keywords)]
+    server = MockOpenAIServer(latency=args.latency).start()
+    use_mock_server(server)
+    env = dict(os.environ, CACHE_DIR=os.path.join(workdir, "cache"), OPENAI_API_BASE=server.url, OPENAI_API_KEY="sk-mock")
+    quiet = contextlib.redirect_stdout(io.StringIO())
+    try:
+        # 1. 執行到一半強制結束
+        proc = subprocess.Popen(
+            [sys.executable, "-c", _ANALYZE_SNIPPET, csv_file, json.dumps(keywords, ensure_ascii=False), log_path],
+            env=env, cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL,
+        )
+        while sum(r["type"] == "result" for r in read_records(log_path)) < args.kill_after and proc.poll() is None:
+            time.sleep(0.005)
+        proc.kill()
+        proc.wait()
+        time.sleep(args.latency + 0.1)  # 等待被中斷的那個請求在伺服器端計數完成
+        first_requests = server.request_count
+        logged = sum(r["type"] == "result" for r in read_records(log_path))
+
+        # 2. 續跑：只對紀錄中沒有的關鍵字呼叫 API
+        start = time.perf_counter()
+        with quiet:
+            results = sp.analyze_products(csv_file, None, keywords, use_cache=False, resume=True)
+        resume_seconds = time.perf_counter() - start
+        resume_requests = server.request_count - first_requests
+        ok = sum("error" not in r for r in results.values())
+        with open(os.path.join(workdir, "SimilarProduct_Output.json"), "r", encoding="utf-8") as f:
+            consolidated = json.load(f)
+
+        print(f"keywords={args.keywords} latency={args.latency}s")
+        print(f"killed run: {first_requests} requests, {logged} results in log")
+        print(f"resumed run: {resume_requests} requests ({resume_seconds:.2f} s), "
+              f"{ok}/{len(keywords)} ok, consolidated JSON has {len(consolidated)} keywords")
+        print(f"without the log a rerun would need {len(keywords)} requests")
+
+        # 3. follow()：背景執行時讀取端看到第一個與最後一個結果的時間
+        run_id = new_run_id()
+        arrivals = []
+        with quiet:
+            start = time.perf_counter()
+            worker = threading.Thread(
+                target=sp.analyze_products, args=(csv_file, None, keywords),
+                kwargs={"use_cache": False, "run_id": run_id, "write_output": False, "log_path": log_path},
+            )
+            worker.start()
+            for _ in follow(log_path, run_id, is_running=worker.is_alive):
+                arrivals.append(time.perf_counter() - start)
+            worker.join()
+        print(f"follow(): first result after {arrivals[0] * 1000:.0f} ms, "
+              f"last after {arrivals[-1] * 1000:.0f} ms ({len(arrivals)} results)")
+
+        # 4. 每筆紀錄的寫入成本
+        response = next(iter(results.values()))
+        for fsync in (False, True):
+            log = ResultLog(os.path.join(workdir, f"append_{fsync}.jsonl"), fsync=fsync)
+            start = time.perf_counter()
+            for i in range(args.appends):
+                log.append("bench", f"k{i}", "key", response)
+            per_append = (time.perf_counter() - start) * 1000 / args.appends
+            print(f"append (fsync={fsync}): {per_append:.3f} ms/record")
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+##############################################################################
+# 常駐查詢服務：每個問題啟動一個新行程 (冷啟動) vs 對 QueryDaemon 發送請求
+#   - 兩者都先以同一份 PDF 索引暖機 (不計時)，冷啟動仍需載入模組、CSV 與索引
+#   - 兩組問題使用不同的關鍵字，避免 completion 快取讓後者佔便宜
+#   - 最後新增一個 PDF，量測服務偵測到變動並切換到新索引所需的時間
+##############################################################################
+_DAEMON_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "QueryDaemon.py")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _latency_row(name: str, samples: List[float], seconds: float) -> str:
+    p50, p99 = np.percentile(samples, [50, 99]) * 1000
+    return f"{name:<26}{len(samples):>6}{p50:>11.1f}{p99:>11.1f}{len(samples) / seconds:>11.2f}"
+
+
+def bench_daemon(args) -> None:
+    workdir = tempfile.mkdtemp(prefix="bench_daemon_")
+    rng = random.Random(args.seed)
+    questions = [
+        [f"{rng.choice(_WORDS)}{i}-{j}" for j in range(args.keywords)] for i in range(args.questions * 3 + 1)
+    ]
+    cold_questions = questions[1:args.questions + 1]
+    daemon_questions = questions[args.questions + 1:]
+    csv_file = os.path.join(workdir, os.path.basename(args.csv))
+    shutil.copy(args.csv, csv_file)
+    pdf_folder = os.path.join(workdir, "pdfs")
+    synthetic_corpus(pdf_folder, args.pdfs, args.pages, seed=args.seed)
+
+    server = MockOpenAIServer(latency=args.latency, dim=args.dim, seed=args.seed).start()
+    port = _free_port()
+    env = dict(
+        os.environ, CACHE_DIR=os.path.join(workdir, "cache"), OPENAI_API_BASE=server.url, OPENAI_API_KEY="sk-mock",
+    )
+    common = [
+        "--env", os.path.join(workdir, ".env"), "--url", f"http://127.0.0.1:{port}",
+    ]
+    data = ["--csv", csv_file, "--pdf-folder", pdf_folder, "--store-dir", os.path.join(workdir, "pdf_index")]
+
+    def run_local(keywords):
+        subprocess.run(
+            [sys.executable, _DAEMON_SCRIPT, *common, "ask", "--local", *data, *keywords],
+            env=env, check=True, stdout=subprocess.DEVNULL,
+        )
+
+    daemon = None
+    try:
+        print(f"pdfs={args.pdfs} pages={args.pages} keywords/question={args.keywords} latency={args.latency}s")
+        run_local(questions[0])  # 建立 PDF 索引 (不計時)
+
+        cold = []
+        start = time.perf_counter()
+        for keywords in cold_questions:
+            t0 = time.perf_counter()
+            run_local(keywords)
+            cold.append(time.perf_counter() - t0)
+        cold_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        daemon = subprocess.Popen(
+            [sys.executable, _DAEMON_SCRIPT, *common, "serve", *data, "--port", str(port),
+             "--reload-interval", str(args.reload_interval)],
+            env=env, stdout=subprocess.DEVNULL,
+        )
+        client = DaemonClient(f"http://127.0.0.1:{port}")
+        while not client.is_running():
+            if daemon.poll() is not None:
+                raise RuntimeError("QueryDaemon 啟動失敗")
+            time.sleep(0.05)
+        startup = time.perf_counter() - start
+
+        sequential = []
+        start = time.perf_counter()
+        for keywords in daemon_questions[:args.questions]:
+            t0 = time.perf_counter()
+            client.ask(keywords)
+            sequential.append(time.perf_counter() - t0)
+        sequential_seconds = time.perf_counter() - start
+
+        def ask_with_own_client(batch):
+            own = DaemonClient(client.url)
+            latencies = []
+            for keywords in batch:
+                t0 = time.perf_counter()
+                own.ask(keywords)
+                latencies.append(time.perf_counter() - t0)
+            own.close()
+            return latencies
+
+        concurrent_questions = daemon_questions[args.questions:]
+        batches = [concurrent_questions[i::args.clients] for i in range(args.clients)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.clients) as pool:
+            concurrent = [t for latencies in pool.map(ask_with_own_client, batches) for t in latencies]
+        concurrent_seconds = time.perf_counter() - start
+
+        print(f"{'path':<26}{'asks':>6}{'p50_ms':>11}{'p99_ms':>11}{'asks/s':>11}")
+        print(_latency_row("new process per question", cold, cold_seconds))
+        print(_latency_row("daemon sequential", sequential, sequential_seconds))
+        print(_latency_row(f"daemon {args.clients} clients", concurrent, concurrent_seconds))
+        print(f"daemon startup (load CSV + index): {startup:.2f} s")
+        status = client.status()
+        for route, stats in status["latency"].items():
+            print(f"daemon-side {route}: count={stats['count']} p50={stats['p50_ms']} ms p99={stats['p99_ms']} ms")
+
+        chunks_before = status["chunks"]
+        write_synthetic_pdf(
+            os.path.join(pdf_folder, "added.pdf"), [[f"HIP CUP INSERT added-{l}" for l in range(60)]]
+        )
+        start = time.perf_counter()
+        while client.status()["reloads"] == status["reloads"]:
+            time.sleep(0.02)
+        status = client.status()
+        print(
+            f"hot reload after adding a PDF: {time.perf_counter() - start:.2f} s "
+            f"(interval {args.reload_interval} s, chunks {chunks_before} -> {status['chunks']})"
+        )
+        client.close()
+    finally:
+        if daemon is not None:
+            daemon.terminate()
+            daemon.wait()
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AssitantAPP 效能量測 (離線)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("embeddings", help="get_embeddings_for_chunks 吞吐量")
+    p.add_argument("--chunks", type=int, default=500)
+    p.add_argument("--latency", type=float, default=0.02)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument("--dim", type=int, default=1536)
+    p.add_argument("--batch-size", type=int, default=fs.EMBED_BATCH_SIZE)
+    p.add_argument("--workers", type=int, default=fs.EMBED_MAX_WORKERS)
+    p.add_argument("--skip-sequential", action="store_true")
+    p.set_defaults(func=bench_embeddings)
+
+    p = sub.add_parser("index", help="EmbeddingIndex 查詢延遲 (1M x 1536 約需 6 GB 記憶體)")
+    p.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    p.add_argument("--dim", type=int, default=1536)
+    p.add_argument("--top-k", type=int, default=20)
+    p.add_argument("--batch", type=int, default=32)
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--loop-max", type=int, default=100_000, help="超過此筆數不量測舊的迴圈版本")
+    p.set_defaults(func=bench_index)
+
+    p = sub.add_parser("quantized", help="float16 / int8 / PQ 索引的記憶體與 recall@k")
+    p.add_argument("--chunks", type=int, default=100_000)
+    p.add_argument("--dim", type=int, default=1536)
+    p.add_argument("--chunk-size", type=int, default=800)
+    p.add_argument("--top-k", type=int, default=20)
+    p.add_argument("--queries", type=int, default=100)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_quantized)
+
+    p = sub.add_parser("extract", help="平行 PDF 解析速度")
+    p.add_argument("--folder", default=DEFAULT_PDF_FOLDER)
+    p.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    p.set_defaults(func=bench_extract)
+
+    p = sub.add_parser("chat", help="analyze_products 並行吞吐量")
+    p.add_argument("--csv", default=DEFAULT_CSV)
+    p.add_argument("--keywords", type=int, default=30)
+    p.add_argument("--latency", type=float, default=0.3)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16])
+    p.add_argument("--rpm", type=float, default=sp.DEFAULT_RPM_LIMIT)
+    p.add_argument("--tpm", type=float, default=10_000_000)
+    p.set_defaults(func=bench_chat)
+
+    p = sub.add_parser("years", help="關鍵字出現年度查詢速度")
+    p.add_argument("--csv", default=DEFAULT_SURVEY_CSV)
+    p.add_argument("--keywords", type=int, default=300)
+    p.add_argument("--scan-sample", type=int, default=20, help="舊方法只量測前 N 個關鍵字再推估")
+    p.set_defaults(func=bench_years)
+
+    p = sub.add_parser("startup", help="GUI 啟動時的資料載入時間 (冷啟動 / 熱啟動)")
+    p.add_argument("--csv", default=DEFAULT_SURVEY_CSV)
+    p.add_argument("--scale", type=int, nargs="+", default=[1, 10, 50], help="將資料複製 N 倍模擬較大的檔案")
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser("stats", help="支付點數統計：逐次過濾 vs 預先計算")
+    p.add_argument("--csv", default=DEFAULT_SURVEY_CSV)
+    p.add_argument("--scale", type=int, nargs="+", default=[1, 10])
+    p.set_defaults(func=bench_stats)
+
+    p = sub.add_parser("search", help="GUI 搜尋框索引建立與查詢延遲")
+    p.add_argument("--csv", default=DEFAULT_SURVEY_CSV)
+    p.add_argument("--scale", type=int, nargs="+", default=[1, 10])
+    p.add_argument("--queries", type=int, default=200)
+    p.set_defaults(func=bench_search)
+
+    p = sub.add_parser("retrieval", help="代碼查詢：dense / lexical / hybrid 延遲與命中率")
+    p.add_argument("--chunks", type=int, default=5000)
+    p.add_argument("--queries", type=int, default=100)
+    p.add_argument("--latency", type=float, default=0.02)
+    p.add_argument("--dim", type=int, default=1536)
+    p.set_defaults(func=bench_retrieval)
+
+    p = sub.add_parser("multiquery", help="合併單一查詢 vs 多查詢 RRF 檢索")
+    p.add_argument("--chunks", type=int, default=5000)
+    p.add_argument("--queries", type=int, default=300)
+    p.add_argument("--top-k", type=int, default=20)
+    p.add_argument("--latency", type=float, default=0.02)
+    p.add_argument("--dim", type=int, default=1536)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_multiquery)
+
+    p = sub.add_parser("vectorstore", help="遠端 vector store vs 本機 LocalVectorStore 查詢延遲")
+    p.add_argument("--docs", type=int, default=20_000)
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--latency", type=float, default=0.05)
+    p.add_argument("--dim", type=int, default=1536)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_vectorstore)
+
+    p = sub.add_parser("http", help="每次新連線 vs 共用連線池的單次請求延遲")
+    p.add_argument("--calls", type=int, default=200)
+    p.add_argument("--threads", type=int, default=8)
+    p.add_argument("--latency", type=float, default=0.0)
+    p.add_argument("--dim", type=int, default=1536)
+    p.add_argument("--tls", action="store_true", help="以自簽憑證的 HTTPS 連線量測 (需要 openssl)")
+    p.set_defaults(func=bench_http)
+
+    p = sub.add_parser("daemon", help="每個問題一個新行程 vs 常駐查詢服務的延遲")
+    p.add_argument("--questions", type=int, default=20)
+    p.add_argument("--keywords", type=int, default=3, help="每個問題的關鍵字數")
+    p.add_argument("--clients", type=int, default=4)
+    p.add_argument("--pdfs", type=int, default=20)
+    p.add_argument("--pages", type=int, default=10)
+    p.add_argument("--latency", type=float, default=0.05)
+    p.add_argument("--reload-interval", type=float, default=0.5)
+    p.add_argument("--dim", type=int, default=1536)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--csv", default=DEFAULT_CSV)
+    p.set_defaults(func=bench_daemon)
+
+    p = sub.add_parser("checkpoint", help="analyze_products 中斷後以結果紀錄續跑")
+    p.add_argument("--keywords", type=int, default=50)
+    p.add_argument("--kill-after", type=int, default=40)
+    p.add_argument("--latency", type=float, default=0.05)
+    p.add_argument("--appends", type=int, default=500)
+    p.add_argument("--csv", default=DEFAULT_CSV)
+    p.set_defaults(func=bench_checkpoint)
+
+    p = sub.add_parser("suite", help="各階段與 Assistant_api.main 完整流程 (替身伺服器)")
+    p.add_argument("--pdfs", type=int, default=20)
+    p.add_argument("--pages", type=int, default=10)
+    p.add_argument("--queries", type=int, default=50)
+    p.add_argument("--answers", type=int, default=10, help="answer / vector_store 階段的查詢數")
+    p.add_argument("--keywords", type=int, default=10)
+    p.add_argument("--vector-store-docs", type=int, default=2000)
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--workers", type=int, default=None, help="PDF 解析行程數")
+    p.add_argument("--latency", type=float, default=0.05)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument("--dim", type=int, default=1536)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--csv", default=DEFAULT_CSV)
+    p.add_argument("--output", default="benchmark_results.jsonl")
+    p.add_argument("--telemetry", default=None, help="同時以 Telemetry 記錄到此 JSON lines 檔")
+    p.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
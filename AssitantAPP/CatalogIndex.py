@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Tuple
+
+##############################################################################
+# 價量調查資料的查詢索引 (供 assitant_UI_02 使用)
+#   - 特材代碼前五碼 / 核價類別名稱 轉為 categorical 欄位
+#   - 載入時一次建立：五碼 → 核價類別清單、(五碼, 核價類別) → 列位置
+#   - 下拉選單切換與查詢只取對應的列，不需對整張表建立布林遮罩
+##############################################################################
+CODE_COLUMN = "特材代碼前五碼"
+CATEGORY_COLUMN = "核價類別名稱"
+
+
+class CatalogIndex:
+    def __init__(self, df: pd.DataFrame):
+        df = df.copy()
+        df[CODE_COLUMN] = df[CODE_COLUMN].astype(str).astype("category")
+        df[CATEGORY_COLUMN] = df[CATEGORY_COLUMN].astype("category")
+        self.data = df
+
+        groups = df.groupby([CODE_COLUMN, CATEGORY_COLUMN], observed=True, sort=True).indices
+        self._rows: Dict[Tuple[str, str], np.ndarray] = {key: rows for key, rows in groups.items()}
+
+        categories: Dict[str, List[str]] = {}
+        for code, category in self._rows:
+            categories.setdefault(code, []).append(category)
+        self._categories = {code: sorted(values) for code, values in categories.items()}
+        self.codes = sorted(df[CODE_COLUMN].cat.categories)
+
+    def categories(self, code: str) -> List[str]:
+        """回傳該五碼下所有核價類別 (已排序)。"""
+        return self._categories.get(code, [])
+
+    def positions(self, code: str, category: str) -> np.ndarray:
+        return self._rows.get((code, category), np.empty(0, dtype=np.intp))
+
+    def rows(self, code: str, category: str) -> pd.DataFrame:
+        """回傳符合 (五碼, 核價類別) 的資料列，維持原始順序。"""
+        return self.data.iloc[self.positions(code, category)]
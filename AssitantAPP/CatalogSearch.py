@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+from typing import List, Sequence
+
+from NgramIndex import NgramIndex
+
+##############################################################################
+# 價量調查資料的即時搜尋 (供 assitant_UI_02 的搜尋框使用)
+#   - 將每列的 中英文品名 / 產品型號/規格 / 申請者簡稱 / 許可證字號 合併成一份文件
+#   - 相同內容的列只建一份文件，以字元 n-gram 倒排索引 (NgramIndex) 計分
+#   - n-gram 比對可容許少數錯字；輸入每一個字都可以重新查詢
+##############################################################################
+SEARCH_COLUMNS = ["中英文品名", "產品型號/規格", "申請者簡稱", "許可證字號"]
+
+
+class CatalogSearch:
+    def __init__(self, df: pd.DataFrame, columns: Sequence[str] = SEARCH_COLUMNS):
+        self.data = df
+        self.columns = [c for c in columns if c in df.columns]
+        parts = [df[c].astype("string").fillna("") for c in self.columns]
+        texts = parts[0].str.cat(parts[1:], sep=" ")
+        # doc_ids[i] 為第 i 列對應的文件；first_rows[d] 為文件 d 第一次出現的列
+        doc_ids, docs = pd.factorize(texts, sort=False)
+        self.doc_ids = doc_ids
+        self.first_rows = np.unique(doc_ids, return_index=True)[1]
+        self.index = NgramIndex(list(docs))
+
+    def search_positions(self, query: str, top_n: int = 20) -> List[tuple]:
+        """回傳 [(列位置, 分數)]，由高到低。"""
+        if not query.strip():
+            return []
+        return [(int(self.first_rows[doc]), score) for doc, score in self.index.search(query, top_n)]
+
+    def search(self, query: str, top_n: int = 20) -> pd.DataFrame:
+        """回傳最相符的 top_n 列 (多一個「分數」欄)。"""
+        hits = self.search_positions(query, top_n)
+        rows = self.data.iloc[[pos for pos, _ in hits]].copy()
+        rows["分數"] = [score for _, score in hits]
+        return rows
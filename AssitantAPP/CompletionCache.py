@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from typing import Optional
+
+from EmbeddingCache import CACHE_DIR
+
+##############################################################################
+# Chat completion 回應快取 (多個行程可共用同一個快取目錄)
+#   - 鍵：(model, messages, temperature, response_format) 的 SHA-256
+#   - 值：zlib 壓縮後的完整 JSON 回應
+#   - 超過 ttl 秒的項目視為過期；超過 max_bytes 時依最後使用時間 (LRU) 淘汰
+#   - SQLite WAL 模式 + busy timeout，讓多個行程可同時讀寫
+##############################################################################
+DEFAULT_CACHE_PATH = os.path.join(CACHE_DIR, "completions.sqlite")
+DEFAULT_TTL = 7 * 24 * 3600  # 7 天
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def completion_key(request: dict) -> str:
+    """由請求內容中會影響回覆的欄位計算快取鍵。"""
+    material = {
+        "model": request.get("model"),
+        "messages": request.get("messages"),
+        "temperature": request.get("temperature"),
+        "response_format": request.get("response_format"),
+    }
+    encoded = json.dumps(material, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """
+    get(request) / put(request, response) 以 chat completion 的請求內容為鍵。
+    hits / misses 記錄本行程的命中次數，可用 stats() 取得。
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl: float = DEFAULT_TTL, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS completions (
+                key        TEXT PRIMARY KEY,
+                model      TEXT,
+                response   BLOB NOT NULL,
+                created    REAL NOT NULL,
+                last_used  REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_completions_last_used ON completions(last_used)")
+
+    def get(self, request: dict) -> Optional[dict]:
+        key = completion_key(request)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE completions SET last_used = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def put(self, request: dict, response: dict) -> None:
+        blob = zlib.compress(json.dumps(response, ensure_ascii=False).encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, model, response, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (completion_key(request), request.get("model"), blob, now, now),
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        """刪除過期項目；總大小仍超過上限時，刪除最久未使用的項目直到低於上限的 90%。"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = self._conn.execute("DELETE FROM completions WHERE created < ?", (time.time() - self.ttl,))
+            self.evictions += cursor.rowcount
+            total = self._conn.execute("SELECT COALESCE(SUM(LENGTH(response)), 0) FROM completions").fetchone()[0]
+            if total > self.max_bytes:
+                target = int(self.max_bytes * 0.9)
+                victims = []
+                for key, size in self._conn.execute(
+                    "SELECT key, LENGTH(response) FROM completions ORDER BY last_used ASC"
+                ).fetchall():
+                    if total <= target:
+                        break
+                    victims.append((key,))
+                    total -= size
+                self._conn.executemany("DELETE FROM completions WHERE key = ?", victims)
+                self.evictions += len(victims)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(response)), 0) FROM completions"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM completions")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_default_cache: Optional[CompletionCache] = None
+
+
+def get_default_cache() -> CompletionCache:
+    """回傳全程式共用的預設快取 (延遲建立)。"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = CompletionCache()
+    return _default_cache
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Chat completion 快取統計")
+    parser.add_argument("--clear", action="store_true", help="清除所有快取項目")
+    args = parser.parse_args()
+
+    cache = get_default_cache()
+    if args.clear:
+        cache.clear()
+    for k, v in cache.stats().items():
+        print(f"{k}: {v}")
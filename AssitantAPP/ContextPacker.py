@@ -0,0 +1,159 @@
+from typing import Dict, List, Optional, Tuple, Union
+
+from NgramIndex import char_ngrams
+from TokenCounter import count_tokens
+
+##############################################################################
+# 上下文組裝 (answer_with_context 送出前)
+#   1. 合併同一份文件中相鄰 / 重疊的 chunk (pdf_to_chunks 預設重疊 100 字元)
+#      - 依 metadata 的 file / offset 判斷；重疊部分必須與文字內容一致才合併
+#      - 合併後分數取最高者，頁碼取聯集
+#      - 合併後超過 token 預算就不再往後接，從下一個 chunk 開始新的一段
+#        (避免相關度最高的一長串相鄰 chunk 整段放不下而被略過)
+#   2. 近似重複的 chunk (字元 3-gram Jaccard >= dedup_threshold) 只保留分數高者
+#   3. MMR：每次選出 lambda * 相關度 - (1 - lambda) * 與已選內容最大相似度 最高者
+#   4. 依上述順序放入，直到超過 token 預算 (放不下的 chunk 略過，改試下一個；
+#      排在第一位的 chunk 本身就超過預算時截斷到預算內，不會整段略過)
+##############################################################################
+DEFAULT_MMR_LAMBDA = 0.7
+DEFAULT_DEDUP_THRESHOLD = 0.8
+SIMILARITY_NGRAM = 3
+
+Chunk = Union[str, dict]
+
+
+def _as_record(rank: int, chunk: Chunk, total: int) -> dict:
+    """統一轉成字典；沒有分數時以名次換算 (第一名為 1)。"""
+    record = dict(chunk) if isinstance(chunk, dict) else {"text": chunk}
+    record.setdefault("score", 1.0 - rank / max(total, 1))
+    return record
+
+
+def _truncate(text: str, max_tokens: int, model: Optional[str]) -> str:
+    """保留開頭、不超過 max_tokens 的最長前綴 (以二分搜尋字元數)。"""
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle], model) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low]
+
+
+def merge_adjacent(
+    records: List[dict],
+    max_tokens: Optional[int] = None,
+    model: Optional[str] = "gpt-4o",
+) -> List[dict]:
+    """
+    合併同一檔案中相鄰或重疊的 chunk，回傳依分數由高到低排序的列表。
+    max_tokens 有值時，合併後超過 max_tokens 的 chunk 不再接上，改從它開始新的一段。
+    """
+    by_file: Dict[str, List[dict]] = {}
+    merged = []
+    for record in records:
+        if "offset" in record and "file" in record:
+            by_file.setdefault(record["file"], []).append(record)
+        else:
+            merged.append(record)
+
+    for file_records in by_file.values():
+        file_records.sort(key=lambda r: r["offset"])
+        current = dict(file_records[0])
+        for record in file_records[1:]:
+            overlap = current["offset"] + len(current["text"]) - record["offset"]
+            adjacent = 0 <= overlap <= len(record["text"]) and current["text"].endswith(record["text"][:overlap])
+            if adjacent and max_tokens is not None:
+                adjacent = count_tokens(current["text"] + record["text"][overlap:], model) <= max_tokens
+            if adjacent:
+                current["text"] += record["text"][overlap:]
+                current["score"] = max(current["score"], record["score"])
+                if "page_end" in record:
+                    current["page_end"] = max(current.get("page_end", record["page_end"]), record["page_end"])
+                current["merged"] = current.get("merged", 1) + 1
+            else:
+                merged.append(current)
+                current = dict(record)
+        merged.append(current)
+
+    merged.sort(key=lambda r: r["score"], reverse=True)
+    return merged
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def mmr_order(
+    records: List[dict],
+    mmr_lambda: float = DEFAULT_MMR_LAMBDA,
+    dedup_threshold: float = DEFAULT_DEDUP_THRESHOLD,
+) -> Tuple[List[dict], int]:
+    """回傳 (MMR 排序後的 chunk, 因近似重複而移除的數量)；records 需依分數由高到低排序。"""
+    if not records:
+        return [], 0
+    grams = [frozenset(char_ngrams(r["text"], SIMILARITY_NGRAM, SIMILARITY_NGRAM)) for r in records]
+    scores = [r["score"] for r in records]
+    low, high = min(scores), max(scores)
+    relevance = [(s - low) / (high - low) if high > low else 1.0 for s in scores]
+
+    remaining = list(range(len(records)))
+    max_sim = [0.0] * len(records)
+    ordered, dropped = [], 0
+    while remaining:
+        best = max(remaining, key=lambda i: mmr_lambda * relevance[i] - (1 - mmr_lambda) * max_sim[i])
+        remaining.remove(best)
+        ordered.append(records[best])
+        kept = []
+        for i in remaining:
+            sim = _jaccard(grams[i], grams[best])
+            if sim >= dedup_threshold:
+                dropped += 1
+                continue
+            max_sim[i] = max(max_sim[i], sim)
+            kept.append(i)
+        remaining = kept
+    return ordered, dropped
+
+
+def pack_context(
+    chunks: List[Chunk],
+    max_tokens: int,
+    model: Optional[str] = "gpt-4o",
+    mmr_lambda: float = DEFAULT_MMR_LAMBDA,
+    dedup_threshold: float = DEFAULT_DEDUP_THRESHOLD,
+) -> Tuple[List[dict], dict]:
+    """
+    回傳 (放入上下文的 chunk 字典, 統計)。
+    統計包含 chunks_in / merged / duplicates / chunks_out 與 tokens_in / tokens_out
+    (只計算 chunk 文字的 token，不含標籤與系統提示)。
+    """
+    records = [_as_record(i, chunk, len(chunks)) for i, chunk in enumerate(chunks)]
+    tokens_in = sum(count_tokens(r["text"], model) for r in records)
+
+    merged = merge_adjacent(records, max_tokens, model)
+    ordered, duplicates = mmr_order(merged, mmr_lambda, dedup_threshold)
+
+    packed, tokens_out = [], 0
+    for record in ordered:
+        tokens = count_tokens(record["text"], model)
+        if tokens_out + tokens > max_tokens:
+            if packed or max_tokens <= 0:
+                continue
+            record = dict(record, text=_truncate(record["text"], max_tokens, model), truncated=True)
+            tokens = count_tokens(record["text"], model)
+        packed.append(record)
+        tokens_out += tokens
+
+    stats = {
+        "chunks_in": len(records),
+        "merged": len(records) - len(merged),
+        "duplicates": duplicates,
+        "chunks_out": len(packed),
+        "tokens_in": tokens_in,
+        "tokens_out": tokens_out,
+    }
+    return packed, stats
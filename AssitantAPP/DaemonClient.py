@@ -0,0 +1,64 @@
+import os
+import httpx
+from typing import List, Optional
+
+##############################################################################
+# 常駐查詢服務 (DaemonServer.py，以 python QueryDaemon.py serve 啟動) 的用戶端
+#   - CLI (QueryDaemon.py ask / search / status / reload) 與 GUI 共用
+#   - 只依賴 httpx，不載入產品目錄、PDF 索引等伺服端模組，用戶端行程啟動快
+##############################################################################
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = int(os.getenv("QUERY_DAEMON_PORT", "8765"))
+DEFAULT_URL = f"http://{DEFAULT_HOST}:{DEFAULT_PORT}"
+
+
+class DaemonError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+
+class DaemonClient:
+    """常駐服務的輕量用戶端；同一個實例的請求共用連線 (keep-alive)。"""
+
+    def __init__(self, url: str = DEFAULT_URL, timeout: float = 600.0):
+        self.url = url.rstrip("/")
+        self._client = httpx.Client(timeout=httpx.Timeout(timeout, connect=2.0))
+
+    def _request(self, method: str, path: str, payload: Optional[dict] = None) -> dict:
+        response = self._client.request(method, f"{self.url}{path}", json=payload)
+        try:
+            result = response.json()
+        except ValueError:
+            # 不是本服務的回應 (例如埠被其他程式佔用) 或回應不完整
+            raise DaemonError(response.status_code, response.text[:200] or "回應不是 JSON") from None
+        if not response.is_success:
+            error = result.get("error") if isinstance(result, dict) else None
+            raise DaemonError(response.status_code, error or response.text)
+        return result
+
+    def is_running(self) -> bool:
+        try:
+            self.status()
+            return True
+        except httpx.TransportError:
+            return False
+
+    def status(self) -> dict:
+        return self._request("GET", "/status")
+
+    def reload(self) -> dict:
+        return self._request("POST", "/reload")
+
+    def analyze(self, keywords: List[str], **options) -> dict:
+        return self._request("POST", "/analyze", dict(options, keywords=keywords))["results"]
+
+    def ask(self, keywords: List[str], **options) -> dict:
+        return self._request("POST", "/ask", dict(options, keywords=keywords))
+
+    def search(self, query=None, queries=None, **options) -> List[dict]:
+        payload = dict(options, query=query, queries=queries)
+        return self._request("POST", "/search", payload)["chunks"]
+
+    def close(self) -> None:
+        self._client.close()
@@ -0,0 +1,290 @@
+import os
+import json
+import time
+import asyncio
+import collections
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import Assistant_api
+import FileSearch as fs
+from DaemonClient import DEFAULT_HOST, DEFAULT_PORT
+from EmbeddingIndex import EmbeddingIndex
+from PdfIngest import DEFAULT_STORE_DIR, ingest_folder
+from QuantizedIndex import QuantizedIndex
+from SimilarProduct import ProductCatalog, analyze_products
+
+##############################################################################
+# 常駐查詢服務的伺服端 (產品 CSV 與 PDF 索引只載入一次，之後的問題都在已載入的狀態上回答)
+#   以 python QueryDaemon.py serve 啟動；用戶端見 DaemonClient.py
+#   - asyncio 的 HTTP/1.1 (keep-alive) JSON 介面，只監聽本機
+#   - 會呼叫 API 或做大量運算的處理在執行緒池執行，多個用戶端可同時查詢
+#   - 每 RELOAD_INTERVAL 秒比對 CSV 與 PDF 資料夾 (大小、修改時間)，有變動時在背景
+#     重新載入 (PDF 以 ingest_folder 增量同步，未變動的部分沿用)，完成後一次切換；
+#     切換前進行中的請求繼續使用舊的狀態
+#   - quantization = float16 / int8 / pq：常駐的 PDF 索引改用 QuantizedIndex
+#     (原始向量留在磁碟上、只在重新排序時讀取；讀取的是這次載入專用的 pinned/ 檔案，
+#      熱重載時 ingest_folder 取代 vectors.npy 不影響仍在使用舊狀態的查詢)
+#   - GET /status 回報載入時間、資料筆數與各路徑的 p50 / p99 延遲 (最近 LATENCY_WINDOW 次)
+##############################################################################
+RELOAD_INTERVAL = 5.0
+LATENCY_WINDOW = 1000
+MAX_WORKERS = 8
+
+
+class WarmState(NamedTuple):
+    catalog: ProductCatalog
+    chunk_index: EmbeddingIndex
+    csv_signature: Tuple
+    pdf_signature: Tuple
+    loaded_at: float
+    load_seconds: float
+
+
+def _csv_signature(csv_file: str) -> Tuple:
+    st = os.stat(csv_file)
+    return (st.st_size, st.st_mtime_ns)
+
+
+def _pdf_signature(pdf_folder: str) -> Tuple:
+    entries = []
+    with os.scandir(pdf_folder) as it:
+        for entry in it:
+            if entry.name.lower().endswith(".pdf"):
+                st = entry.stat()
+                entries.append((entry.name, st.st_size, st.st_mtime_ns))
+    return tuple(sorted(entries))
+
+
+def load_state(
+    csv_file: str,
+    pdf_folder: str,
+    store_dir: str = DEFAULT_STORE_DIR,
+    previous: Optional[WarmState] = None,
+    quantization: Optional[str] = None,
+) -> WarmState:
+    """載入產品目錄與 PDF 索引；previous 中未變動的部分直接沿用。quantization 見 QuantizedIndex。"""
+    start = time.perf_counter()
+    if not os.path.isdir(pdf_folder):
+        raise FileNotFoundError(f"找不到 PDF 資料夾：{pdf_folder}")
+    csv_signature = _csv_signature(csv_file)
+    pdf_signature = _pdf_signature(pdf_folder)
+
+    if previous is not None and previous.csv_signature == csv_signature:
+        catalog = previous.catalog
+    else:
+        print(f"載入產品目錄：{csv_file}")
+        catalog = ProductCatalog(csv_file)
+    if previous is not None and previous.pdf_signature == pdf_signature:
+        chunk_index = previous.chunk_index
+    else:
+        print(f"同步 PDF 索引：{pdf_folder}")
+        chunk_index = ingest_folder(pdf_folder, store_dir)
+        if quantization and len(chunk_index):
+            # 向量固定在 pinned/ 下的專用檔案，之後的 ingest_folder 不會改動舊狀態的重新排序
+            chunk_index = QuantizedIndex.load(store_dir, mmap=True, quantization=quantization)
+
+    return WarmState(catalog, chunk_index, csv_signature, pdf_signature, time.time(), time.perf_counter() - start)
+
+
+def _keywords(request: dict) -> List[str]:
+    keywords = request.get("keywords")
+    if isinstance(keywords, str):
+        keywords = keywords.split(",")
+    keywords = [k.strip() for k in keywords or [] if k and k.strip()]
+    if not keywords:
+        raise ValueError("keywords 不可為空")
+    return keywords
+
+
+def analyze(state: WarmState, request: dict) -> dict:
+    """SimilarProduct 分析：{"keywords": [...]} -> {"results": {關鍵字: API 回應}}。"""
+    results = analyze_products(
+        state.catalog.csv_file, None, _keywords(request),
+        concurrency=int(request.get("concurrency", 1)),
+        catalog=state.catalog, write_output=False,
+    )
+    return {"results": results}
+
+
+def ask(state: WarmState, request: dict) -> dict:
+    """與 Assistant_api.main 相同的流程：產品分析 -> PDF 檢索 -> 回答。"""
+    product_data = analyze(state, request)["results"]
+    all_products = Assistant_api.parse_products(product_data)
+    if not all_products:
+        raise ValueError("未能從 SimilarProduct 結果中取得任何產品資訊")
+    if len(state.chunk_index) == 0:
+        raise ValueError("PDF 索引中沒有任何文字區塊")
+    budget = request.get("context_token_budget", Assistant_api.CONTEXT_TOKEN_BUDGET)
+    answer, top_chunks = Assistant_api.answer_from_index(product_data, all_products, state.chunk_index, budget)
+    return {"answer": answer, "products": all_products, "chunks": top_chunks}
+
+
+def search(state: WarmState, request: dict) -> dict:
+    """PDF 檢索：{"query": str} 或 {"queries": [...]} (RRF 合併)，回傳 chunk 字典。"""
+    top_k = int(request.get("top_k", 20))
+    if request.get("queries"):
+        chunks = fs.search_multi_query(request["queries"], state.chunk_index, top_k=top_k, with_metadata=True)
+    elif request.get("query"):
+        chunks = fs.search_relevant_chunks(
+            request["query"], state.chunk_index, top_k=top_k, with_metadata=True,
+            mode=request.get("mode", "dense"), alpha=float(request.get("alpha", 0.5)),
+        )
+    else:
+        raise ValueError("需要 query 或 queries")
+    return {"chunks": chunks}
+
+
+class QueryDaemon:
+    ROUTES = {("POST", "/analyze"): analyze, ("POST", "/ask"): ask, ("POST", "/search"): search}
+
+    def __init__(
+        self,
+        csv_file: str,
+        pdf_folder: str,
+        store_dir: str = DEFAULT_STORE_DIR,
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        reload_interval: float = RELOAD_INTERVAL,
+        max_workers: int = MAX_WORKERS,
+        quantization: Optional[str] = None,
+    ):
+        self.csv_file = csv_file
+        self.pdf_folder = pdf_folder
+        self.store_dir = store_dir
+        self.host = host
+        self.port = port
+        self.reload_interval = reload_interval
+        self.quantization = quantization
+        self.state: Optional[WarmState] = None
+        self.reloads = 0
+        self.latencies: Dict[str, collections.deque] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._reload_lock: Optional[asyncio.Lock] = None
+
+    # ------------------------------------------------------------------
+    # 狀態載入與熱重載
+    # ------------------------------------------------------------------
+    async def reload(self, force: bool = False) -> bool:
+        """CSV 或 PDF 資料夾有變動 (或 force) 時重新載入，回傳是否切換了狀態。"""
+        loop = asyncio.get_running_loop()
+        async with self._reload_lock:
+            previous = self.state
+            if previous is not None and not force:
+                signatures = await loop.run_in_executor(
+                    self._executor, lambda: (_csv_signature(self.csv_file), _pdf_signature(self.pdf_folder))
+                )
+                if signatures == (previous.csv_signature, previous.pdf_signature):
+                    return False
+            self.state = await loop.run_in_executor(
+                self._executor, load_state, self.csv_file, self.pdf_folder, self.store_dir,
+                None if force else previous, self.quantization,
+            )
+            if previous is not None:
+                self.reloads += 1
+            print(
+                f"資料已載入 ({self.state.load_seconds:.2f} 秒)：產品 {len(self.state.catalog.all_products)} 項，"
+                f"chunk {len(self.state.chunk_index)} 個"
+            )
+            return True
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                await self.reload()
+            except Exception as e:
+                print(f"重新載入失敗，繼續使用舊的資料：{e}")
+
+    def status(self) -> dict:
+        state = self.state
+        routes = {}
+        for route, samples in self.latencies.items():
+            p50, p99 = np.percentile(list(samples), [50, 99]) * 1000
+            routes[route] = {"count": len(samples), "p50_ms": round(float(p50), 2), "p99_ms": round(float(p99), 2)}
+        return {
+            "csv_file": self.csv_file,
+            "pdf_folder": self.pdf_folder,
+            "products": len(state.catalog.all_products),
+            "chunks": len(state.chunk_index),
+            "quantization": self.quantization,
+            "loaded_at": state.loaded_at,
+            "load_seconds": round(state.load_seconds, 3),
+            "reloads": self.reloads,
+            "latency": routes,
+        }
+
+    # ------------------------------------------------------------------
+    # HTTP
+    # ------------------------------------------------------------------
+    async def _dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, dict]:
+        try:
+            if (method, path) == ("GET", "/status"):
+                return 200, self.status()
+            if (method, path) == ("POST", "/reload"):
+                return 200, {"reloaded": await self.reload(force=True)}
+            handler = self.ROUTES.get((method, path))
+            if handler is None:
+                return 404, {"error": f"{method} {path} 不存在"}
+            request = json.loads(body or b"{}")
+            state = self.state  # 整個請求使用同一份狀態，不受中途的熱重載影響
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, handler, state, request)
+            return 200, result
+        except (ValueError, TypeError) as e:
+            return 400, {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                body = await reader.readexactly(length) if length else b""
+
+                start = time.perf_counter()
+                path = target.split("?", 1)[0]
+                status, payload = await self._dispatch(method, path, body)
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    "Content-Type: application/json; charset=utf-8\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+                if path != "/status":
+                    self.latencies.setdefault(path, collections.deque(maxlen=LATENCY_WINDOW)).append(
+                        time.perf_counter() - start
+                    )
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self) -> None:
+        self._reload_lock = asyncio.Lock()
+        await self.reload(force=True)
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        watcher = asyncio.create_task(self._watch())
+        print(f"QueryDaemon 已啟動：http://{self.host}:{self.port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+            self._executor.shutdown(wait=False)
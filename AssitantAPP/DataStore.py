@@ -0,0 +1,142 @@
+import os
+import time
+import pickle
+import pandas as pd
+from typing import Iterable, Iterator, Optional
+
+from EmbeddingCache import CACHE_DIR
+
+##############################################################################
+# 價量調查資料的二進位快取
+#   - 第一次讀取 CSV 時依 DTYPES 轉型，並存成 .pkb 檔：
+#       [header dict][DataFrame 區塊 1][DataFrame 區塊 2]...  (皆為 pickle)
+#     每個區塊以欄為單位存放 numpy 陣列，讀取時不需再解析文字與轉型
+#   - header 記錄來源 CSV 的大小與修改時間與 pandas 版本；CSV 變動或 pandas 升級後會自動重建
+#     (其他版本的 pandas 寫入的 pickle 不一定能讀取)，快取損壞或無法讀取時改為重新解析 CSV
+#   - 區塊可逐一寫入，大型資料不需一次放進記憶體 (見 modifyCSV.py)
+#   - modifyCSV.py 輸出的 .pkb 可直接傳給 load_dataset
+##############################################################################
+FORMAT_VERSION = 1
+
+# 明確指定欄位型別：重複度高的文字欄使用 category，年份使用可為空的整數
+DTYPES = {
+    "年份": "Int16",
+    "特材代碼": "string",
+    "特材代碼前五碼": "category",
+    "核價類別名稱": "category",
+    "中英文品名": "string",
+    "產品型號/規格": "string",
+    "單位": "category",
+    "支付點數": "float64",
+    "申請者簡稱": "category",
+    "許可證字號": "string",
+}
+NUMERIC_COLUMNS = {"年份", "支付點數"}
+
+
+def apply_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """依 DTYPES 轉換已知欄位的型別，未列出的欄位維持原樣。"""
+    for column, dtype in DTYPES.items():
+        if column not in df.columns:
+            continue
+        values = df[column]
+        if column in NUMERIC_COLUMNS:
+            values = pd.to_numeric(values, errors="coerce")
+        elif dtype in ("category", "string"):
+            values = values.astype("string")
+        df[column] = values.astype(dtype)
+    return df
+
+
+def default_cache_path(csv_path: str) -> str:
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(CACHE_DIR, f"{name}.pkb")
+
+
+def source_signature(path: str) -> dict:
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def write_frames(path: str, frames: Iterable[pd.DataFrame], header: Optional[dict] = None) -> int:
+    """逐一寫入 DataFrame 區塊，完成後才取代舊檔；回傳總列數。"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    header = dict(header or {}, format=FORMAT_VERSION, pandas=pd.__version__)
+    rows = 0
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+        for frame in frames:
+            pickle.dump(frame, f, protocol=pickle.HIGHEST_PROTOCOL)
+            rows += len(frame)
+    os.replace(path + ".tmp", path)
+    return rows
+
+
+def read_header(path: str) -> Optional[dict]:
+    """檔案不存在、無法讀取，或由其他格式版本 / pandas 版本寫入時回傳 None。"""
+    try:
+        with open(path, "rb") as f:
+            header = pickle.load(f)
+    except Exception:
+        # 除了 OSError / EOFError / UnpicklingError，不同版本的 pickle 也可能引發
+        # AttributeError、ModuleNotFoundError、TypeError 等
+        return None
+    if not isinstance(header, dict):
+        return None
+    if header.get("format") != FORMAT_VERSION or header.get("pandas") != pd.__version__:
+        return None
+    return header
+
+
+def iter_frames(path: str) -> Iterator[pd.DataFrame]:
+    with open(path, "rb") as f:
+        pickle.load(f)  # header
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def read_frames(path: str) -> pd.DataFrame:
+    frames = list(iter_frames(path))
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0]
+    # 各區塊的 category 值域可能不同，合併後重新套用型別
+    return apply_dtypes(pd.concat(frames, ignore_index=True))
+
+
+def load_dataset(csv_path: str, cache_path: Optional[str] = None) -> pd.DataFrame:
+    """
+    讀取價量調查資料：快取存在且與 CSV 一致時直接讀取二進位快取，
+    否則解析 CSV、轉型並重建快取。傳入 .pkb (例如 modifyCSV.py 的輸出) 時直接讀取。
+    """
+    if csv_path.lower().endswith(".pkb"):
+        start = time.perf_counter()
+        if read_header(csv_path) is None:
+            raise ValueError(f"無法讀取 {csv_path} (檔案損壞或由其他版本的 pandas 建立)，請重新執行 modifyCSV.py")
+        df = read_frames(csv_path)
+        print(f"讀取 {csv_path}：{len(df)} 列 ({(time.perf_counter() - start) * 1000:.0f} ms)")
+        return df
+
+    cache_path = cache_path or default_cache_path(csv_path)
+    signature = source_signature(csv_path)
+    start = time.perf_counter()
+
+    header = read_header(cache_path)
+    if header is not None and header.get("source") == signature and header.get("dtypes") == DTYPES:
+        try:
+            df = read_frames(cache_path)
+        except Exception as e:
+            # 快取損壞或無法還原：改為重新解析 CSV 並覆寫快取
+            print(f"快取無法讀取，重新解析 CSV：{cache_path} ({type(e).__name__}: {e})")
+        else:
+            print(f"讀取快取 {cache_path}：{len(df)} 列 ({(time.perf_counter() - start) * 1000:.0f} ms)")
+            return df
+
+    df = apply_dtypes(pd.read_csv(csv_path))
+    write_frames(cache_path, [df], {"source": signature, "dtypes": DTYPES})
+    print(f"讀取 CSV 並建立快取 {csv_path}：{len(df)} 列 ({(time.perf_counter() - start) * 1000:.0f} ms)")
+    return df
@@ -0,0 +1,54 @@
+import math
+import zlib
+import numpy as np
+from collections import Counter
+from typing import Sequence
+
+from NgramIndex import char_ngrams
+
+##############################################################################
+# 可替換的 Embedding 後端
+#   - EmbeddingBackend：embed(texts) 回傳 (筆數, 維度) 的 float32 矩陣
+#   - HashingEmbeddingBackend：本機字元 n-gram 雜湊向量，不需網路
+#       * n-gram 與 NgramIndex 相同 (NFKC、小寫、2~3 字元)
+#       * 以 CRC32 將 n-gram 對應到固定維度，並以另一個位元決定正負號以減少碰撞偏差
+#       * 詞頻取 1 + log(tf)，結果與行程無關 (不使用 Python 的 hash())
+#   - OpenAI 後端定義於 FileSearch.OpenAIEmbeddingBackend (沿用快取與批次請求)
+##############################################################################
+
+
+class EmbeddingBackend:
+    """所有後端的共同介面；name 用來區分由不同後端建立的索引。"""
+
+    name = "base"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        raise NotImplementedError
+
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    def __init__(self, dim: int = 1024, n_min: int = 2, n_max: int = 3):
+        self.dim = dim
+        self.n_min = n_min
+        self.n_max = n_max
+        self.name = f"hashing-{dim}-{n_min}-{n_max}"
+
+    def embed_one(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        counts = Counter(char_ngrams(text, self.n_min, self.n_max))
+        if not counts:
+            return vec
+        buckets = np.empty(len(counts), dtype=np.int64)
+        weights = np.empty(len(counts), dtype=np.float32)
+        for i, (gram, tf) in enumerate(counts.items()):
+            h = zlib.crc32(gram.encode("utf-8"))
+            buckets[i] = h % self.dim
+            weights[i] = (1.0 + math.log(tf)) * (1.0 if h & 0x80000000 else -1.0)
+        np.add.at(vec, buckets, weights)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        if not len(texts):
+            return np.empty((0, self.dim), dtype=np.float32)
+        return np.stack([self.embed_one(text) for text in texts])
@@ -0,0 +1,187 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from typing import List, Optional, Sequence, Tuple
+
+##############################################################################
+# 磁碟 Embedding 快取
+#   - 鍵：(模型名稱, chunk 文字的 SHA-256)
+#   - 值：float32 向量的原始位元組 (BLOB)，不使用 JSON 浮點數列表
+#   - 超過 max_bytes 時，依最後使用時間 (LRU) 淘汰
+##############################################################################
+CACHE_DIR = os.getenv(
+    "CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "cache"),
+)
+DEFAULT_CACHE_PATH = os.path.join(CACHE_DIR, "embeddings.sqlite")
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024  # 1 GB
+
+# SQLite 單一查詢可帶入的參數數量有限，批次查詢時分段處理
+_SQL_BATCH = 500
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    以 (模型名稱, 文字雜湊) 為鍵的持久化 Embedding 快取。
+    hits / misses 記錄本次執行的命中次數，可用 stats() 取得。
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model     TEXT    NOT NULL,
+                hash      TEXT    NOT NULL,
+                dim       INTEGER NOT NULL,
+                vector    BLOB    NOT NULL,
+                last_used REAL    NOT NULL,
+                PRIMARY KEY (model, hash)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    # ------------------------------------------------------------------
+    # 查詢 / 寫入
+    # ------------------------------------------------------------------
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """依序回傳每段文字的向量；未命中者為 None。"""
+        hashes = [text_hash(t) for t in texts]
+        found = {}
+        with self._lock:
+            unique = list(dict.fromkeys(hashes))
+            for i in range(0, len(unique), _SQL_BATCH):
+                part = unique[i:i + _SQL_BATCH]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({marks})",
+                    [model, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32)
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                    [(now, model, h) for h in found],
+                )
+                self._conn.commit()
+
+        results = [found.get(h) for h in hashes]
+        hit_count = sum(1 for r in results if r is not None)
+        self.hits += hit_count
+        self.misses += len(results) - hit_count
+        return results
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model: str, items: Sequence[Tuple[str, np.ndarray]]) -> None:
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        for text, vector in items:
+            vec = np.asarray(vector, dtype=np.float32)
+            rows.append((model, text_hash(text), vec.shape[0], vec.tobytes(), now))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, dim, vector, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._evict_if_needed()
+
+    def put(self, model: str, text: str, vector: np.ndarray) -> None:
+        self.put_many(model, [(text, vector)])
+
+    # ------------------------------------------------------------------
+    # 容量控制與統計
+    # ------------------------------------------------------------------
+    def _total_bytes(self) -> int:
+        row = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+        return int(row[0])
+
+    def _evict_if_needed(self) -> None:
+        """超過上限時，刪除最久未使用的項目直到低於上限的 90%。"""
+        total = self._total_bytes()
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        cursor = self._conn.execute(
+            "SELECT model, hash, LENGTH(vector) FROM embeddings ORDER BY last_used ASC"
+        )
+        victims = []
+        for model, h, size in cursor:
+            if total <= target:
+                break
+            victims.append((model, h))
+            total -= size
+        cursor.close()
+        self._conn.executemany("DELETE FROM embeddings WHERE model = ? AND hash = ?", victims)
+        self._conn.commit()
+        self.evictions += len(victims)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self._total_bytes()
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_default_cache: Optional[EmbeddingCache] = None
+
+
+def get_default_cache() -> EmbeddingCache:
+    """回傳全程式共用的預設快取 (延遲建立)。"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = EmbeddingCache()
+    return _default_cache
+
+
+if __name__ == "__main__":
+    # 顯示預設快取的統計資訊
+    cache = get_default_cache()
+    for k, v in cache.stats().items():
+        print(f"{k}: {v}")
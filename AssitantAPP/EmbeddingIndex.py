@@ -0,0 +1,218 @@
+import os
+import json
+import numpy as np
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+##############################################################################
+# Embedding 索引
+#   - 所有 chunk 向量存成一個連續 (C-contiguous)、預先正規化的 float32 矩陣
+#   - 單一查詢：一次矩陣 × 向量；多個查詢：一次矩陣 × 矩陣
+#   - search_fused：多個查詢各取前 depth 名，以 reciprocal rank fusion 合併成單一排名
+#   - top-k 使用 np.argpartition 部分選取，只排序最後的 k 筆
+#   - save/load：向量存為 vectors.npy，文字與 metadata 存為 chunks.json
+#   - 所有查詢都經過 _score_block / _top_k_block，量化索引 (QuantizedIndex) 只需覆寫這兩個方法
+##############################################################################
+
+# 批次查詢時每次處理的查詢數，避免 (查詢數 × chunk 數) 的分數矩陣過大
+QUERY_BLOCK = 256
+# reciprocal rank fusion 的平滑常數：第 r 名 (從 1 開始) 的權重為 1 / (RRF_K + r)
+RRF_K = 60
+# search_fused 每個查詢預設只取前幾名：取得越深，與許多查詢都「有點像」的 chunk
+# 累積的分數越高，反而擠掉只與單一查詢高度相關的 chunk
+FUSION_DEPTH = 3
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """將每一列正規化為單位向量 (零向量維持為零)。"""
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """回傳分數最高的 top_k 個索引 (由高到低)；scores 可為一維或二維 (逐列處理)。"""
+    n = scores.shape[-1]
+    k = min(top_k, n)
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+    if k < n:
+        part = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        part = np.broadcast_to(np.arange(n), scores.shape).copy()
+    part_scores = np.take_along_axis(scores, part, axis=-1)
+    order = np.argsort(-part_scores, axis=-1, kind="stable")
+    return np.take_along_axis(part, order, axis=-1)
+
+
+class EmbeddingIndex:
+    """
+    以單一 float32 矩陣保存所有 chunk 向量的索引。
+    texts[i] 對應 matrix[i] 與 metadata[i] (例如來源檔名)，查詢結果為 (列索引, 餘弦相似度)。
+    """
+
+    VECTORS_FILE = "vectors.npy"
+    CHUNKS_FILE = "chunks.json"
+
+    def __init__(
+        self,
+        texts: Sequence[str],
+        vectors: np.ndarray,
+        metadata: Optional[Sequence[dict]] = None,
+        normalized: bool = False,
+    ):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[0] != len(texts):
+            raise ValueError(f"texts ({len(texts)}) 與向量矩陣 {vectors.shape} 的筆數不一致")
+        if metadata is not None and len(metadata) != len(texts):
+            raise ValueError(f"texts ({len(texts)}) 與 metadata ({len(metadata)}) 的筆數不一致")
+        self.texts = list(texts)
+        self.metadata = list(metadata) if metadata is not None else [{} for _ in self.texts]
+        self.matrix = np.ascontiguousarray(vectors) if normalized else normalize_rows(vectors)
+
+    @classmethod
+    def from_embedded_chunks(cls, embedded_chunks: Sequence[Tuple[str, np.ndarray]]) -> "EmbeddingIndex":
+        """由 get_embeddings_for_chunks 的 (text, vector) 列表建立索引。"""
+        if not embedded_chunks:
+            return cls([], np.empty((0, 0), dtype=np.float32))
+        texts = [text for text, _ in embedded_chunks]
+        vectors = np.stack([np.asarray(vec, dtype=np.float32) for _, vec in embedded_chunks])
+        return cls(texts, vectors)
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    def scores(self, query_vec: np.ndarray, top_k: Optional[int] = None, rows=None) -> np.ndarray:
+        """
+        回傳 query 與每個 chunk 的餘弦相似度。
+        top_k / rows 供近似索引 (QuantizedIndex) 決定哪些列要重算精確分數，這裡不使用。
+        """
+        if len(self) == 0:
+            return np.empty(0, dtype=np.float32)
+        return self._score_block(normalize_rows(np.asarray(query_vec).reshape(1, -1)))[0]
+
+    def _score_block(self, queries: np.ndarray) -> np.ndarray:
+        """(查詢數, chunk 數) 的分數矩陣；queries 已正規化。"""
+        return queries @ self.matrix.T
+
+    def _top_k_block(self, queries: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """每個查詢的 top_k (列索引, 分數)，皆為 (查詢數, top_k) 的陣列。"""
+        scores = self._score_block(queries)
+        idx = top_k_indices(scores, top_k)
+        return idx, np.take_along_axis(scores, idx, axis=-1)
+
+    def search(self, query_vec: np.ndarray, top_k: int = 3) -> List[Tuple[int, float]]:
+        if len(self) == 0:
+            return []
+        idx, scores = self._top_k_block(normalize_rows(np.asarray(query_vec).reshape(1, -1)), top_k)
+        return [(int(i), float(s)) for i, s in zip(idx[0], scores[0])]
+
+    def search_batch(self, query_matrix: np.ndarray, top_k: int = 3) -> List[List[Tuple[int, float]]]:
+        """一次查詢多個向量 (每列一個查詢)，回傳每個查詢各自的 top-k。"""
+        queries = normalize_rows(np.atleast_2d(query_matrix))
+        if len(self) == 0:
+            return [[] for _ in range(queries.shape[0])]
+
+        results = []
+        for start in range(0, queries.shape[0], QUERY_BLOCK):
+            idx, top_scores = self._top_k_block(queries[start:start + QUERY_BLOCK], top_k)
+            for row_idx, row_scores in zip(idx, top_scores):
+                results.append([(int(i), float(s)) for i, s in zip(row_idx, row_scores)])
+        return results
+
+    def search_fused(
+        self, query_matrix: np.ndarray, top_k: int = 3, depth: int = FUSION_DEPTH, rrf_k: int = RRF_K
+    ) -> List[Tuple[int, float]]:
+        """
+        多個查詢 (每列一個) 合併成一個排名：每個查詢取前 depth 名，
+        chunk 的分數為 sum(1 / (rrf_k + 名次))，回傳分數最高的 top_k 個 (列索引, RRF 分數)。
+        查詢數太少、前 depth 名不足 top_k 個時，自動加深到 ceil(top_k / 查詢數)。
+        """
+        queries = normalize_rows(np.atleast_2d(query_matrix))
+        if len(self) == 0 or queries.shape[0] == 0:
+            return []
+
+        depth = min(max(depth, -(-top_k // queries.shape[0])), len(self))
+        weights = 1.0 / (rrf_k + np.arange(1, depth + 1, dtype=np.float64))
+        fused = np.zeros(len(self), dtype=np.float64)
+        for start in range(0, queries.shape[0], QUERY_BLOCK):
+            idx, _ = self._top_k_block(queries[start:start + QUERY_BLOCK], depth)
+            fused += np.bincount(idx.ravel(), weights=np.tile(weights, idx.shape[0]), minlength=len(self))
+
+        top = top_k_indices(fused, top_k)
+        return [(int(i), float(fused[i])) for i in top if fused[i] > 0]
+
+    def search_texts(self, query_vec: np.ndarray, top_k: int = 3) -> List[str]:
+        return [self.texts[i] for i, _ in self.search(query_vec, top_k)]
+
+    def search_records(self, query_vec: np.ndarray, top_k: int = 3) -> List[dict]:
+        """回傳 {"text", "score", 以及該列 metadata} 的字典列表。"""
+        return self.records(self.search(query_vec, top_k))
+
+    def records(self, hits: Iterable[Tuple[int, float]]) -> List[dict]:
+        """將 (列索引, 分數) 轉為 {"text", "score", metadata...} 字典。"""
+        return [{"text": self.texts[i], "score": score, **self.metadata[i]} for i, score in hits]
+
+    # ------------------------------------------------------------------
+    # 增刪與持久化
+    # ------------------------------------------------------------------
+    def select(self, rows: Iterable[int]) -> "EmbeddingIndex":
+        """回傳只包含指定列的新索引。"""
+        rows = np.fromiter(rows, dtype=np.int64)
+        matrix = self.matrix[rows] if len(self) else self.matrix
+        return EmbeddingIndex(
+            [self.texts[i] for i in rows],
+            matrix,
+            [self.metadata[i] for i in rows],
+            normalized=True,
+        )
+
+    def extend(
+        self,
+        texts: Sequence[str],
+        vectors: np.ndarray,
+        metadata: Optional[Sequence[dict]] = None,
+    ) -> "EmbeddingIndex":
+        """回傳附加新 chunk 後的新索引。"""
+        added = EmbeddingIndex(texts, np.asarray(vectors).reshape(len(texts), -1), metadata)
+        if len(self) == 0:
+            return added
+        if len(added) == 0:
+            return self
+        return EmbeddingIndex(
+            self.texts + added.texts,
+            np.concatenate([self.matrix, added.matrix]),
+            self.metadata + added.metadata,
+            normalized=True,
+        )
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        vectors_path = os.path.join(directory, self.VECTORS_FILE)
+        chunks_path = os.path.join(directory, self.CHUNKS_FILE)
+
+        # 先寫入暫存檔再取代，避免中斷時留下不完整的索引
+        with open(vectors_path + ".tmp", "wb") as f:
+            np.save(f, self.matrix)
+        with open(chunks_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"texts": self.texts, "metadata": self.metadata}, f, ensure_ascii=False)
+        os.replace(vectors_path + ".tmp", vectors_path)
+        os.replace(chunks_path + ".tmp", chunks_path)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = False) -> "EmbeddingIndex":
+        """讀取 save() 的結果；mmap=True 時向量以唯讀記憶體映射方式載入。"""
+        with open(os.path.join(directory, cls.CHUNKS_FILE), "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+        matrix = np.load(os.path.join(directory, cls.VECTORS_FILE), mmap_mode="r" if mmap else None)
+        return cls(chunks["texts"], matrix, chunks["metadata"], normalized=True)
+
+    @classmethod
+    def exists(cls, directory: str) -> bool:
+        return all(
+            os.path.exists(os.path.join(directory, name)) for name in (cls.VECTORS_FILE, cls.CHUNKS_FILE)
+        )
@@ -1,70 +1,490 @@
 import os
 import json
-import openai
+import time
+import base64
+import random
+import threading
+import weakref
 import PyPDF2
 import numpy as np
-from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
 from dotenv import load_dotenv
+from CompletionCache import CompletionCache, get_default_cache as get_completion_cache
+from ContextPacker import pack_context
+from EmbeddingBackend import EmbeddingBackend, HashingEmbeddingBackend
+from EmbeddingCache import EmbeddingCache, get_default_cache
+from EmbeddingIndex import FUSION_DEPTH, EmbeddingIndex, top_k_indices
+from NgramIndex import NgramIndex
+import OpenAIClient as oc
+import Telemetry as tm
+from TokenCounter import count_tokens, get_encoding
 
 ##############################################################################
 # 1. 載入環境變數 & 初始化
 ##############################################################################
 env_path = r'D:\CYCU\113_WebCrawler\CODE\.env'
 load_dotenv(dotenv_path=env_path)
-openai.api_key = os.getenv("OPENAI_API_KEY")  # 或直接設定 openai.api_key = "sk-xxxxx"
+# API key 由 OpenAIClient 在呼叫當下讀取環境變數 OPENAI_API_KEY
 
 ##############################################################################
 # 2. 工具函式：讀取並切分 PDF
+#   - 逐頁讀取 PDF，以固定大小、部分重疊的滑動視窗切分
+#   - 視窗只保留尚未輸出的文字，記憶體用量與文件長度無關
+#   - 每個 chunk 附帶 (檔案, 起訖頁碼, 在全文中的起始位置)
+#   - unit="char" 以字元數切分；unit="token" 以 tiktoken token 數切分
 ##############################################################################
-def pdf_to_chunks(pdf_path: str, chunk_size: int = 800, chunk_overlap: int = 100) -> List[str]:
-    text = ""
+class ChunkRecord(NamedTuple):
+    text: str
+    file: str
+    page_start: int  # 起始頁碼 (從 1 開始)
+    page_end: int    # 結束頁碼 (含)
+    offset: int      # 在整份文件中的起始位置 (單位同 chunk_size)
+
+    def to_metadata(self) -> dict:
+        return {
+            "file": os.path.basename(self.file),
+            "page_start": self.page_start,
+            "page_end": self.page_end,
+            "offset": self.offset,
+        }
+
+
+def iter_page_texts(pdf_path: str) -> Iterator[str]:
+    """逐頁回傳整理過的文字 (空白頁回傳空字串，以維持頁碼)。"""
     with open(pdf_path, "rb") as f:
         reader = PyPDF2.PdfReader(f)
         for page in reader.pages:
             page_text = page.extract_text()
-            if page_text:
-                text += page_text.strip() + "\n"
-
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunk = text[start:end]
-        chunks.append(chunk)
-        start = end - chunk_overlap if (end - chunk_overlap) > 0 else end
+            yield page_text.strip() + "\n" if page_text else ""
+
+
+def iter_chunks(
+    page_texts: Iterable[str],
+    file: str = "",
+    chunk_size: int = 800,
+    chunk_overlap: int = 100,
+    unit: str = "char",
+    model: str = "text-embedding-ada-002",
+) -> Iterator[ChunkRecord]:
+    """
+    將逐頁文字串流切分成 ChunkRecord。以字元切分時，結果與把所有頁面
+    串接後再以 chunk_size / chunk_overlap 切分完全相同。
+    """
+    if unit == "char":
+        encode, decode = (lambda text: text), (lambda units: units)
+        buffer = ""
+    elif unit == "token":
+        encoding = get_encoding(model)
+        if encoding is None:
+            raise ValueError("unit='token' 需要可用的 tiktoken")
+        encode, decode = (lambda text: encoding.encode(text, disallowed_special=())), encoding.decode
+        buffer = []
+    else:
+        raise ValueError(f"未知的切分單位：{unit}")
+
+    buffer_start = 0  # buffer[0] 在全文中的位置
+    next_start = 0    # 下一個 chunk 的起始位置
+    page_starts = []  # 仍與 buffer 重疊的頁面：(頁面起始位置, 頁碼)
+
+    def emit(final: bool) -> Iterator[ChunkRecord]:
+        nonlocal buffer, buffer_start, next_start
+        buffer_end = buffer_start + len(buffer)
+        while next_start < buffer_end and (final or next_start + chunk_size <= buffer_end):
+            start = next_start
+            end = start + chunk_size
+            units = buffer[start - buffer_start:end - buffer_start]
+            pages = [page for page_start, page in page_starts if page_start < start + len(units)]
+            first_page = max((page for page_start, page in page_starts if page_start <= start), default=pages[0])
+            yield ChunkRecord(decode(units), file, first_page, pages[-1], start)
+            next_start = end - chunk_overlap if (end - chunk_overlap) > 0 else end
+
+        # 丟棄已不會再用到的文字與頁面
+        drop = min(next_start, buffer_end) - buffer_start
+        if drop > 0:
+            buffer = buffer[drop:]
+            buffer_start += drop
+            while len(page_starts) > 1 and page_starts[1][0] <= buffer_start:
+                page_starts.pop(0)
+
+    for page_no, page_text in enumerate(page_texts, start=1):
+        if not page_text:
+            continue
+        page_starts.append((buffer_start + len(buffer), page_no))
+        buffer = buffer + encode(page_text)
+        yield from emit(final=False)
+    yield from emit(final=True)
+
+
+def iter_pdf_chunks(
+    pdf_path: str,
+    chunk_size: int = 800,
+    chunk_overlap: int = 100,
+    unit: str = "char",
+) -> Iterator[ChunkRecord]:
+    return iter_chunks(iter_page_texts(pdf_path), pdf_path, chunk_size, chunk_overlap, unit)
+
+
+def pdf_to_chunks(pdf_path: str, chunk_size: int = 800, chunk_overlap: int = 100) -> List[str]:
+    with tm.stage("pdf_to_chunks", file=os.path.basename(pdf_path)) as span:
+        chunks = [record.text for record in iter_pdf_chunks(pdf_path, chunk_size, chunk_overlap)]
+        span.update(chunks=len(chunks))
     return chunks
 
+##############################################################################
+# 2.1 平行讀取多個 PDF (多行程)
+#   - 每個 PDF 為一個工作；超過 LARGE_PDF_BYTES 的 PDF 再依頁數範圍拆成多個工作
+#   - 依完成順序逐檔回傳 chunk，並附上每個檔案的解析耗時
+##############################################################################
+LARGE_PDF_BYTES = 1024 * 1024
+PAGES_PER_TASK = 20
+
+
+def _extract_page_range(pdf_path: str, start: int, end: Optional[int]) -> Tuple[str, int, List[str], float]:
+    """於子行程中執行：回傳 (pdf_path, 起始頁, 各頁文字, 耗時秒數)。"""
+    begin = time.perf_counter()
+    with open(pdf_path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        pages = reader.pages[start:end]
+        texts = []
+        for page in pages:
+            page_text = page.extract_text()
+            texts.append(page_text.strip() + "\n" if page_text else "")
+    return pdf_path, start, texts, time.perf_counter() - begin
+
+
+def _page_ranges(pdf_path: str, pages_per_task: int) -> List[Tuple[int, Optional[int]]]:
+    if os.path.getsize(pdf_path) < LARGE_PDF_BYTES:
+        return [(0, None)]
+    with open(pdf_path, "rb") as f:
+        page_count = len(PyPDF2.PdfReader(f).pages)
+    return [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+
+
+def iter_pdf_chunks_parallel(
+    pdf_paths: Sequence[str],
+    chunk_size: int = 800,
+    chunk_overlap: int = 100,
+    max_workers: Optional[int] = None,
+    pages_per_task: int = PAGES_PER_TASK,
+    unit: str = "char",
+) -> Iterator[Tuple[str, List[ChunkRecord], float]]:
+    """
+    以 ProcessPoolExecutor 平行解析 PDF，每完成一個檔案就 yield (pdf_path, chunk 紀錄, 秒數)。
+    秒數為該檔所有頁數範圍的解析時間總和，可用來找出特別慢的文件。
+    切分結果與 iter_pdf_chunks 相同。max_workers 預設為 CPU 核心數。
+    """
+    tasks = [(path, start, end) for path in pdf_paths for start, end in _page_ranges(path, pages_per_task)]
+    remaining = {}
+    for path, _, _ in tasks:
+        remaining[path] = remaining.get(path, 0) + 1
+    parts = {path: {} for path in remaining}
+    seconds = {path: 0.0 for path in remaining}
+
+    for path, start, texts, elapsed in _run_extract_tasks(tasks, max_workers):
+        parts[path][start] = texts
+        seconds[path] += elapsed
+        remaining[path] -= 1
+        if remaining[path]:
+            continue
+
+        ranges = parts.pop(path)
+        name = os.path.basename(path)
+        if tm.enabled():
+            pages = sum(len(texts) for texts in ranges.values())
+            tm.record("stage", "pdf_read", seconds[path], file=name, pages=pages, bytes=os.path.getsize(path))
+        page_texts = (text for start in sorted(ranges) for text in ranges[start])
+        with tm.stage("chunk", file=name) as span:
+            records = list(iter_chunks(page_texts, path, chunk_size, chunk_overlap, unit))
+            span.update(chunks=len(records))
+        yield path, records, seconds[path]
+
+
+def _run_extract_tasks(tasks: List[tuple], max_workers: Optional[int]) -> Iterator[tuple]:
+    """max_workers=1 時直接在本行程依序執行，不建立行程池。"""
+    if max_workers == 1:
+        for task in tasks:
+            yield _extract_page_range(*task)
+        return
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_extract_page_range, *task) for task in tasks]
+        for future in as_completed(futures):
+            yield future.result()
+
 ##############################################################################
 # 3. 工具函式：使用 OpenAI Embeddings 將 chunk 向量化
 ##############################################################################
-def get_embeddings_for_chunks(chunks: List[str], model="text-embedding-ada-002") -> List[Tuple[str, np.ndarray]]:
-    embedded_chunks = []
-    for chunk in chunks:
-        resp = openai.Embedding.create(model=model, input=chunk)
-        vector = np.array(resp["data"][0]["embedding"])
-        embedded_chunks.append((chunk, vector))
-    return embedded_chunks
+EMBED_BATCH_SIZE = 100          # 每個 Embedding 請求最多包含的 chunk 數
+EMBED_MAX_BATCH_TOKENS = 100_000  # 每個請求的 token 上限 (API 上限為 300k)
+EMBED_MAX_WORKERS = 4           # 同時進行中的請求數
+EMBED_MAX_RETRIES = 6
+
+class _AdaptiveBackoff(oc.RetryPolicy):
+    """
+    所有 worker 共用的退避狀態：收到 429 時加倍等待時間並暫停所有 worker，
+    成功時逐步縮短，讓整體請求速率自動貼近 API 的限制。
+    """
+
+    def __init__(self, base: float = 0.5, maximum: float = 30.0):
+        self.base = base
+        self.maximum = maximum
+        self.pause = 0.0
+        self.rate_limited = 0
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_attempt(self) -> float:
+        with self._lock:
+            return self._resume_at - time.monotonic()
+
+    def delay(self, attempt: int, retry_after: Optional[str]) -> float:
+        # 暫停時間記在共用狀態中，由下一次 before_attempt 等待
+        self.on_rate_limit()
+        return 0.0
+
+    def on_rate_limit(self) -> None:
+        with self._lock:
+            self.rate_limited += 1
+            self.pause = min(self.maximum, max(self.base, self.pause * 2))
+            jittered = self.pause * random.uniform(0.5, 1.0)
+            self._resume_at = max(self._resume_at, time.monotonic() + jittered)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.pause = self.pause / 2 if self.pause > self.base else 0.0
+
+
+def _make_batches(texts: List[str], model: str, batch_size: int, max_batch_tokens: int) -> List[List[int]]:
+    """依 chunk 數與 token 數上限，將文字索引分組成多個請求。"""
+    batches, current, current_tokens = [], [], 0
+    for i, text in enumerate(texts):
+        tokens = count_tokens(text, model)
+        if current and (len(current) >= batch_size or current_tokens + tokens > max_batch_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _decode_embedding(embedding) -> np.ndarray:
+    if isinstance(embedding, str):
+        return np.frombuffer(base64.b64decode(embedding), dtype=np.float32)
+    return np.asarray(embedding, dtype=np.float32)
+
+
+def _embed_batch(texts: List[str], model: str, backoff: _AdaptiveBackoff) -> List[np.ndarray]:
+    with tm.api_call("embeddings", model, inputs=len(texts)) as span:
+        resp = oc.post_json(
+            oc.api_url("embeddings"),
+            {"model": model, "input": texts, "encoding_format": "base64"},
+            max_retries=EMBED_MAX_RETRIES,
+            policy=backoff,
+            span=span,
+        )
+        span.update(**tm.usage_fields(resp.get("usage")))
+
+    # 依回傳的 index 排回原本順序
+    vectors = [None] * len(texts)
+    for item in resp["data"]:
+        vectors[item["index"]] = _decode_embedding(item["embedding"])
+    return vectors
+
+
+def get_embeddings_for_chunks(
+    chunks: List[str],
+    model="text-embedding-ada-002",
+    cache: Optional[EmbeddingCache] = None,
+    use_cache: bool = True,
+    batch_size: int = EMBED_BATCH_SIZE,
+    max_workers: int = EMBED_MAX_WORKERS,
+    max_batch_tokens: int = EMBED_MAX_BATCH_TOKENS,
+) -> List[Tuple[str, np.ndarray]]:
+    """
+    先查詢磁碟 Embedding 快取，只對未命中的 chunk 呼叫 embeddings API (OpenAIClient)，
+    並將新取得的向量寫回快取。use_cache=False 時略過快取。
+
+    未命中的 chunk 會依 batch_size / max_batch_tokens 打包成批次請求，
+    最多 max_workers 個批次同時進行；回傳順序與輸入的 chunks 相同。
+    batch_size=1、max_workers=1 即為逐一呼叫的舊行為。
+    """
+    start = time.perf_counter()
+    if use_cache and cache is None:
+        cache = get_default_cache()
+
+    vectors = cache.get_many(model, chunks) if use_cache else [None] * len(chunks)
+
+    # 重複的文字只需要 embed 一次
+    missing = list(dict.fromkeys(chunk for chunk, vec in zip(chunks, vectors) if vec is None))
+    if missing:
+        batches = _make_batches(missing, model, batch_size, max_batch_tokens)
+        backoff = _AdaptiveBackoff()
+
+        def run(batch: List[int]) -> List[np.ndarray]:
+            return _embed_batch([missing[i] for i in batch], model, backoff)
+
+        if max_workers > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                batch_vectors = list(executor.map(run, batches))
+        else:
+            batch_vectors = [run(batch) for batch in batches]
+
+        new_vectors = {}
+        for batch, vecs in zip(batches, batch_vectors):
+            for i, vec in zip(batch, vecs):
+                new_vectors[missing[i]] = vec
+        vectors = [vec if vec is not None else new_vectors[chunk] for chunk, vec in zip(chunks, vectors)]
+
+        if use_cache:
+            cache.put_many(model, list(new_vectors.items()))
+
+    tm.record("stage", "embed", time.perf_counter() - start, chunks=len(chunks), embedded=len(missing))
+    return list(zip(chunks, vectors))
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    """透過 get_embeddings_for_chunks 呼叫 OpenAI (沿用磁碟快取與批次請求)。"""
+
+    def __init__(self, model: str = "text-embedding-ada-002", cache: Optional[EmbeddingCache] = None, use_cache: bool = True):
+        self.model = model
+        self.cache = cache
+        self.use_cache = use_cache
+        self.name = f"openai-{model}"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        embedded = get_embeddings_for_chunks(list(texts), model=self.model, cache=self.cache, use_cache=self.use_cache)
+        return np.stack([vec for _, vec in embedded]) if embedded else np.empty((0, 0), dtype=np.float32)
+
+
+# 以名稱選擇的本機後端 (共用同一個實例，讓衍生索引可以重複使用)
+LOCAL_BACKENDS = {"hashing": HashingEmbeddingBackend()}
 
 ##############################################################################
 # 4. 工具函式：根據使用者 query，搜尋最相似的 chunk
+#   - mode="dense"：向量相似度 (backend 預設為 OpenAI；"hashing" 為本機向量，不需網路)
+#   - mode="lexical"：字元 n-gram BM25 (NgramIndex)，適合 ACM01 這類代碼或許可證字號
+#   - mode="hybrid"：兩種分數各自正規化到 0~1 後以 alpha 加權合併
+#   - 本機向量索引與 BM25 索引在第一次查詢時由 EmbeddingIndex 的文字建立，
+#     之後同一個 EmbeddingIndex 物件的查詢都直接重用
+#   - search_multi_query：多個短查詢 (例如每個產品名稱) 分別計分後以 RRF 合併
 ##############################################################################
+SEARCH_MODES = ("dense", "lexical", "hybrid")
+_derived_indexes: "weakref.WeakKeyDictionary[EmbeddingIndex, dict]" = weakref.WeakKeyDictionary()
+
+
+def _derived_index(index: EmbeddingIndex, key, build):
+    derived = _derived_indexes.setdefault(index, {})
+    if key not in derived:
+        derived[key] = build()
+    return derived[key]
+
+
+def lexical_index(index: EmbeddingIndex) -> NgramIndex:
+    return _derived_index(index, "lexical", lambda: NgramIndex(index.texts))
+
+
+def _embed_queries(queries: List[str], index: EmbeddingIndex, backend, embed_model, cache, use_cache):
+    """回傳 (要比對的索引, 查詢向量矩陣)；本機後端比對的是由該後端建立的衍生索引。"""
+    if backend is None or backend == "openai":
+        embedded = get_embeddings_for_chunks(queries, model=embed_model, cache=cache, use_cache=use_cache)
+        return index, np.stack([vec for _, vec in embedded])
+    if isinstance(backend, str):
+        backend = LOCAL_BACKENDS[backend]
+    local = _derived_index(
+        index, ("dense", backend.name),
+        lambda: EmbeddingIndex(index.texts, backend.embed(index.texts), index.metadata),
+    )
+    return local, backend.embed(queries)
+
+
+def _dense_query(query: str, index: EmbeddingIndex, backend, embed_model, cache, use_cache):
+    target, query_matrix = _embed_queries([query], index, backend, embed_model, cache, use_cache)
+    return target, query_matrix[0]
+
+
+def _minmax(scores: np.ndarray) -> np.ndarray:
+    low, high = float(scores.min()), float(scores.max())
+    return (scores - low) / (high - low) if high > low else np.zeros_like(scores)
+
+
 def search_relevant_chunks(
     query: str,
-    embedded_chunks: List[Tuple[str, np.ndarray]],
+    embedded_chunks: Union[EmbeddingIndex, List[Tuple[str, np.ndarray]]],
     top_k: int = 3,
     embed_model="text-embedding-ada-002",
-) -> List[str]:
-    query_resp = openai.Embedding.create(model=embed_model, input=query)
-    query_vec = np.array(query_resp["data"][0]["embedding"])
+    cache: Optional[EmbeddingCache] = None,
+    use_cache: bool = True,
+    with_metadata: bool = False,
+    mode: str = "dense",
+    backend: Union[None, str, EmbeddingBackend] = None,
+    alpha: float = 0.5,
+) -> List[Union[str, dict]]:
+    """
+    embedded_chunks 可傳入 EmbeddingIndex (建議，重複查詢時只需建一次)，
+    或 get_embeddings_for_chunks 回傳的 (text, vector) 列表。
+    with_metadata=True 時回傳 {"text", "file", "page_start", ...} 字典，
+    可直接交給 answer_with_context 以頁碼標示出處。
 
-    scores = []
-    for chunk_text, chunk_vec in embedded_chunks:
-        score = cosine_similarity(query_vec, chunk_vec)
-        scores.append((chunk_text, score))
+    mode 為 "dense" / "lexical" / "hybrid"；backend 為 None 或 "openai" (預設)、
+    "hashing" 或自訂的 EmbeddingBackend。
+    "hybrid" 模式中 alpha 為向量分數的權重 (1 - alpha 為 BM25)。
+    """
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"未知的搜尋模式：{mode}")
+    with tm.stage("search", top_k=top_k, mode=mode):
+        if not isinstance(embedded_chunks, EmbeddingIndex):
+            embedded_chunks = EmbeddingIndex.from_embedded_chunks(embedded_chunks)
+        if len(embedded_chunks) == 0:
+            return []
+
+        if mode == "lexical":
+            hits = lexical_index(embedded_chunks).search(query, top_k)
+        elif mode == "dense":
+            # search() 讓 QuantizedIndex 以原始向量重新排序候選
+            target, query_vec = _dense_query(query, embedded_chunks, backend, embed_model, cache, use_cache)
+            hits = target.search(query_vec, top_k)
+        else:
+            target, query_vec = _dense_query(query, embedded_chunks, backend, embed_model, cache, use_cache)
+            lexical = lexical_index(embedded_chunks).scores(query)
+            # QuantizedIndex：向量分數的前幾名與 BM25 的前幾名都改用精確分數再混合
+            dense = target.scores(query_vec, top_k, rows=top_k_indices(lexical, top_k))
+            scores = alpha * _minmax(dense) + (1 - alpha) * _minmax(lexical)
+            hits = [(int(i), float(scores[i])) for i in top_k_indices(scores, top_k)]
+
+        if with_metadata:
+            return embedded_chunks.records(hits)
+        return [embedded_chunks.texts[i] for i, _ in hits]
+
+
+def search_multi_query(
+    queries: Sequence[str],
+    embedded_chunks: Union[EmbeddingIndex, List[Tuple[str, np.ndarray]]],
+    top_k: int = 20,
+    depth: int = FUSION_DEPTH,
+    embed_model="text-embedding-ada-002",
+    cache: Optional[EmbeddingCache] = None,
+    use_cache: bool = True,
+    with_metadata: bool = False,
+    backend: Union[None, str, EmbeddingBackend] = None,
+) -> List[Union[str, dict]]:
+    """
+    每個查詢 (例如每個產品名稱) 各自向量化 (批次請求)，以一次矩陣乘法對所有 chunk 計分，
+    再以 reciprocal rank fusion 合併成單一 top_k (見 EmbeddingIndex.search_fused)。
+    重複或空白的查詢只計算一次；with_metadata=True 時 score 為 RRF 分數。
+    """
+    queries = list(dict.fromkeys(q.strip() for q in queries if q and q.strip()))
+    with tm.stage("search_multi_query", queries=len(queries), top_k=top_k):
+        if not isinstance(embedded_chunks, EmbeddingIndex):
+            embedded_chunks = EmbeddingIndex.from_embedded_chunks(embedded_chunks)
+        if len(embedded_chunks) == 0 or not queries:
+            return []
 
-    scores.sort(key=lambda x: x[1], reverse=True)
-    top_chunks = [item[0] for item in scores[:top_k]]
-    return top_chunks
+        target, query_matrix = _embed_queries(queries, embedded_chunks, backend, embed_model, cache, use_cache)
+        hits = target.search_fused(query_matrix, top_k=top_k, depth=depth)
+        if with_metadata:
+            return embedded_chunks.records(hits)
+        return [embedded_chunks.texts[i] for i, _ in hits]
 
 def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
@@ -72,24 +492,83 @@ def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
 ##############################################################################
 # 5. 用 ChatCompletion 回答，將相似 chunks 當作「context」提示
 ##############################################################################
-def answer_with_context(query: str, top_chunks: List[str], model="gpt-3.5-turbo") -> str:
+def _chunk_label(i: int, chunk: Union[str, dict]) -> str:
+    """chunk 若帶有來源資訊，標示為「<chunk> 1 (檔名 p.3-4)」。"""
+    if isinstance(chunk, dict) and "page_start" in chunk:
+        pages = f"p.{chunk['page_start']}"
+        if chunk.get("page_end", chunk["page_start"]) != chunk["page_start"]:
+            pages += f"-{chunk['page_end']}"
+        return f"<chunk> {i+1} ({chunk.get('file', '')} {pages})"
+    return f"<chunk> {i+1}"
+
+
+def _build_messages(query: str, top_chunks: List[Union[str, dict]]) -> List[dict]:
     context_text = "\n---\n".join(
-        [f"<chunk> {i+1}\n{ch}" for i, ch in enumerate(top_chunks)]
+        [
+            f"{_chunk_label(i, ch)}\n{ch['text'] if isinstance(ch, dict) else ch}"
+            for i, ch in enumerate(top_chunks)
+        ]
     )
 
     system_msg = (
         "You are a helpful assistant that answers questions based on the provided context. "
         "Use the context to answer the user's question. "
         "If the user asks about content not in context, say you are not sure. "
-        "When you cite content, reference the <chunk> number."
+        "When you cite content, reference the <chunk> number, "
+        "and the file name and page numbers when they are given."
     )
     user_content = f"Context:\n{context_text}\n\nQuestion: {query}"
-    messages = [
+    return [
         {"role": "system", "content": system_msg},
         {"role": "user", "content": user_content},
     ]
 
-    resp = openai.ChatCompletion.create(model=model, messages=messages, temperature=0.2)
+
+def _prompt_tokens(messages: List[dict], model: str) -> int:
+    return sum(count_tokens(m["content"], model) for m in messages)
+
+
+def answer_with_context(
+    query: str,
+    top_chunks: List[Union[str, dict]],
+    model="gpt-3.5-turbo",
+    cache: Optional[CompletionCache] = None,
+    use_cache: bool = True,
+    max_context_tokens: Optional[int] = None,
+) -> str:
+    """
+    相同的問題與上下文會直接使用 CompletionCache 中的回答；use_cache=False 可略過快取。
+
+    max_context_tokens 有值時先以 ContextPacker.pack_context 合併相鄰 chunk、
+    移除近似重複並依相關度放入預算內，並印出組裝前後的 prompt token 數。
+    """
+    messages = _build_messages(query, top_chunks)
+    if max_context_tokens is not None:
+        with tm.stage("pack_context", chunks=len(top_chunks)) as span:
+            tokens_before = _prompt_tokens(messages, model)
+            packed, stats = pack_context(top_chunks, max_context_tokens, model=model)
+            messages = _build_messages(query, packed)
+            tokens_after = _prompt_tokens(messages, model)
+            span.update(prompt_tokens_before=tokens_before, prompt_tokens_after=tokens_after, **stats)
+        print(
+            f"Prompt tokens：{tokens_before} -> {tokens_after} "
+            f"(chunk {stats['chunks_in']} -> {stats['chunks_out']}，合併 {stats['merged']}、"
+            f"近似重複 {stats['duplicates']}，預算 {max_context_tokens})"
+        )
+
+    request = {"model": model, "messages": messages, "temperature": 0.2}
+    if use_cache:
+        cache = cache or get_completion_cache()
+        cached = cache.get(request)
+        if cached is not None:
+            tm.record("api", "chat.completions", 0.0, model=model, cache_hit=True)
+            return cached["choices"][0]["message"]["content"]
+
+    with tm.api_call("chat.completions", model) as span:
+        resp = oc.post_json(oc.api_url("chat/completions"), request, span=span)
+        span.update(**tm.usage_fields(resp.get("usage")))
+    if use_cache:
+        cache.put(request, resp)
     return resp["choices"][0]["message"]["content"]
 
 ##############################################################################
@@ -145,25 +624,14 @@ if __name__ == "__main__":
 
     # 6.3 指定 PDF 資料夾 (自動讀取所有 PDF)
     pdf_folder = os.getenv("PDFfloder_PATH")
-    pdf_files = [
-        os.path.join(pdf_folder, f)
-        for f in os.listdir(pdf_folder)
-        if f.lower().endswith(".pdf")
-    ]
-
-    # 6.4 讀取與切分 PDF
-    all_chunks = []
-    for pdf_file in pdf_files:
-        print(f"Reading and splitting PDF: {pdf_file}")
-        chunks = pdf_to_chunks(pdf_file)
-        all_chunks.extend(chunks)
 
-    # 6.5 對所有 chunks 做 Embedding
-    print("Embedding all chunks ...")
-    embedded_chunks = get_embeddings_for_chunks(all_chunks, model="text-embedding-ada-002")
+    # 6.4 ~ 6.5 增量同步 PDF 索引：只讀取、切分並 Embedding 新增或變動的 PDF
+    from PdfIngest import ingest_folder
+    chunk_index = ingest_folder(pdf_folder, model="text-embedding-ada-002")
+    print(f"Embedding cache: {get_default_cache().stats()}")
 
     # 6.6 搜尋與問題最相似的前 20 個 chunks
-    top_chunks = search_relevant_chunks(user_question, embedded_chunks, top_k=20)
+    top_chunks = search_relevant_chunks(user_question, chunk_index, top_k=20, with_metadata=True)
 
     # 6.7 呼叫 ChatCompletion 結合最相似 chunks (可換成 gpt-4o 或其他模型)
     answer = answer_with_context(user_question, top_chunks, model="gpt-4o")
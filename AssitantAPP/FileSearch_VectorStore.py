@@ -1,14 +1,14 @@
-import os
 import json
-import openai
-import requests
-from typing import List
+from typing import List, Optional
 from dotenv import load_dotenv
+from CompletionCache import CompletionCache, get_default_cache
+from LocalVectorStore import LocalVectorStore
+import OpenAIClient as oc
+import Telemetry as tm
 
 # 載入環境變數（請確認 .env 路徑與內容正確）
 env_path = r'D:\CYCU\113_WebCrawler\CODE\.env'
 load_dotenv(dotenv_path=env_path)
-openai.api_key = os.getenv("OPENAI_API_KEY")
 
 # 1. Vector Store 設定
 VECTOR_STORE_URL = "https://api.openai.com/v1/vector-stores"
@@ -20,7 +20,12 @@ ASSISTANT_MODEL_ID = "asst_nvA34D7Wmv2pq19Ewx3Kllvu"
 ASSISTANT_NAME = "Medical Equiment_Filea Saerch"  # 參考需求
 RESPONSE_FORMAT = "json_object"
 
-def search_similar_keywords(keywords: List[str]) -> dict:
+def search_similar_keywords(
+    keywords: List[str],
+    cache: Optional[CompletionCache] = None,
+    use_cache: bool = True,
+    vector_store: Optional[LocalVectorStore] = None,
+) -> dict:
     """
     使用 OpenAI 向量庫搜尋與關鍵字（可為多組）相關或相似的名稱，
     並回傳指定格式的 JSON 物件:
@@ -30,6 +35,9 @@ def search_similar_keywords(keywords: List[str]) -> dict:
       "中文名稱": "...",
       "費用年": "..."
     }
+
+    相同的關鍵字與參考內容會直接使用 CompletionCache 中的回覆；use_cache=False 可略過快取。
+    vector_store 指定 LocalVectorStore 時改查本機向量庫 (查詢格式相同)，不呼叫遠端 VECTOR_STORE_ID。
     """
     # 將多個關鍵字合併成一個查詢字串
     combined_query = " ".join(keywords)
@@ -38,9 +46,7 @@ def search_similar_keywords(keywords: List[str]) -> dict:
     # 將向量庫 ID 納入 URL，並使用冒號語法呼叫 query 功能
     vector_store_query_url = f"{VECTOR_STORE_URL}/{VECTOR_STORE_ID}"
     headers = {
-        "Authorization": f"Bearer {openai.api_key}",
-        "Content-Type": "application/json",
-        "OpenAI-Beta": "assistants=v2"  # 符合 Assistants API 的要求
+        "OpenAI-Beta": "assistants=v2"  # 符合 Assistants API 的要求 (Authorization 由 OpenAIClient 補上)
     }
     data = {
         "queries": [
@@ -51,11 +57,15 @@ def search_similar_keywords(keywords: List[str]) -> dict:
         ]
     }
 
-    response = requests.post(vector_store_query_url, headers=headers, json=data)
-    if response.status_code != 200:
-        raise Exception(f"Vector store query failed: {response.text}")
-    
-    results = response.json()
+    if vector_store is not None:
+        with tm.stage("vector_store.local_query"):
+            results = vector_store.query(data)
+    else:
+        with tm.api_call("vector_store.query") as span:
+            try:
+                results = oc.post_json(vector_store_query_url, data, headers=headers, span=span)
+            except oc.APIError as err:
+                raise Exception(f"Vector store query failed: {err.body}") from err
 
     # 4. 整理 Vector Store 回傳的資料作為上下文 (Context)
     top_contexts = []
@@ -86,15 +96,30 @@ def search_similar_keywords(keywords: List[str]) -> dict:
         "請回答對應的功能類別(5碼)、中文名稱、費用年。只以 JSON 回覆，不要多餘解釋。"
     )
 
-    completion = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=[
+    request = {
+        "model": "gpt-3.5-turbo",
+        "messages": [
             {"role": "system", "content": system_message},
             {"role": "user", "content": user_message}
         ],
-        temperature=0,
-        user=ASSISTANT_MODEL_ID,  # 根據需求設定；目前用於識別最終使用者
-    )
+        "temperature": 0,
+    }
+    cached = None
+    if use_cache:
+        cache = cache or get_default_cache()
+        cached = cache.get(request)
+
+    if cached is not None:
+        completion = cached
+        tm.record("api", "chat.completions", 0.0, model=request["model"], cache_hit=True)
+    else:
+        with tm.api_call("chat.completions", request["model"]) as span:
+            completion = oc.post_json(
+                oc.api_url("chat/completions"),
+                dict(request, user=ASSISTANT_MODEL_ID),  # 根據需求設定；目前用於識別最終使用者
+                span=span,
+            )
+            span.update(**tm.usage_fields(completion.get("usage")))
 
     answer_text = completion["choices"][0]["message"]["content"]
 
@@ -104,6 +129,10 @@ def search_similar_keywords(keywords: List[str]) -> dict:
     except Exception as e:
         raise ValueError("模型回傳內容無法解析成 JSON: \n" + answer_text) from e
 
+    # 只快取可解析的回覆
+    if use_cache and cached is None:
+        cache.put(request, completion)
+
     return answer_json
 
 if __name__ == "__main__":
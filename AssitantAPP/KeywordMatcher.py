@@ -0,0 +1,99 @@
+from collections import deque
+from typing import Dict, Iterator, List, Sequence
+
+import pandas as pd
+
+##############################################################################
+# 多關鍵字比對
+#   - AhoCorasick：一次掃描文字即可找出所有出現的關鍵字 (字面比對，非正規表示式)
+#   - KeywordYearIndex：CSV 載入時先整理出「品名 → 出現年度」，
+#     之後所有關鍵字共用一次 Aho-Corasick 掃描
+##############################################################################
+
+
+class AhoCorasick:
+    """以 dict 實作的 Aho-Corasick 自動機；find_all 回傳出現過的 pattern 索引。"""
+
+    def __init__(self, patterns: Sequence[str]):
+        self.patterns = list(patterns)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+
+        for pattern_id, pattern in enumerate(self.patterns):
+            if not pattern:
+                continue
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = nxt
+            self._output[state].append(pattern_id)
+
+        # 以 BFS 建立失敗連結，並合併後綴狀態的輸出
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+
+    def iter_matches(self, text: str) -> Iterator[int]:
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            yield from output[state]
+
+    def find_all(self, text: str) -> set:
+        return set(self.iter_matches(text))
+
+
+class KeywordYearIndex:
+    """
+    預先整理 DataFrame 中每個不重複的文字值會出現在哪些年度：
+      - 有 year_column (例如「年份」) 的長表格：該值所在列的年份
+      - 沒有年份欄的寬表格 (每欄一個年度)：該值所在的欄位名稱
+    lookup(keywords) 只需一次 Aho-Corasick 掃描所有不重複文字。
+    """
+
+    def __init__(self, df: pd.DataFrame, year_column: str = "年份"):
+        years_by_text: Dict[str, set] = {}
+        if year_column in df.columns:
+            for column in df.columns:
+                if column == year_column:
+                    continue
+                pairs = df[[column, year_column]].dropna(subset=[column]).drop_duplicates()
+                for text, year in zip(pairs[column].astype(str), pairs[year_column]):
+                    years_by_text.setdefault(text, set()).add(year)
+        else:
+            for column in df.columns:
+                for text in df[column].dropna().astype(str).unique():
+                    years_by_text.setdefault(text, set()).add(column)
+
+        self.texts = list(years_by_text)
+        self.years = [years_by_text[text] for text in self.texts]
+
+    def lookup(self, keywords: Sequence[str]) -> Dict[str, List]:
+        """回傳 {關鍵字: 排序後的出現年度}；沒有出現的關鍵字為空列表。"""
+        matcher = AhoCorasick(keywords)
+        found = [set() for _ in matcher.patterns]
+        for text, years in zip(self.texts, self.years):
+            for pattern_id in matcher.find_all(text):
+                found[pattern_id].update(years)
+
+        result = {}
+        for keyword, years in zip(matcher.patterns, found):
+            result.setdefault(keyword, set()).update(years)
+        return {keyword: sorted(years, key=str) for keyword, years in result.items()}
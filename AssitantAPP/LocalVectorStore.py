@@ -0,0 +1,315 @@
+import os
+import json
+import sqlite3
+import threading
+import numpy as np
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from EmbeddingBackend import EmbeddingBackend
+from EmbeddingCache import CACHE_DIR, text_hash
+from EmbeddingIndex import normalize_rows, top_k_indices
+
+##############################################################################
+# 本機向量庫 (與 OpenAI vector store 相同的查詢格式)
+#   - 向量：預先正規化的 float32 原始檔 (vectors-<n>.f32)，以 np.memmap 唯讀映射
+#   - metadata：同目錄的 SQLite (WAL)，items(id, row, metadata JSON) 與 meta 設定
+#   - 寫入 (add / upsert / delete / compact) 以 SQLite 的寫入鎖序列化：
+#       * 新向量一律附加到檔尾，寫入完成後才在同一個交易中更新 items，
+#         讀取端不會看到寫到一半的向量
+#       * upsert 既有 id 時改指向新的列，舊列成為空位，compact() 時回收
+#       * compact() 寫到新的向量檔再切換 (Windows 上無法取代已被映射的檔案)
+#   - 讀取端 (可多個行程) 每次查詢先比對 generation，有變動才重新映射：
+#     generation、meta 與 items 在同一個讀取交易中取得，向量檔、有效列與 列 -> id
+#     來自同一個版本；查詢結果的 id 由這份快照決定 (之後 compact() 重新編號也不會對錯)，
+#     metadata 再依 id 查詢 (查詢期間已刪除的 id 略過)
+#   - query(payload) 接受 {"queries": [{"query", "top_k"}]}，
+#     回傳 {"results": [{"query", "matches": [{"id", "score", "metadata": {"text", ...}}]}]}
+##############################################################################
+DEFAULT_STORE_DIR = os.path.join(CACHE_DIR, "vector_store")
+
+_SQL_BATCH = 500
+
+
+class _Snapshot(NamedTuple):
+    """同一個 generation 的向量、有效列與 列 -> id (整組一起替換，查詢中不會混到兩個版本)。"""
+    matrix: np.ndarray
+    live: np.ndarray
+    live_count: int
+    ids: np.ndarray
+
+
+def _empty_snapshot() -> _Snapshot:
+    return _Snapshot(np.empty((0, 0), dtype=np.float32), np.zeros(0, dtype=bool), 0, np.empty(0, dtype=object))
+
+
+class LocalVectorStore:
+    DB_FILE = "store.sqlite"
+
+    def __init__(self, directory: str = DEFAULT_STORE_DIR, backend: Optional[EmbeddingBackend] = None):
+        """
+        backend 用於 add() 未提供向量時，以及 query() 將查詢文字向量化；
+        同一個向量庫只能搭配同一個後端 (名稱記錄在 meta 中)。
+        """
+        self.directory = directory
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._generation = None
+        self._snapshot = _empty_snapshot()
+
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(
+            os.path.join(directory, self.DB_FILE), timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS items (
+                id       TEXT    PRIMARY KEY,
+                row      INTEGER NOT NULL UNIQUE,
+                metadata TEXT    NOT NULL
+            )
+            """
+        )
+        if backend is not None:
+            stored = self._meta().get("backend")
+            if stored and stored != backend.name:
+                raise ValueError(f"向量庫由 {stored} 建立，無法以 {backend.name} 查詢")
+
+    # ------------------------------------------------------------------
+    # 內部狀態
+    # ------------------------------------------------------------------
+    def _meta(self) -> Dict[str, str]:
+        return dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+
+    def _vectors_path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _generation_now(self) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return row[0] if row else None
+
+    def _refresh(self) -> _Snapshot:
+        """generation 有變動 (其他寫入者或本身寫入) 時重新映射向量檔與有效列，回傳目前的快照。"""
+        with self._lock:
+            while True:
+                # 同一個讀取交易：generation、meta 與 items 屬於同一個版本
+                self._conn.execute("BEGIN")
+                try:
+                    generation = self._generation_now()
+                    if generation == self._generation:
+                        return self._snapshot
+                    meta = self._meta()
+                    items = self._conn.execute("SELECT row, id FROM items").fetchall()
+                finally:
+                    self._conn.execute("COMMIT")
+
+                rows, dim = int(meta.get("rows", 0)), int(meta.get("dim", 0))
+                if rows and dim:
+                    path = self._vectors_path(meta["vectors_file"])
+                    try:
+                        matrix = np.asarray(np.memmap(path, dtype=np.float32, mode="r", shape=(rows, dim)))
+                    except FileNotFoundError:
+                        # 其他行程的 compact() 已提交並刪除這個版本的向量檔：改讀新版本
+                        if self._generation_now() != generation:
+                            continue
+                        raise
+                else:
+                    matrix = np.empty((0, dim), dtype=np.float32)
+                live = np.zeros(rows, dtype=bool)
+                ids = np.empty(rows, dtype=object)
+                for r, item_id in items:
+                    live[r] = True
+                    ids[r] = item_id
+                self._snapshot = _Snapshot(matrix, live, len(items), ids)
+                self._generation = generation
+                return self._snapshot
+
+    def _begin_write(self) -> Dict[str, str]:
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._meta()
+
+    def _commit_write(self, meta: Dict[str, str], **changes) -> None:
+        changes["generation"] = int(meta.get("generation", 0)) + 1
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [(k, str(v)) for k, v in changes.items()]
+        )
+        self._conn.execute("COMMIT")
+
+    # ------------------------------------------------------------------
+    # 寫入
+    # ------------------------------------------------------------------
+    def upsert(self, ids: Sequence[str], vectors: np.ndarray, metadata: Sequence[dict]) -> None:
+        """新增或取代指定 id 的向量與 metadata (metadata 應包含 "text")。"""
+        vectors = normalize_rows(np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1))
+        if len(ids) != len(metadata):
+            raise ValueError(f"ids ({len(ids)}) 與 metadata ({len(metadata)}) 的筆數不一致")
+        if not len(ids):
+            return
+        # 同一批中重複的 id 以最後一筆為準
+        last = {item_id: i for i, item_id in enumerate(ids)}
+        keep = sorted(last.values())
+        ids, vectors, metadata = [ids[i] for i in keep], vectors[keep], [metadata[i] for i in keep]
+
+        with self._lock:
+            meta = self._begin_write()
+            try:
+                dim = int(meta.get("dim", vectors.shape[1]))
+                if vectors.shape[1] != dim:
+                    raise ValueError(f"向量維度 {vectors.shape[1]} 與向量庫的 {dim} 不一致")
+                vectors_file = meta.get("vectors_file", "vectors-0.f32")
+                start = int(meta.get("rows", 0))
+                with open(self._vectors_path(vectors_file), "r+b" if start else "wb") as f:
+                    f.seek(start * dim * 4)
+                    f.write(vectors.tobytes())
+                    f.flush()
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO items (id, row, metadata) VALUES (?, ?, ?)",
+                    [
+                        (item_id, start + i, json.dumps(m, ensure_ascii=False))
+                        for i, (item_id, m) in enumerate(zip(ids, metadata))
+                    ],
+                )
+                changes = {"dim": dim, "vectors_file": vectors_file, "rows": start + len(ids)}
+                if self.backend is not None and "backend" not in meta:
+                    changes["backend"] = self.backend.name
+                self._commit_write(meta, **changes)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def add(
+        self,
+        texts: Sequence[str],
+        vectors: Optional[np.ndarray] = None,
+        metadata: Optional[Sequence[dict]] = None,
+        ids: Optional[Sequence[str]] = None,
+    ) -> List[str]:
+        """加入文字 (未提供向量時以 backend 向量化)；id 預設為文字的 SHA-256，回傳 id 列表。"""
+        if vectors is None:
+            if self.backend is None:
+                raise ValueError("未提供向量時需要指定 backend")
+            vectors = self.backend.embed(texts)
+        ids = list(ids) if ids is not None else [text_hash(t) for t in texts]
+        if metadata is None:
+            metadata = [{} for _ in texts]
+        metadata = [dict(m, text=t) for m, t in zip(metadata, texts)]
+        self.upsert(ids, vectors, metadata)
+        return ids
+
+    def delete(self, ids: Sequence[str]) -> int:
+        """刪除指定 id，回傳實際刪除的筆數。"""
+        with self._lock:
+            meta = self._begin_write()
+            try:
+                deleted = 0
+                for i in range(0, len(ids), _SQL_BATCH):
+                    part = list(ids[i:i + _SQL_BATCH])
+                    marks = ",".join("?" * len(part))
+                    deleted += self._conn.execute(f"DELETE FROM items WHERE id IN ({marks})", part).rowcount
+                self._commit_write(meta)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return deleted
+
+    def compact(self) -> None:
+        """把有效列依序寫到新的向量檔，回收 upsert / delete 留下的空位。"""
+        with self._lock:
+            meta = self._begin_write()
+            try:
+                rows, dim = int(meta.get("rows", 0)), int(meta.get("dim", 0))
+                items = self._conn.execute("SELECT id, row FROM items ORDER BY row").fetchall()
+                old_file = meta.get("vectors_file", "vectors-0.f32")
+                new_file = f"vectors-{int(meta.get('generation', 0)) + 1}.f32"
+                if rows:
+                    source = np.memmap(self._vectors_path(old_file), dtype=np.float32, mode="r", shape=(rows, dim))
+                    with open(self._vectors_path(new_file), "wb") as f:
+                        for i in range(0, len(items), 65536):
+                            f.write(np.ascontiguousarray(source[[r for _, r in items[i:i + 65536]]]).tobytes())
+                    del source
+                self._conn.execute("UPDATE items SET row = -row - 1")  # 暫時避開 UNIQUE 衝突
+                self._conn.executemany(
+                    "UPDATE items SET row = ? WHERE id = ?", [(i, item_id) for i, (item_id, _) in enumerate(items)]
+                )
+                self._commit_write(meta, vectors_file=new_file, rows=len(items))
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        # 舊檔可能仍被其他讀取端映射 (Windows 上無法刪除)，刪不掉時留待下次 compact
+        for name in os.listdir(self.directory):
+            if name.startswith("vectors-") and name.endswith(".f32") and name != new_file:
+                try:
+                    os.remove(self._vectors_path(name))
+                except OSError:
+                    pass
+
+    # ------------------------------------------------------------------
+    # 查詢
+    # ------------------------------------------------------------------
+    def __len__(self) -> int:
+        return self._refresh().live_count
+
+    @property
+    def dead_rows(self) -> int:
+        """upsert / delete 留下、尚未 compact 的空位數。"""
+        snapshot = self._refresh()
+        return len(snapshot.live) - snapshot.live_count
+
+    def search(self, query_vecs: np.ndarray, top_k: int = 5) -> List[List[dict]]:
+        """每個查詢向量 (每列一個) 回傳 [{"id", "score", "metadata"}]，由高到低。"""
+        matrix, live, live_count, ids = self._refresh()
+        queries = normalize_rows(np.atleast_2d(np.asarray(query_vecs, dtype=np.float32)))
+        if live_count == 0:
+            return [[] for _ in range(queries.shape[0])]
+
+        scores = queries @ matrix.T
+        if live_count < len(live):
+            scores[:, ~live] = -np.inf
+        idx = top_k_indices(scores, min(top_k, live_count))
+
+        # id 取自與向量同一版本的快照；metadata 依 id 查詢，不受之後的重新編號影響
+        wanted = sorted(set(ids[idx.ravel()].tolist()))
+        found = {}
+        with self._lock:
+            for i in range(0, len(wanted), _SQL_BATCH):
+                part = wanted[i:i + _SQL_BATCH]
+                marks = ",".join("?" * len(part))
+                for item_id, meta in self._conn.execute(
+                    f"SELECT id, metadata FROM items WHERE id IN ({marks})", part
+                ):
+                    found[item_id] = json.loads(meta)
+
+        results = []
+        for row_idx, row_scores in zip(idx, np.take_along_axis(scores, idx, axis=-1)):
+            # 查詢期間被其他寫入者刪除的 id 略過
+            results.append([
+                {"id": ids[r], "score": float(s), "metadata": found[ids[r]]}
+                for r, s in zip(row_idx.tolist(), row_scores) if ids[r] in found
+            ])
+        return results
+
+    def query(self, payload: dict) -> dict:
+        """與 OpenAI vector store 查詢相同的輸入 / 輸出格式。"""
+        if self.backend is None:
+            raise ValueError("query() 需要 backend 將查詢文字向量化")
+        queries = payload.get("queries", [])
+        texts = [q.get("query", "") for q in queries]
+        if not texts:
+            return {"results": []}
+        top_ks = [int(q.get("top_k", 5)) for q in queries]
+        hits = self.search(self.backend.embed(texts), max(top_ks))
+        return {
+            "results": [
+                {"query": text, "matches": matches[:top_k]}
+                for text, top_k, matches in zip(texts, top_ks, hits)
+            ]
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._snapshot = _empty_snapshot()
+            self._generation = None
+            self._conn.close()
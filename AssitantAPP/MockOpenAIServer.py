@@ -0,0 +1,203 @@
+import re
+import ssl
+import json
+import time
+import base64
+import random
+import hashlib
+import threading
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+##############################################################################
+# 本機 OpenAI 替身伺服器 (僅供效能測試 / 離線開發使用)
+#   - POST /v1/embeddings：依文字雜湊產生固定的假向量
+#   - POST /v1/chat/completions：回傳 SimilarProduct 格式的假 JSON 回覆
+#   - POST /v1/vector-stores/<id>：依假向量的相似度，從 documents 中回傳前 top_k 段文字
+#     (FileSearch_VectorStore 的查詢格式)；documents 為空時產生固定的假段落
+#   - latency：每個請求的模擬延遲 (秒)
+#   - error_rate：隨機回傳 429 的比例
+#   - certfile / keyfile：提供時改以 HTTPS 服務 (量測 TLS 交握成本)
+##############################################################################
+
+
+def fake_embedding(text: str, dim: int = 1536) -> np.ndarray:
+    """同一段文字永遠得到同一個單位向量。"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vec = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, dim=1536, seed=0, documents=None,
+        certfile=None, keyfile=None,
+    ):
+        super().__init__((host, port), _Handler)
+        self.tls = certfile is not None
+        if self.tls:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.socket = context.wrap_socket(self.socket, server_side=True)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.dim = dim
+        self.set_documents(documents or [])
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"{'https' if self.tls else 'http'}://{host}:{port}/v1"
+
+    def start(self) -> "MockOpenAIServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def set_documents(self, documents) -> None:
+        """設定向量庫查詢所用的文件 (預先計算假向量)。"""
+        self.documents = list(documents)
+        self._doc_vectors = np.stack([fake_embedding(t, self.dim) for t in self.documents]) if self.documents else None
+
+    def should_rate_limit(self) -> bool:
+        with self._lock:
+            self.request_count += 1
+            limited = self._random.random() < self.error_rate
+            if limited:
+                self.rate_limited_count += 1
+            return limited
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 標頭與內容分兩次寫出，不關閉 Nagle 時 keep-alive 連線每個請求會多等約 40 ms (delayed ACK)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        server: MockOpenAIServer = self.server
+
+        if server.latency:
+            time.sleep(server.latency)
+        if server.should_rate_limit():
+            self._send_json(429, {"error": {"message": "Rate limit reached (mock)", "type": "requests"}})
+            return
+
+        path = self.path.rstrip("/")
+        if path.endswith("/embeddings"):
+            self._send_json(200, _embeddings_response(payload, server.dim))
+        elif path.endswith("/chat/completions"):
+            self._send_json(200, _chat_response(payload))
+        elif "/vector-stores/" in path or "/vector_stores/" in path:
+            self._send_json(200, _vector_store_response(payload, server))
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+
+def _embeddings_response(payload: dict, dim: int) -> dict:
+    inputs = payload.get("input", [])
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    use_base64 = payload.get("encoding_format") == "base64"
+
+    data = []
+    for i, text in enumerate(inputs):
+        vec = fake_embedding(text, dim)
+        embedding = base64.b64encode(vec.tobytes()).decode("ascii") if use_base64 else vec.tolist()
+        data.append({"object": "embedding", "index": i, "embedding": embedding})
+
+    tokens = sum(len(t) for t in inputs)
+    return {
+        "object": "list",
+        "data": data,
+        "model": payload.get("model", ""),
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    }
+
+
+def _vector_store_response(payload: dict, server: MockOpenAIServer) -> dict:
+    results = []
+    for query in payload.get("queries", []):
+        text, top_k = query.get("query", ""), int(query.get("top_k", 5))
+        if server._doc_vectors is not None:
+            scores = server._doc_vectors @ fake_embedding(text, server.dim)
+            order = np.argsort(-scores)[:top_k]
+            matches = [{"score": float(scores[i]), "metadata": {"text": server.documents[i]}} for i in order]
+        else:
+            matches = [{"score": 1.0 / (i + 1), "metadata": {"text": f"{text} 相關段落 {i + 1}"}} for i in range(top_k)]
+        results.append({"query": text, "matches": matches})
+    return {"results": results}
+
+
+_KEYWORD_PATTERN = re.compile(r"「(.+?)」")
+
+
+def _chat_response(payload: dict) -> dict:
+    """
+    回覆內容為 {"關鍵字", "出現年度", "相關產品"} JSON 字串：
+    關鍵字取自使用者訊息中的「...」，相關產品取產品清單的前 3 行。
+    """
+    messages = payload.get("messages", [])
+    user_text = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+    match = _KEYWORD_PATTERN.search(user_text)
+    keyword = match.group(1) if match else ""
+    lines = user_text.split("：\n", 1)[-1].splitlines()
+    content = json.dumps(
+        {"關鍵字": keyword, "出現年度": [], "相關產品": [line for line in lines if line][:3]},
+        ensure_ascii=False,
+    )
+
+    prompt_tokens = sum(len(m.get("content", "")) for m in messages)
+    completion_tokens = len(content)
+    return {
+        "id": f"chatcmpl-mock-{hashlib.sha256(user_text.encode('utf-8')).hexdigest()[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model", ""),
+        "choices": [
+            {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="本機 OpenAI 替身伺服器")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--dim", type=int, default=1536)
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(port=args.port, latency=args.latency, error_rate=args.error_rate, dim=args.dim)
+    print(f"Mock OpenAI server listening on {server.url}")
+    server.serve_forever()
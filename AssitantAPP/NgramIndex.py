@@ -0,0 +1,103 @@
+import re
+import math
+import unicodedata
+import numpy as np
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+
+##############################################################################
+# 字元 n-gram 倒排索引 (BM25 計分)
+#   - 適用中英混合的品名：不需要斷詞，中文以 2~3 字、英文以 2~3 字母片段比對
+#   - 文字先經 NFKC 正規化 (全形轉半形)、轉小寫、合併空白
+#   - 查詢只走過查詢字串中 n-gram 的倒排列表，與資料總筆數無關
+##############################################################################
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    return _SPACES.sub(" ", unicodedata.normalize("NFKC", str(text)).lower()).strip()
+
+
+def char_ngrams(text: str, n_min: int = 2, n_max: int = 3) -> List[str]:
+    text = normalize_text(text)
+    grams = []
+    for n in range(n_min, n_max + 1):
+        grams.extend(text[i:i + n] for i in range(len(text) - n + 1))
+    return [g for g in grams if not g.isspace()]
+
+
+class NgramIndex:
+    """
+    對 docs 建立字元 n-gram 倒排索引；search() 回傳 (文件索引, BM25 分數)。
+    查詢字串短於 n_min 時改用單字 (unigram) 比對。
+    """
+
+    def __init__(self, docs: Sequence[str], n_min: int = 2, n_max: int = 3, k1: float = 1.2, b: float = 0.75):
+        self.n_min = n_min
+        self.n_max = n_max
+        self.k1 = k1
+        self.b = b
+        self.size = len(docs)
+
+        # 先收集 (n-gram 編號, 文件, 次數)，再依 n-gram 排序成連續的倒排列表
+        self._vocab: Dict[str, int] = {}
+        gram_ids: List[int] = []
+        tfs: List[int] = []
+        doc_sizes = np.zeros(len(docs), dtype=np.int64)
+        for doc_id, doc in enumerate(docs):
+            counts = Counter(char_ngrams(doc, 1, n_max))
+            gram_ids.extend(self._vocab.setdefault(gram, len(self._vocab)) for gram in counts)
+            tfs.extend(counts.values())
+            doc_sizes[doc_id] = len(counts)
+
+        gram_ids = np.asarray(gram_ids, dtype=np.int32)
+        tfs = np.asarray(tfs, dtype=np.float32)
+        doc_ids = np.repeat(np.arange(len(docs), dtype=np.int32), doc_sizes)
+        gram_lengths = np.fromiter((len(g) for g in self._vocab), dtype=np.int32, count=len(self._vocab))
+
+        lengths = np.bincount(doc_ids, weights=tfs * (gram_lengths[gram_ids] >= n_min), minlength=len(docs))
+        self.doc_lengths = lengths.astype(np.float32)
+        self.avg_length = float(lengths.mean()) if len(docs) else 0.0
+        self._norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / max(self.avg_length, 1e-6))
+
+        order = np.argsort(gram_ids, kind="stable")
+        self._posting_docs = doc_ids[order]
+        self._posting_tfs = tfs[order]
+        self._offsets = np.zeros(len(self._vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(gram_ids, minlength=len(self._vocab)), out=self._offsets[1:])
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _query_grams(self, query: str) -> Counter:
+        grams = char_ngrams(query, self.n_min, self.n_max)
+        if not grams:
+            grams = char_ngrams(query, 1, 1)
+        return Counter(grams)
+
+    def scores(self, query: str) -> np.ndarray:
+        """回傳每份文件對 query 的 BM25 分數 (未命中者為 0)。"""
+        scores = np.zeros(self.size, dtype=np.float32)
+        if not self.size:
+            return scores
+        norm = self._norm
+        for gram, qtf in self._query_grams(query).items():
+            gram_id = self._vocab.get(gram)
+            if gram_id is None:
+                continue
+            start, end = self._offsets[gram_id], self._offsets[gram_id + 1]
+            docs, tf = self._posting_docs[start:end], self._posting_tfs[start:end]
+            idf = math.log(1 + (self.size - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores[docs] += qtf * idf * tf * (self.k1 + 1) / (tf + norm[docs])
+        return scores
+
+    def search(self, query: str, top_n: int = 10) -> List[Tuple[int, float]]:
+        """回傳分數大於 0 的前 top_n 筆 (文件索引, 分數)，由高到低。"""
+        if top_n <= 0:
+            return []
+        scores = self.scores(query)
+        hits = np.flatnonzero(scores)
+        if len(hits) > top_n:
+            hits = hits[np.argpartition(-scores[hits], top_n - 1)[:top_n]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(int(i), float(scores[i])) for i in hits]
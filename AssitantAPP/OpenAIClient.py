@@ -0,0 +1,311 @@
+import os
+import json
+import time
+import asyncio
+import threading
+import collections
+import weakref
+import httpx
+from typing import Awaitable, Callable, Dict, Optional
+
+from RateLimit import RETRYABLE_STATUS, backoff_delay
+
+##############################################################################
+# 共用的 OpenAI HTTP 用戶端 (FileSearch / FileSearch_VectorStore / SimilarProduct)
+#   - 同步：整個行程共用一個 httpx.Client (keep-alive 連線池，執行緒安全)
+#   - 非同步：每個 event loop 一個 httpx.AsyncClient (連線不能跨 loop 使用)，
+#     用完以 aclose() 關閉
+#   - 重試：RETRYABLE_STATUS 與連線錯誤依 RetryPolicy 退避後重試；
+#     退避等待時不佔用並行名額
+#   - 並行上限：同步與非同步請求共用 MAX_CONCURRENCY 個名額 (先到先得)
+#   - OPENAI_HTTP2=1 且已安裝 h2 時使用 HTTP/2
+#   - API_BASE / API_KEY 可直接修改 (例如指向本機替身伺服器)；
+#     API_KEY 為 None 時使用呼叫當下的環境變數 OPENAI_API_KEY
+##############################################################################
+API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
+API_KEY: Optional[str] = None
+MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+MAX_RETRIES = 5
+TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+
+
+class APIError(Exception):
+    """非 2xx 回應 (或重試用盡的連線錯誤)；status 為 None 表示沒有收到回應。"""
+
+    def __init__(self, status: Optional[int], body: str = ""):
+        super().__init__(f"HTTP {status}: {body[:500]}" if status is not None else body)
+        self.status = status
+        self.body = body
+
+
+class RetryPolicy:
+    """預設重試策略：指數退避 + jitter，伺服器有給 Retry-After 時優先採用。"""
+
+    def before_attempt(self) -> float:
+        """送出前需要再等待的秒數 (共用的暫停狀態)。"""
+        return 0.0
+
+    def delay(self, attempt: int, retry_after: Optional[str]) -> float:
+        """第 attempt 次 (從 0 開始) 失敗後，重試前等待的秒數。"""
+        return backoff_delay(attempt, retry_after=retry_after)
+
+    def on_success(self) -> None:
+        pass
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+
+class ConcurrencyCap:
+    """
+    同步 (with) 與非同步 (async with) 共用的並行名額，依等待順序 (FIFO) 分配。
+    釋放名額時直接交給下一個等待者，不會被後來的請求插隊。
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._lock = threading.Lock()
+        self._waiters = collections.deque()  # threading.Event 或 (loop, future)
+
+    def _try_acquire(self, waiter) -> bool:
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return True
+            self._waiters.append(waiter)
+            return False
+
+    def release(self) -> None:
+        with self._lock:
+            if not self._waiters:
+                self.active -= 1
+                return
+            waiter = self._waiters.popleft()
+        if isinstance(waiter, threading.Event):
+            waiter.set()
+        else:
+            loop, future = waiter
+            try:
+                loop.call_soon_threadsafe(self._hand_over, future)
+            except RuntimeError:  # loop 已關閉
+                self.release()
+
+    def _hand_over(self, future: asyncio.Future) -> None:
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def __enter__(self) -> "ConcurrencyCap":
+        event = threading.Event()
+        if not self._try_acquire(event):
+            event.wait()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.release()
+        return False
+
+    async def __aenter__(self) -> "ConcurrencyCap":
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+        if self._try_acquire(waiter):
+            return self
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                queued = waiter in self._waiters
+                if queued:
+                    self._waiters.remove(waiter)
+            if not queued and future.done() and not future.cancelled():
+                self.release()  # 名額已交給這個 future，但呼叫者被取消
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        self.release()
+        return False
+
+
+_cap = ConcurrencyCap(MAX_CONCURRENCY)
+_options: Dict = {"pooled": True, "http2": os.getenv("OPENAI_HTTP2") == "1", "verify": True}
+_client: Optional[httpx.Client] = None
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_client_lock = threading.Lock()
+
+
+def _client_kwargs() -> dict:
+    http2 = _options["http2"]
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print("未安裝 h2，改用 HTTP/1.1 (pip install httpx[http2])")
+            http2 = _options["http2"] = False
+    return {
+        "http2": http2,
+        "verify": _options["verify"],
+        "timeout": TIMEOUT,
+        "limits": httpx.Limits(max_connections=_cap.limit, max_keepalive_connections=_cap.limit),
+    }
+
+
+def configure(
+    pooled: Optional[bool] = None,
+    http2: Optional[bool] = None,
+    verify=None,
+    max_concurrency: Optional[int] = None,
+) -> None:
+    """
+    變更連線設定並關閉現有的同步連線池 (非同步用戶端在各自的 loop 結束時關閉)。
+    pooled=False 時每個請求都建立新的連線 (僅供比較效能)。
+    """
+    global _client, _cap
+    with _client_lock:
+        for key, value in (("pooled", pooled), ("http2", http2), ("verify", verify)):
+            if value is not None:
+                _options[key] = value
+        if max_concurrency is not None:
+            _cap = ConcurrencyCap(max_concurrency)
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def get_client() -> httpx.Client:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = httpx.Client(**_client_kwargs())
+        return _client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """目前 event loop 的 AsyncClient (同一個 loop 中的請求共用連線)。"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = httpx.AsyncClient(**_client_kwargs())
+    return client
+
+
+async def aclose() -> None:
+    """關閉目前 event loop 的 AsyncClient；在 asyncio.run 的最後呼叫。"""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def api_url(path: str) -> str:
+    return f"{API_BASE.rstrip('/')}/{path.lstrip('/')}"
+
+
+def auth_headers(api_key: Optional[str] = None) -> Dict[str, str]:
+    key = api_key or API_KEY or os.getenv("OPENAI_API_KEY", "")
+    return {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}
+
+
+def _prepare(payload: dict, headers: Optional[Dict[str, str]]):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    merged = auth_headers()
+    merged.update(headers or {})
+    return body, merged
+
+
+def _result(response: httpx.Response, attempt: int, body: bytes, span) -> dict:
+    if span is not None:
+        span.update(retries=attempt, bytes_sent=len(body), bytes_received=len(response.content))
+    return response.json()
+
+
+def post_json(
+    url: str,
+    payload: dict,
+    headers: Optional[Dict[str, str]] = None,
+    max_retries: int = MAX_RETRIES,
+    policy: RetryPolicy = DEFAULT_POLICY,
+    span=None,
+) -> dict:
+    """
+    同步 POST JSON 並回傳解析後的回應；headers 會覆蓋預設的 Authorization / Content-Type。
+    span (Telemetry) 有值時補上 retries / bytes_sent / bytes_received。
+    """
+    body, headers = _prepare(payload, headers)
+    for attempt in range(max_retries + 1):
+        wait = policy.before_attempt()
+        if wait > 0:
+            time.sleep(wait)
+        response, error = None, None
+        with _cap:
+            try:
+                if _options["pooled"]:
+                    response = get_client().post(url, content=body, headers=headers)
+                else:
+                    with httpx.Client(**_client_kwargs()) as client:
+                        response = client.post(url, content=body, headers=headers)
+            except httpx.TransportError as err:
+                error = err
+
+        if response is not None and response.is_success:
+            policy.on_success()
+            return _result(response, attempt, body, span)
+        status = response.status_code if response is not None else None
+        if (status is not None and status not in RETRYABLE_STATUS) or attempt == max_retries:
+            if span is not None:
+                span.update(retries=attempt)
+            raise APIError(status, response.text if response is not None else repr(error)) from error
+        time.sleep(policy.delay(attempt, response.headers.get("Retry-After") if response is not None else None))
+
+
+async def apost_json(
+    url: str,
+    payload: dict,
+    headers: Optional[Dict[str, str]] = None,
+    max_retries: int = MAX_RETRIES,
+    policy: RetryPolicy = DEFAULT_POLICY,
+    span=None,
+    before_send: Optional[Callable[[], Awaitable]] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+) -> dict:
+    """
+    post_json 的非同步版本。before_send 在每次送出前 await (例如 RateLimiter 的額度)，
+    semaphore 為呼叫端自己的並行限制，只在請求進行中佔用。
+    """
+    body, headers = _prepare(payload, headers)
+    client = get_async_client()
+    for attempt in range(max_retries + 1):
+        wait = policy.before_attempt()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        if before_send is not None:
+            await before_send()
+        response, error = None, None
+        async with semaphore or _NO_LIMIT, _cap:
+            try:
+                response = await client.post(url, content=body, headers=headers)
+            except httpx.TransportError as err:
+                error = err
+
+        if response is not None and response.is_success:
+            policy.on_success()
+            return _result(response, attempt, body, span)
+        status = response.status_code if response is not None else None
+        if (status is not None and status not in RETRYABLE_STATUS) or attempt == max_retries:
+            if span is not None:
+                span.update(retries=attempt)
+            raise APIError(status, response.text if response is not None else repr(error)) from error
+        await asyncio.sleep(policy.delay(attempt, response.headers.get("Retry-After") if response is not None else None))
+
+
+class _NoLimit:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NO_LIMIT = _NoLimit()
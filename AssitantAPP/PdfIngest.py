@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import hashlib
+from typing import Dict, Optional
+
+import FileSearch as fs
+import Telemetry as tm
+from EmbeddingCache import CACHE_DIR
+from EmbeddingIndex import EmbeddingIndex
+
+##############################################################################
+# 增量式 PDF 匯入
+#   - manifest.json 記錄每個 PDF 的 (檔名, 大小, 修改時間, 內容 SHA-256)
+#   - chunk 與向量存於 EmbeddingIndex (vectors.npy + chunks.json)
+#   - 只解析、embed 新增或內容有變動的 PDF；已刪除的 PDF 會從索引移除
+#   - 沒有任何變動時只需 stat 檔案並載入索引
+##############################################################################
+DEFAULT_STORE_DIR = os.path.join(CACHE_DIR, "pdf_index")
+MANIFEST_FILE = "manifest.json"
+INDEX_VERSION = 2  # chunk metadata 格式變更時遞增，舊索引會自動重建
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _scan_folder(pdf_folder: str) -> Dict[str, os.stat_result]:
+    return {
+        name: os.stat(os.path.join(pdf_folder, name))
+        for name in os.listdir(pdf_folder)
+        if name.lower().endswith(".pdf")
+    }
+
+
+def _load_manifest(store_dir: str) -> dict:
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_manifest(store_dir: str, manifest: dict) -> None:
+    os.makedirs(store_dir, exist_ok=True)
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def ingest_folder(
+    pdf_folder: str,
+    store_dir: str = DEFAULT_STORE_DIR,
+    model: str = "text-embedding-ada-002",
+    chunk_size: int = 800,
+    chunk_overlap: int = 100,
+    chunk_unit: str = "char",
+    workers: Optional[int] = None,
+    **embed_kwargs,
+) -> EmbeddingIndex:
+    """
+    將 pdf_folder 內的 PDF 同步到 store_dir 的持久化索引並回傳 EmbeddingIndex。
+    workers 為平行解析 PDF 的行程數 (預設為 CPU 核心數，1 表示不使用行程池)；
+    embed_kwargs 會傳給 fs.get_embeddings_for_chunks (例如 batch_size、max_workers)。
+    chunk_unit 為 "char" 或 "token"。model 或切分參數改變時會整個重建。
+    """
+    start = time.perf_counter()
+    config = {
+        "version": INDEX_VERSION,
+        "model": model,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "chunk_unit": chunk_unit,
+    }
+
+    manifest = _load_manifest(store_dir)
+    if manifest.get("config") == config and EmbeddingIndex.exists(store_dir):
+        index = EmbeddingIndex.load(store_dir)
+        old_files = manifest.get("files", {})
+    else:
+        index = EmbeddingIndex.from_embedded_chunks([])
+        old_files = {}
+
+    # 1. 比對 manifest：大小與修改時間相同視為未變動，否則再比對內容雜湊
+    current = _scan_folder(pdf_folder)
+    files, to_parse = {}, []
+    for name, st in sorted(current.items()):
+        entry = old_files.get(name)
+        if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            files[name] = entry
+            continue
+        digest = _file_sha256(os.path.join(pdf_folder, name))
+        files[name] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}
+        if not (entry and entry["sha256"] == digest):
+            to_parse.append(name)
+    removed = [name for name in old_files if name not in current]
+
+    # 2. 移除已刪除或需重新解析的檔案
+    stale = set(removed) | set(to_parse)
+    if stale:
+        index = index.select(i for i, meta in enumerate(index.metadata) if meta.get("file") not in stale)
+
+    # 3. 解析並 embed 新增 / 變動的檔案
+    if to_parse:
+        texts, metadata, timings = [], [], []
+        paths = [os.path.join(pdf_folder, name) for name in to_parse]
+        for path, records, seconds in fs.iter_pdf_chunks_parallel(
+            paths, chunk_size, chunk_overlap, max_workers=workers, unit=chunk_unit
+        ):
+            name = os.path.basename(path)
+            print(f"已讀取與切分 PDF：{name} ({len(records)} chunks, {seconds:.2f} s)")
+            texts.extend(record.text for record in records)
+            metadata.extend(record.to_metadata() for record in records)
+            timings.append((seconds, name))
+        slowest = ", ".join(f"{name} {sec:.2f}s" for sec, name in sorted(timings, reverse=True)[:3])
+        print(f"解析最慢的 PDF：{slowest}")
+        if texts:
+            embedded = fs.get_embeddings_for_chunks(texts, model=model, **embed_kwargs)
+            index = index.extend(texts, [vec for _, vec in embedded], metadata)
+
+    if stale:
+        index.save(store_dir)
+    if stale or files != old_files:
+        _save_manifest(store_dir, {"config": config, "files": files})
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    tm.record(
+        "stage", "ingest", elapsed_ms / 1000,
+        parsed=len(to_parse), removed=len(removed), unchanged=len(current) - len(to_parse), chunks=len(index),
+    )
+    print(
+        f"PDF 匯入完成：新增/變動 {len(to_parse)}、刪除 {len(removed)}、"
+        f"未變動 {len(current) - len(to_parse)}，共 {len(index)} 個 chunk ({elapsed_ms:.1f} ms)"
+    )
+    return index
+
+
+if __name__ == "__main__":
+    pdf_folder = os.getenv("PDFfloder_PATH")
+    ingest_folder(pdf_folder)
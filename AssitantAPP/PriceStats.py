@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Tuple
+
+from CatalogIndex import CATEGORY_COLUMN, CODE_COLUMN
+
+##############################################################################
+# 支付點數統計 (供議價參考)
+#   - 以 (特材代碼前五碼, 核價類別名稱, 年份) 分組，一次 groupby 算出
+#     筆數 / 最低 / P10 / P25 / 中位數 / P75 / P90 / 最高 / 平均
+#   - 年增率：中位數與同一 (五碼, 核價類別) 前一個有資料年度的變化率
+#   - 申請者件數：(五碼, 核價類別, 年份, 申請者簡稱) 的筆數
+#   - 結果為每組一列的小表格；查詢只取對應的列
+#   - 新增一個調查年度時以 update() 只計算新年度的分組
+##############################################################################
+YEAR_COLUMN = "年份"
+PRICE_COLUMN = "支付點數"
+APPLICANT_COLUMN = "申請者簡稱"
+GROUP_KEYS = [CODE_COLUMN, CATEGORY_COLUMN, YEAR_COLUMN]
+
+PERCENTILES = {"P10": 0.10, "P25": 0.25, "中位數": 0.50, "P75": 0.75, "P90": 0.90}
+STAT_COLUMNS = ["筆數", "最低", "P10", "P25", "中位數", "P75", "P90", "最高", "平均", "年增率"]
+
+
+def _key_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """取出統計需要的欄位並統一型別；沒有年份的列不列入統計。"""
+    frame = pd.DataFrame({
+        CODE_COLUMN: df[CODE_COLUMN].astype(str).astype("category"),
+        CATEGORY_COLUMN: df[CATEGORY_COLUMN].astype("category"),
+        YEAR_COLUMN: pd.to_numeric(df[YEAR_COLUMN], errors="coerce"),
+        PRICE_COLUMN: pd.to_numeric(df[PRICE_COLUMN], errors="coerce"),
+        APPLICANT_COLUMN: df[APPLICANT_COLUMN].astype("category"),
+    })
+    frame = frame.dropna(subset=[YEAR_COLUMN])
+    frame[YEAR_COLUMN] = frame[YEAR_COLUMN].astype(np.int16)
+    return frame
+
+
+def compute_group_stats(frame: pd.DataFrame) -> pd.DataFrame:
+    """每個 (五碼, 核價類別, 年份) 一列的支付點數統計 (不含年增率)。"""
+    grouped = frame.dropna(subset=[PRICE_COLUMN]).groupby(GROUP_KEYS, observed=True, sort=True)[PRICE_COLUMN]
+    stats = grouped.agg(["count", "min", "max", "mean"])
+    stats.columns = ["筆數", "最低", "最高", "平均"]
+    quantiles = grouped.quantile(list(PERCENTILES.values())).unstack()
+    quantiles.columns = list(PERCENTILES)
+    stats = stats.join(quantiles)
+    stats["筆數"] = stats["筆數"].astype(np.int32)
+    return stats.reset_index()
+
+
+def compute_applicant_counts(frame: pd.DataFrame) -> pd.DataFrame:
+    keys = GROUP_KEYS + [APPLICANT_COLUMN]
+    counts = frame.dropna(subset=[APPLICANT_COLUMN]).groupby(keys, observed=True, sort=True).size()
+    return counts.astype(np.int32).rename("筆數").reset_index()
+
+
+def _concat_sorted(tables, keys) -> pd.DataFrame:
+    table = pd.concat(tables, ignore_index=True)
+    for column in keys:
+        if column != YEAR_COLUMN:
+            table[column] = table[column].astype(str).astype("category")
+    return table.sort_values(keys, kind="stable").reset_index(drop=True)
+
+
+def _group_rows(table: pd.DataFrame) -> Dict[Tuple[str, str], np.ndarray]:
+    return table.groupby([CODE_COLUMN, CATEGORY_COLUMN], observed=True, sort=False).indices
+
+
+class PriceStats:
+    """
+    stats:      每個 (五碼, 核價類別, 年份) 一列，欄位為 STAT_COLUMNS
+    applicants_table: 每個 (五碼, 核價類別, 年份, 申請者簡稱) 一列的筆數
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        frame = _key_frame(df)
+        self.stats = compute_group_stats(frame)
+        self.applicants_table = compute_applicant_counts(frame)
+        self._finalize()
+
+    def _finalize(self) -> None:
+        # 依年份排序後，同組的前一列即為前一個有資料的年度
+        self.stats["年增率"] = self.stats.groupby(
+            [CODE_COLUMN, CATEGORY_COLUMN], observed=True, sort=False
+        )["中位數"].pct_change()
+        self.stats = self.stats[GROUP_KEYS + STAT_COLUMNS]
+        self._stat_rows = _group_rows(self.stats)
+        self._applicant_rows = _group_rows(self.applicants_table)
+
+    @property
+    def years(self) -> list:
+        return sorted(self.stats[YEAR_COLUMN].unique().tolist())
+
+    def update(self, new_rows: pd.DataFrame) -> None:
+        """
+        加入新調查年度的資料，只計算新資料的分組。
+        年份已存在於統計表時無法只做增量計算，請以完整資料重新建立 PriceStats。
+        """
+        frame = _key_frame(new_rows)
+        overlap = sorted(set(frame[YEAR_COLUMN].unique().tolist()) & set(self.years))
+        if overlap:
+            raise ValueError(f"年份 {overlap} 已在統計表中，請以完整資料重新建立 PriceStats")
+        self.stats = _concat_sorted([self.stats, compute_group_stats(frame)], GROUP_KEYS)
+        self.applicants_table = _concat_sorted(
+            [self.applicants_table, compute_applicant_counts(frame)], GROUP_KEYS + [APPLICANT_COLUMN]
+        )
+        self._finalize()
+
+    def summary(self, code: str, category: str) -> pd.DataFrame:
+        """回傳該 (五碼, 核價類別) 各年度的統計，依年份排序。"""
+        rows = self._stat_rows.get((code, category), np.empty(0, dtype=np.intp))
+        return self.stats.iloc[rows][[YEAR_COLUMN] + STAT_COLUMNS]
+
+    def applicants(self, code: str, category: str) -> pd.DataFrame:
+        """回傳申請者 × 年份的筆數表，最後一欄為合計，依合計由多到少排序。"""
+        rows = self._applicant_rows.get((code, category), np.empty(0, dtype=np.intp))
+        counts = self.applicants_table.iloc[rows]
+        if counts.empty:
+            return pd.DataFrame()
+        index = pd.MultiIndex.from_arrays(
+            [counts[APPLICANT_COLUMN].astype(str).to_numpy(), counts[YEAR_COLUMN].to_numpy()],
+            names=[APPLICANT_COLUMN, YEAR_COLUMN],
+        )
+        table = pd.Series(counts["筆數"].to_numpy(), index=index).unstack(fill_value=0)
+        table["合計"] = table.sum(axis=1)
+        return table.sort_values("合計", ascending=False, kind="stable")
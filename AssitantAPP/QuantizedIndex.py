@@ -0,0 +1,432 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import weakref
+import collections.abc
+import numpy as np
+from typing import Iterator, Optional, Sequence, Tuple, Union
+
+from EmbeddingIndex import EmbeddingIndex, normalize_rows, top_k_indices
+
+##############################################################################
+# 量化的 Embedding 索引 (常駐記憶體的部分只保留壓縮後的向量與文字)
+#   - "float16"：每維 2 bytes
+#   - "int8"：每一維依該維的最小 / 最大值線性對應到 0~255，每維 1 byte
+#   - "pq"：product quantization，向量切成 m 段，每段以 256 個中心點 (k-means) 之一表示，
+#     每個向量 m bytes；查詢時先算好每段的查表 (ADC)，不需還原向量
+#   - 重新排序：先以量化分數取前 top_k * rerank 名候選，再讀取原始 float32 向量計算精確分數
+#     (load(mmap=True) 時原始向量留在磁碟上，每次只讀取候選列且不保持檔案開啟；
+#      讀取的是 pinned/ 下這次載入專用的 vectors.npy 硬連結 (無法建立時改為複製)，
+#      ingest_folder 取代 vectors.npy 後，舊索引的重新排序仍讀取建立量化碼時的向量，
+#      索引釋放時刪除該檔；常駐服務熱重載期間進行中的查詢不受影響)；
+#     rerank=0 時直接回傳量化分數；預設倍數依量化方式而定 (PQ 誤差較大，需要較多候選)
+#   - chunk 文字存成一個連續的位元組緩衝區 + 位移陣列 (TextBuffer)，不再是一個個 Python 字串
+##############################################################################
+QUANTIZATIONS = ("float16", "int8", "pq")
+DEFAULT_RERANK = {"float16": 2, "int8": 4, "pq": 16}
+# 量化 / 計分時每次處理的列數 (暫存的 float32 區塊約 ROW_BLOCK x 維度 x 4 bytes)
+ROW_BLOCK = 8192
+PQ_CENTROIDS = 256
+PQ_TRAIN_SAMPLE = 10_000
+PQ_ITERATIONS = 10
+# scores() 未指定 top_k 時，重算精確分數的候選數為 SCORES_TOP_K * rerank
+SCORES_TOP_K = 20
+PINNED_DIR = "pinned"
+PIN_ATTEMPTS = 20
+
+
+class TextBuffer(collections.abc.Sequence):
+    """
+    所有文字串接成一個位元組緩衝區，texts[i] = data[offsets[i]:offsets[i + 1]]。
+    以 UTF-8 與 UTF-16 中較小者編碼 (中文為主的文字 UTF-16 每字 2 bytes，UTF-8 為 3 bytes)。
+    """
+
+    def __init__(self, texts: Sequence[str]):
+        texts = list(texts)
+        chars = sum(len(t) for t in texts)
+        encoded = [t.encode("utf-8") for t in texts]
+        self.encoding = "utf-8"
+        if sum(len(b) for b in encoded) > 2 * chars:
+            self.encoding = "utf-16-le"
+            encoded = [t.encode(self.encoding) for t in texts]
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=self.offsets[1:])
+        self.data = b"".join(encoded)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: Union[int, slice]):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.data[self.offsets[i]:self.offsets[i + 1]].decode(self.encoding)
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data) + self.offsets.nbytes
+
+
+def _file_identity(st: os.stat_result) -> Tuple[int, int, int]:
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class ExactVectorFile:
+    """
+    vectors.npy 的唯讀列存取 (matrix[列] / matrix[起:迄])，每次讀取時才開檔。
+    與 np.memmap 不同，不會長時間佔用檔案。
+    檔案被取代 (inode、大小或修改時間不同) 時讀取會失敗，不會回傳其他版本的向量。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._identity = _file_identity(os.fstat(f.fileno()))
+            major, _ = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if major == 1 else np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_header(f)
+            self._offset = f.tell()
+        if fortran_order or len(shape) != 2:
+            raise ValueError(f"不支援的向量檔格式：{path}")
+        self.shape, self.dtype = shape, dtype
+        self.ndim = 2
+        self._row_bytes = shape[1] * dtype.itemsize
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.shape[0] * self._row_bytes
+
+    def __getitem__(self, rows) -> np.ndarray:
+        with open(self.path, "rb") as f:
+            if _file_identity(os.fstat(f.fileno())) != self._identity:
+                raise RuntimeError(f"向量檔已被取代：{self.path}")
+            if isinstance(rows, slice):
+                start, stop, step = rows.indices(self.shape[0])
+                f.seek(self._offset + start * self._row_bytes)
+                block = np.frombuffer(f.read(max(0, stop - start) * self._row_bytes), dtype=self.dtype)
+                return block.reshape(-1, self.shape[1])[::step]
+            rows = np.asarray(rows, dtype=np.int64).reshape(-1)
+            out = np.empty((len(rows), self.shape[1]), dtype=self.dtype)
+            for k, row in enumerate(rows):
+                f.seek(self._offset + int(row) * self._row_bytes)
+                f.readinto(out[k])
+            return out
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        matrix = self[:]
+        return matrix.astype(dtype) if dtype is not None else matrix
+
+
+def _pin_vectors(directory: str, vectors_file: str, chunks_file: str) -> Tuple[dict, str]:
+    """
+    讀取 chunks 並將向量檔固定成 pinned/ 下的專用檔案 (硬連結，失敗時複製)，回傳 (chunks, 路徑)。
+    EmbeddingIndex.save 先取代向量檔再取代 chunks，兩者須是同一次儲存的結果：
+    前後 stat 不變且 chunks 不早於向量檔，否則 (儲存進行中) 稍後重試。
+    """
+    vectors_path = os.path.join(directory, vectors_file)
+    chunks_path = os.path.join(directory, chunks_file)
+    pinned_dir = os.path.join(directory, PINNED_DIR)
+    os.makedirs(pinned_dir, exist_ok=True)
+    for _ in range(PIN_ATTEMPTS):
+        before = (os.stat(vectors_path), os.stat(chunks_path))
+        pinned = os.path.join(pinned_dir, f"vectors-{uuid.uuid4().hex[:12]}.npy")
+        try:
+            os.link(vectors_path, pinned)
+        except OSError:
+            shutil.copyfile(vectors_path, pinned)
+        with open(chunks_path, "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+        after = (os.stat(vectors_path), os.stat(chunks_path))
+        unchanged = [_file_identity(a) for a in before] == [_file_identity(a) for a in after]
+        if unchanged and after[1].st_mtime_ns >= after[0].st_mtime_ns:
+            return chunks, pinned
+        _remove_quietly(pinned)
+        time.sleep(0.05)
+    raise RuntimeError(f"索引持續在更新中，無法取得一致的向量與 chunk：{directory}")
+
+
+def _blocks(n: int, block: int = ROW_BLOCK) -> Iterator[slice]:
+    for start in range(0, n, block):
+        yield slice(start, min(start + block, n))
+
+
+class Float16Quantizer:
+    name = "float16"
+    nbytes = 0
+
+    def fit(self, matrix: np.ndarray) -> "Float16Quantizer":
+        return self
+
+    def encode(self, block: np.ndarray) -> np.ndarray:
+        return block.astype(np.float16)
+
+    def prepare(self, queries: np.ndarray):
+        return queries
+
+    def score(self, codes: np.ndarray, prepared) -> np.ndarray:
+        return prepared @ codes.astype(np.float32).T
+
+
+class Int8Quantizer:
+    """每一維獨立的線性量化：x ≈ low + scale * code。"""
+
+    name = "int8"
+
+    def fit(self, matrix: np.ndarray) -> "Int8Quantizer":
+        low = np.full(matrix.shape[1], np.inf, dtype=np.float32)
+        high = np.full(matrix.shape[1], -np.inf, dtype=np.float32)
+        for rows in _blocks(len(matrix)):
+            block = np.asarray(matrix[rows], dtype=np.float32)
+            low = np.minimum(low, block.min(axis=0))
+            high = np.maximum(high, block.max(axis=0))
+        self.low = low
+        self.scale = np.where(high > low, (high - low) / 255, 1.0).astype(np.float32)
+        return self
+
+    def encode(self, block: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint((block - self.low) / self.scale), 0, 255).astype(np.uint8)
+
+    def prepare(self, queries: np.ndarray):
+        # q . x ≈ q . low + (q * scale) . code
+        return queries * self.scale, queries @ self.low
+
+    def score(self, codes: np.ndarray, prepared) -> np.ndarray:
+        scaled, bias = prepared
+        return scaled @ codes.astype(np.float32).T + bias[:, None]
+
+    @property
+    def nbytes(self) -> int:
+        return self.low.nbytes + self.scale.nbytes
+
+
+class ProductQuantizer:
+    """向量切成 subspaces 段，每段以 k-means 的中心點編號 (uint8) 表示。"""
+
+    name = "pq"
+
+    def __init__(self, subspaces: Optional[int] = None, seed: int = 0):
+        self.subspaces = subspaces
+        self.seed = seed
+
+    def fit(self, matrix: np.ndarray) -> "ProductQuantizer":
+        n, dim = matrix.shape
+        m = self.subspaces or max(1, dim // 16)
+        if dim % m:
+            raise ValueError(f"維度 {dim} 無法平均切成 {m} 段")
+        self.subspaces, self.sub_dim = m, dim // m
+        rng = np.random.default_rng(self.seed)
+        sample_rows = np.sort(rng.choice(n, min(n, PQ_TRAIN_SAMPLE), replace=False))
+        sample = np.asarray(matrix[sample_rows], dtype=np.float32)
+        k = min(PQ_CENTROIDS, len(sample))
+        self.centroids = np.stack([
+            self._kmeans(sample[:, j * self.sub_dim:(j + 1) * self.sub_dim], k, rng) for j in range(m)
+        ])
+        return self
+
+    @staticmethod
+    def _assign(points: np.ndarray, centers: np.ndarray) -> np.ndarray:
+        distances = (centers * centers).sum(axis=1) - 2 * points @ centers.T
+        return distances.argmin(axis=1)
+
+    def _kmeans(self, points: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+        centers = points[rng.choice(len(points), k, replace=False)].copy()
+        for _ in range(PQ_ITERATIONS):
+            labels = self._assign(points, centers)
+            counts = np.bincount(labels, minlength=k)
+            sums = np.zeros_like(centers)
+            np.add.at(sums, labels, points)
+            filled = counts > 0  # 空的群維持原本的中心點
+            centers[filled] = sums[filled] / counts[filled, None]
+        return centers
+
+    def encode(self, block: np.ndarray) -> np.ndarray:
+        codes = np.empty((len(block), self.subspaces), dtype=np.uint8)
+        for j in range(self.subspaces):
+            part = block[:, j * self.sub_dim:(j + 1) * self.sub_dim]
+            codes[:, j] = self._assign(part, self.centroids[j])
+        return codes
+
+    def prepare(self, queries: np.ndarray) -> np.ndarray:
+        """查表：lut[q, j, c] = 查詢 q 第 j 段與第 c 個中心點的內積。"""
+        parts = queries.reshape(len(queries), self.subspaces, self.sub_dim)
+        return np.einsum("qjd,jcd->qjc", parts, self.centroids)
+
+    def score(self, codes: np.ndarray, lut: np.ndarray) -> np.ndarray:
+        scores = np.zeros((lut.shape[0], len(codes)), dtype=np.float32)
+        for j in range(self.subspaces):
+            scores += lut[:, j, codes[:, j]]
+        return scores
+
+    @property
+    def nbytes(self) -> int:
+        return self.centroids.nbytes
+
+
+def make_quantizer(quantization: str, **options):
+    if quantization == "float16":
+        return Float16Quantizer()
+    if quantization == "int8":
+        return Int8Quantizer()
+    if quantization == "pq":
+        return ProductQuantizer(**options)
+    raise ValueError(f"未知的量化方式：{quantization} (可用：{', '.join(QUANTIZATIONS)})")
+
+
+class QuantizedIndex(EmbeddingIndex):
+    """
+    與 EmbeddingIndex 相同的查詢介面 (search / search_batch / search_fused / records)，
+    可直接交給 FileSearch.search_relevant_chunks 與 search_multi_query。
+    matrix 為原始的正規化 float32 向量 (只在重新排序時讀取候選列)。
+    select / extend 回傳一般的 EmbeddingIndex。
+    """
+
+    def __init__(
+        self,
+        texts: Sequence[str],
+        vectors: np.ndarray,
+        metadata: Optional[Sequence[dict]] = None,
+        quantization: str = "int8",
+        rerank: Optional[int] = None,
+        **quantizer_options,
+    ):
+        """vectors 必須已正規化 (例如 EmbeddingIndex.matrix 或 ExactVectorFile)。"""
+        if vectors.ndim != 2 or vectors.shape[0] != len(texts):
+            raise ValueError(f"texts ({len(texts)}) 與向量矩陣 {vectors.shape} 的筆數不一致")
+        self.texts = TextBuffer(texts)
+        self.metadata = list(metadata) if metadata is not None else [{} for _ in range(len(texts))]
+        self.matrix = vectors
+        self.rerank = DEFAULT_RERANK.get(quantization, 0) if rerank is None else rerank
+        self.quantization = quantization
+        self.quantizer = make_quantizer(quantization, **quantizer_options)
+        if len(texts):
+            self.quantizer.fit(vectors)
+            first = self.quantizer.encode(np.asarray(vectors[:1], dtype=np.float32))
+            self.codes = np.empty((len(texts),) + first.shape[1:], dtype=first.dtype)
+            for rows in _blocks(len(texts)):
+                self.codes[rows] = self.quantizer.encode(np.asarray(vectors[rows], dtype=np.float32))
+        else:
+            self.codes = np.empty((0, 0), dtype=np.uint8)
+
+    @classmethod
+    def from_index(cls, index: EmbeddingIndex, quantization: str = "int8", rerank: Optional[int] = None, **options) -> "QuantizedIndex":
+        return cls(index.texts, index.matrix, index.metadata, quantization, rerank, **options)
+
+    @classmethod
+    def load(
+        cls,
+        directory: str,
+        mmap: bool = True,
+        quantization: str = "int8",
+        rerank: Optional[int] = None,
+        **options,
+    ) -> "QuantizedIndex":
+        """
+        讀取 EmbeddingIndex.save() 的結果並量化；mmap=True 時原始向量留在磁碟上
+        (pinned/ 下的專用檔案，以 ExactVectorFile 讀取，不受之後的 save 影響)。
+        """
+        if not mmap:
+            with open(os.path.join(directory, cls.CHUNKS_FILE), "r", encoding="utf-8") as f:
+                chunks = json.load(f)
+            matrix = np.load(os.path.join(directory, cls.VECTORS_FILE))
+            return cls(chunks["texts"], matrix, chunks["metadata"], quantization, rerank, **options)
+
+        chunks, pinned = _pin_vectors(directory, cls.VECTORS_FILE, cls.CHUNKS_FILE)
+        try:
+            matrix = ExactVectorFile(pinned)
+        except BaseException:
+            _remove_quietly(pinned)
+            raise
+        # 不再有任何物件使用這份向量時刪除 (進行中的查詢仍持有索引時不會被刪)
+        weakref.finalize(matrix, _remove_quietly, pinned)
+        return cls(chunks["texts"], matrix, chunks["metadata"], quantization, rerank, **options)
+
+    def save(self, directory: str) -> None:
+        EmbeddingIndex(list(self.texts), np.asarray(self.matrix), self.metadata, normalized=True).save(directory)
+
+    def memory_bytes(self) -> dict:
+        """常駐記憶體的主要部分 (不含 metadata)；exact_vectors 為重新排序用的原始向量大小。"""
+        return {
+            "codes": self.codes.nbytes + self.quantizer.nbytes,
+            "texts": self.texts.nbytes,
+            "exact_vectors": self.matrix.nbytes,
+            "exact_in_memory": isinstance(self.matrix, np.ndarray),
+        }
+
+    # ------------------------------------------------------------------
+    # 查詢
+    # ------------------------------------------------------------------
+    def _score_block(self, queries: np.ndarray) -> np.ndarray:
+        """量化後的近似分數。"""
+        prepared = self.quantizer.prepare(queries)
+        scores = np.empty((len(queries), len(self)), dtype=np.float32)
+        for rows in _blocks(len(self)):
+            scores[:, rows] = self.quantizer.score(self.codes[rows], prepared)
+        return scores
+
+    def scores(self, query_vec: np.ndarray, top_k: Optional[int] = None, rows=None) -> np.ndarray:
+        """
+        每個 chunk 的分數：量化分數最高的 top_k * rerank 個候選 (以及 rows 指定的列)
+        改為原始向量的精確分數，其餘為量化分數 (hybrid 模式混合 BM25 時使用)。
+        只需要前幾名時請用 search()，結果與精確索引的排序一致。
+        """
+        if len(self) == 0:
+            return np.empty(0, dtype=np.float32)
+        query = normalize_rows(np.asarray(query_vec).reshape(1, -1))
+        scores = self._score_block(query)[0]
+        if self.rerank <= 0:
+            return scores
+        candidates = top_k_indices(scores, (top_k or SCORES_TOP_K) * self.rerank)
+        if rows is not None:
+            candidates = np.union1d(candidates, np.asarray(rows, dtype=np.int64))
+        candidates = np.sort(candidates)
+        scores[candidates] = np.asarray(self.matrix[candidates], dtype=np.float32) @ query[0]
+        return scores
+
+    def _top_k_block(self, queries: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        approx = self._score_block(queries)
+        if self.rerank <= 0:
+            idx = top_k_indices(approx, top_k)
+            return idx, np.take_along_axis(approx, idx, axis=-1)
+
+        candidates = top_k_indices(approx, top_k * self.rerank)
+        k = min(top_k, candidates.shape[1])
+        idx = np.empty((len(queries), k), dtype=np.int64)
+        scores = np.empty((len(queries), k), dtype=np.float32)
+        for q, rows in enumerate(candidates):
+            # 依列號排序後再讀取，原始向量在磁碟上時為循序讀取
+            rows = np.sort(rows)
+            exact = np.asarray(self.matrix[rows], dtype=np.float32) @ queries[q]
+            best = top_k_indices(exact, k)
+            idx[q], scores[q] = rows[best], exact[best]
+        return idx, scores
+
+    def select(self, rows) -> EmbeddingIndex:
+        rows = np.fromiter(rows, dtype=np.int64)
+        return EmbeddingIndex(
+            [self.texts[i] for i in rows], np.asarray(self.matrix[rows]), [self.metadata[i] for i in rows],
+            normalized=True,
+        )
+
+    def extend(self, texts, vectors, metadata=None) -> EmbeddingIndex:
+        base = EmbeddingIndex(list(self.texts), np.asarray(self.matrix), self.metadata, normalized=True)
+        return base.extend(texts, vectors, metadata)
+
@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+import httpx
+from typing import Optional
+
+from DaemonClient import DEFAULT_HOST, DEFAULT_PORT, DEFAULT_URL, DaemonClient, DaemonError
+
+##############################################################################
+# 常駐查詢服務的命令列 (產品 CSV 與 PDF 索引只在服務中載入一次)
+#   python QueryDaemon.py serve [--csv ...] [--pdf-folder ...] [--quantization int8]
+#   python QueryDaemon.py ask 骨水泥 人工關節        (交給常駐服務)
+#   python QueryDaemon.py ask --local 骨水泥          (不經服務，在本行程載入後回答)
+#   python QueryDaemon.py search "HIP CUP" / status / reload
+#   - 伺服端在 DaemonServer.py，只有 serve 與 ask --local 會匯入 (產品目錄、PDF 索引、
+#     pandas、PyPDF2 等)；其餘指令只需要 DaemonClient (httpx)，行程啟動快
+##############################################################################
+
+
+def _load_env(path: str) -> None:
+    from dotenv import load_dotenv
+    if os.path.exists(path):
+        load_dotenv(dotenv_path=path)
+    else:
+        print(f"找不到環境變數檔案，使用目前的環境變數：{path}")
+
+
+def _run_server_command(args) -> None:
+    """serve 與 ask --local：匯入伺服端模組並載入資料。"""
+    import Assistant_api
+    import DaemonServer
+    from PdfIngest import DEFAULT_STORE_DIR
+    from QuantizedIndex import QUANTIZATIONS
+
+    if args.quantization and args.quantization not in QUANTIZATIONS:
+        sys.exit(f"未知的量化方式：{args.quantization} (可用：{', '.join(QUANTIZATIONS)})")
+    _load_env(args.env or Assistant_api.env_path)
+    csv_file = args.csv or Assistant_api.CSV_FILE_PATH
+    pdf_folder = args.pdf_folder or os.getenv("PDFfloder_PATH", "")
+    store_dir = args.store_dir or DEFAULT_STORE_DIR
+
+    if args.command == "serve":
+        daemon = DaemonServer.QueryDaemon(
+            csv_file, pdf_folder, store_dir, args.host, args.port,
+            args.reload_interval or DaemonServer.RELOAD_INTERVAL,
+            quantization=args.quantization,
+        )
+        try:
+            asyncio.run(daemon.serve())
+        except FileNotFoundError as e:
+            sys.exit(str(e))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    try:
+        state = DaemonServer.load_state(csv_file, pdf_folder, store_dir, quantization=args.quantization)
+    except FileNotFoundError as e:
+        sys.exit(str(e))
+    _print_answer(DaemonServer.ask(state, {"keywords": args.keywords}), args.output)
+
+
+def _print_answer(result: dict, output: Optional[str] = None) -> None:
+    print("\n===== 最終答案 =====")
+    print(result["answer"])
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(result["answer"])
+        print(f"\n===== 答案已存入 {output} =====")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="常駐查詢服務與用戶端")
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--env", default=None, help="預設為 Assistant_api.env_path (只用於 serve 與 ask --local)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def data_args(p):
+        p.add_argument("--csv", default=None, help="預設為 Assistant_api.CSV_FILE_PATH")
+        p.add_argument("--pdf-folder", default=None, help="預設為環境變數 PDFfloder_PATH")
+        p.add_argument("--store-dir", default=None, help="預設為 PdfIngest.DEFAULT_STORE_DIR")
+        p.add_argument("--quantization", default=None, help="PDF 索引的量化方式：float16 / int8 / pq (預設不量化)")
+
+    p = sub.add_parser("serve", help="啟動常駐服務")
+    data_args(p)
+    p.add_argument("--host", default=DEFAULT_HOST)
+    p.add_argument("--port", type=int, default=DEFAULT_PORT)
+    p.add_argument("--reload-interval", type=float, default=None, help="預設為 DaemonServer.RELOAD_INTERVAL 秒")
+
+    p = sub.add_parser("ask", help="產品分析 + PDF 檢索 + 回答")
+    data_args(p)
+    p.add_argument("keywords", nargs="+")
+    p.add_argument("--local", action="store_true", help="不經常駐服務，直接在本行程載入資料後回答")
+    p.add_argument("--output", default=None, help="將答案寫入此檔案")
+
+    p = sub.add_parser("search", help="PDF 檢索 (多個查詢時以 RRF 合併)")
+    p.add_argument("queries", nargs="+")
+    p.add_argument("--top-k", type=int, default=20)
+
+    sub.add_parser("status", help="服務狀態與延遲")
+    sub.add_parser("reload", help="立即重新載入 CSV 與 PDF 索引")
+
+    args = parser.parse_args()
+    if args.command == "serve" or (args.command == "ask" and args.local):
+        _run_server_command(args)
+        return
+
+    client = DaemonClient(args.url)
+    try:
+        if args.command == "ask":
+            _print_answer(client.ask(args.keywords), args.output)
+        elif args.command == "search":
+            queries = args.queries
+            chunks = client.search(queries=queries, top_k=args.top_k) if len(queries) > 1 else \
+                client.search(query=queries[0], top_k=args.top_k)
+            for chunk in chunks:
+                print(f"[{chunk.get('file', '')} p.{chunk.get('page_start', '?')}] {chunk['score']:.4f} {chunk['text'][:80]}")
+        else:
+            print(json.dumps(getattr(client, args.command)(), ensure_ascii=False, indent=2))
+    except httpx.TransportError:
+        sys.exit(f"無法連線到常駐服務 {args.url}，請先執行 python QueryDaemon.py serve (或改用 ask --local)")
+    except DaemonError as e:
+        sys.exit(str(e))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import time
+import random
+import asyncio
+from typing import Optional
+
+##############################################################################
+# 速率限制與重試退避
+#   - RateLimiter：每分鐘請求數 (RPM) 與每分鐘 token 數 (TPM) 兩個 token bucket
+#   - backoff_delay：指數退避 + full jitter，若伺服器有給 Retry-After 則優先採用
+##############################################################################
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0, retry_after: Optional[str] = None) -> float:
+    if retry_after:
+        try:
+            return min(cap, float(retry_after)) + random.uniform(0, base)
+        except ValueError:
+            pass
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class _Bucket:
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        self.refill()
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+
+class RateLimiter:
+    """
+    非同步的 RPM / TPM 限制器。acquire(tokens) 會等到兩個 bucket 都有足夠額度才返回；
+    等待中的呼叫依先來後到取得額度。limit 為 None 表示不限制。
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        self._requests = _Bucket(requests_per_minute) if requests_per_minute else None
+        self._tokens = _Bucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int = 0) -> None:
+        async with self._lock:
+            if self._tokens is not None:
+                # 單一請求超過整分鐘額度時，只要求裝滿的 bucket，避免永遠等不到
+                tokens = min(tokens, self._tokens.capacity)
+            while True:
+                wait = 0.0
+                if self._requests is not None:
+                    wait = max(wait, self._requests.wait_time(1))
+                if self._tokens is not None:
+                    wait = max(wait, self._tokens.wait_time(tokens))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            if self._requests is not None:
+                self._requests.level -= 1
+            if self._tokens is not None:
+                self._tokens.level -= tokens
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import uuid
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+##############################################################################
+# analyze_products 的 append-only 結果紀錄 (JSON lines)
+#   - 每完成一個關鍵字就附加一行並 flush + fsync，中斷 (當機、Ctrl-C、額度用盡) 時
+#     已完成 (已付費) 的結果不會遺失
+#   - 每次執行的紀錄：
+#       {"type": "run", "run", "ts", "model", "keywords"}
+#       {"type": "result", "run", "keyword", "key", "source", "result"}   (每個關鍵字一行)
+#       {"type": "end", "run", "ts", "failed"}
+#     key 為 CompletionCache.completion_key (模型、提示、temperature)；
+#     source 為 "api" / "cache" / "resume"
+#   - resume：沿用先前任何一次執行中 key 相同且沒有錯誤的結果 (複製一行到本次執行)
+#   - 讀取端以 follow() 追蹤檔尾，執行尚未結束時即可逐一取得結果；
+#     寫到一半的最後一行 (中斷時) 會被略過
+##############################################################################
+
+
+def new_run_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def _parse_lines(data: bytes) -> Iterator[dict]:
+    for line in data.split(b"\n"):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            continue  # 中斷時寫到一半的行
+
+
+def read_records(path: str) -> List[dict]:
+    """讀取目前所有完整的紀錄 (檔案不存在時為空列表)。"""
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        data = f.read()
+    # 沒有換行結尾的最後一行可能尚未寫完
+    return list(_parse_lines(data[: data.rfind(b"\n") + 1]))
+
+
+class ResultLog:
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # 上次中斷時留下寫到一半的行：補上換行，避免與下一筆紀錄黏在同一行
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, "rb+") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.seek(0, os.SEEK_END)
+                    f.write(b"\n")
+
+    def _write(self, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+
+    def start_run(self, run_id: str, keywords: List[str], model: Optional[str] = None) -> None:
+        self._write({"type": "run", "run": run_id, "ts": round(time.time(), 3), "model": model, "keywords": keywords})
+
+    def append(self, run_id: str, keyword: str, key: str, result: dict, source: str = "api") -> None:
+        self._write({"type": "result", "run": run_id, "keyword": keyword, "key": key, "source": source, "result": result})
+
+    def end_run(self, run_id: str, failed: int = 0) -> None:
+        self._write({"type": "end", "run": run_id, "ts": round(time.time(), 3), "failed": failed})
+
+    def completed(self, keys: Iterable[str]) -> Dict[str, dict]:
+        """先前執行中已成功的結果 {key: 回應} (同一個 key 以最後一筆為準)。"""
+        wanted = set(keys)
+        done = {}
+        for record in read_records(self.path):
+            if record.get("type") == "result" and record.get("key") in wanted and "error" not in record["result"]:
+                done[record["key"]] = record["result"]
+        return done
+
+    def run_results(self, run_id: str) -> Dict[str, dict]:
+        """指定執行的 {關鍵字: 回應}，依寫入順序。"""
+        return {
+            record["keyword"]: record["result"]
+            for record in read_records(self.path)
+            if record.get("type") == "result" and record.get("run") == run_id
+        }
+
+
+def follow(
+    path: str,
+    run_id: str,
+    is_running: Optional[Callable[[], bool]] = None,
+    poll_interval: float = 0.2,
+) -> Iterator[dict]:
+    """
+    逐一產生 run_id 的 result 紀錄 (包含執行開始前就寫入的)，讀到 end 紀錄時結束。
+    is_running 回傳 False (例如寫入的執行緒已結束卻沒有 end 紀錄) 時，讀完剩餘內容後結束。
+    沒有新資料時的等待時間從 5 ms 倍增到 poll_interval，有新資料時重設。
+    """
+    position, pending = 0, b""
+    wait, finished = 0.005, False
+    while True:
+        data = b""
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                f.seek(position)
+                data = f.read()
+            position += len(data)
+        pending += data
+        cut = pending.rfind(b"\n") + 1
+        complete, pending = pending[:cut], pending[cut:]
+        for record in _parse_lines(complete):
+            if record.get("run") != run_id:
+                continue
+            if record.get("type") == "end":
+                return
+            if record.get("type") == "result":
+                yield record
+        if data:
+            wait = 0.005
+            continue
+        if finished:
+            return
+        if is_running is not None and not is_running():
+            finished = True  # 寫入端已結束：再讀一次剩餘的內容後結束
+            continue
+        time.sleep(wait)
+        wait = min(wait * 2, poll_interval)
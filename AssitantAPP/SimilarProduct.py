@@ -1,30 +1,159 @@
 import pandas as pd
-import requests
 from dotenv import load_dotenv
 import os
+import sys
 import json
+import time
+import asyncio
+import OpenAIClient as oc
+import Telemetry as tm
+from CompletionCache import completion_key, get_default_cache
+from KeywordMatcher import KeywordYearIndex
+from NgramIndex import NgramIndex
+from RateLimit import RateLimiter
+from ResultLog import ResultLog, new_run_id
+from TokenCounter import count_tokens
 
 env_path = r'D:\CYCU\113_WebCrawler\CODE\.env'
 load_dotenv(dotenv_path=env_path)
 
-def analyze_products(csv_file, api_key, keywords=None):
+API_URL = None  # None 時使用 OpenAIClient.API_BASE 下的 /chat/completions
+MODEL = "gpt-4o"  # 請確認您有權限使用此模型名稱
+DEFAULT_SHORTLIST_SIZE = 200
+
+# 非同步模式的預設額度 (依帳號等級調整)
+DEFAULT_RPM_LIMIT = 500
+DEFAULT_TPM_LIMIT = 30_000
+COMPLETION_TOKEN_ALLOWANCE = 1_000  # 預估每個回覆的 token 數，用於 TPM 預留
+MAX_RETRIES = 5
+
+
+class ProductCatalog:
+    """
+    analyze_products 需要的 CSV 衍生資料 (產品清單、n-gram 候選索引、出現年度索引)。
+    每次呼叫 analyze_products 預設會重新建立；常駐服務 (QueryDaemon) 只建一次並重複使用。
+    """
+
+    def __init__(self, csv_file):
+        self.csv_file = csv_file
+        self.df = pd.read_csv(csv_file)
+        self.all_products = pd.Series(self.df.values.ravel()).dropna().astype(str).unique()
+        # 每個 CSV 只建一次候選索引，並先計算完整清單的 token 數作為比較基準
+        self.product_index = NgramIndex(self.all_products)
+        self.full_list_tokens = count_tokens("\n".join(self.all_products), MODEL)
+        self.year_index = KeywordYearIndex(self.df)
+
+
+def shortlist_products(product_index, all_products, keyword, shortlist_size):
+    """
+    以字元 n-gram 索引挑出與關鍵字最相近的前 shortlist_size 個產品；
+    shortlist_size 為 None 或沒有任何字面上相近的產品時，回傳完整清單。
+    """
+    if shortlist_size is None:
+        return list(all_products)
+    hits = product_index.search(keyword, top_n=shortlist_size)
+    if not hits:
+        print(f"關鍵字 {keyword} 沒有字面相近的產品，改送出完整產品清單")
+        return list(all_products)
+    return [all_products[i] for i, _ in hits]
+
+
+async def _post_chat_async(url, headers, data, limiter, semaphore, max_retries=MAX_RETRIES):
+    """
+    送出單一 chat completion 請求：每次送出前向 limiter 取得 RPM / TPM 額度，
+    遇到 429 / 5xx 時由 OpenAIClient 以 jitter 退避後重試 (退避等待時不佔用並行名額)。
+    """
+    tokens = sum(count_tokens(m["content"], data["model"]) for m in data["messages"]) + COMPLETION_TOKEN_ALLOWANCE
+    with tm.api_call("chat.completions", data["model"]) as span:
+        result = await oc.apost_json(
+            url, data, headers=headers, max_retries=max_retries, span=span,
+            before_send=lambda: limiter.acquire(tokens), semaphore=semaphore,
+        )
+        span.update(**tm.usage_fields(result.get("usage")))
+        return result
+
+
+async def _run_keywords_async(url, headers, payloads, concurrency, rpm_limit, tpm_limit, on_result=None):
+    """
+    並行處理所有關鍵字，回傳與 payloads 相同順序的結果列表。
+    on_result(keyword, data, result) 在每個關鍵字完成時立即呼叫 (完成順序)。
+    """
+    limiter = RateLimiter(rpm_limit, tpm_limit)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(keyword, data):
+        try:
+            result = await _post_chat_async(url, headers, data, limiter, semaphore)
+        except oc.APIError as http_err:
+            print(f"HTTP error occurred for keyword {keyword}: {http_err}")
+            result = {"error": str(http_err)}
+        except Exception as err:
+            print(f"An error occurred for keyword {keyword}: {err}")
+            result = {"error": str(err)}
+        if on_result is not None:
+            on_result(keyword, data, result)
+        return result
+
+    try:
+        return await asyncio.gather(*(run(keyword, data) for keyword, data in payloads))
+    finally:
+        await oc.aclose()
+
+
+def analyze_products(
+    csv_file,
+    api_key,
+    keywords=None,
+    shortlist_size=DEFAULT_SHORTLIST_SIZE,
+    concurrency=1,
+    rpm_limit=DEFAULT_RPM_LIMIT,
+    tpm_limit=DEFAULT_TPM_LIMIT,
+    api_url=None,
+    cache=None,
+    use_cache=True,
+    catalog=None,
+    write_output=True,
+    log_path=None,
+    resume=False,
+    run_id=None,
+):
     """
     讀取產品 CSV 檔案，並呼叫 OpenAI API 取得多個關鍵字的回應，
     最終將所有關鍵字的回應都存入同一個 JSON 檔，並印出該檔案位置與回應摘要。
+
+    每個關鍵字只會把 n-gram 索引挑出的前 shortlist_size 個候選產品放進提示，
+    shortlist_size=None 時與過去相同，送出完整產品清單。
+
+    concurrency > 1 時改用 asyncio 同時處理多個關鍵字，並受
+    rpm_limit / tpm_limit 限制；遇到 429 / 5xx 會自動退避重試。
+    輸出 JSON 的關鍵字順序與輸入相同。
+
+    相同請求 (模型、訊息、temperature) 的成功回應會存入 CompletionCache，
+    再次查詢時直接回傳；use_cache=False 可略過快取。
+
+    api_url 未指定時使用呼叫當下的模組常數 API_URL (或 OpenAIClient 的 API_BASE)。
+
+    catalog 可傳入預先建立的 ProductCatalog (需與 csv_file 相同)。
+    回傳 {關鍵字: API 回應}；write_output=False 時不寫 JSON 檔也不印出摘要。
+
+    每個關鍵字完成時立即附加到 log_path 的 JSON lines 紀錄 (見 ResultLog.py)，
+    預設為 JSON 檔旁的 SimilarProduct_Output.jsonl (write_output=False 且未指定時不記錄)；
+    最後的 JSON 檔由紀錄組成。resume=True 時略過紀錄中已成功、且提示與模型相同的關鍵字。
+    run_id 用於讓其他執行緒 / 行程以 ResultLog.follow 逐一讀取本次的結果。
     """
+    api_url = api_url or API_URL or oc.api_url("chat/completions")
+    start = time.perf_counter()
 
     if keywords is None:
         input_keywords = input("請輸入關鍵字（以逗號分隔）：")
         keywords = [k.strip() for k in input_keywords.split(",") if k.strip()]
 
-    API_URL = "https://api.openai.com/v1/chat/completions"
-    df = pd.read_csv(csv_file)
-    all_products = pd.Series(df.values.ravel()).dropna().unique()
+    catalog = catalog or ProductCatalog(csv_file)
+    all_products = catalog.all_products
+    product_index = catalog.product_index
+    full_list_tokens = catalog.full_list_tokens
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
+    headers = oc.auth_headers(api_key)
 
     # 系統提示 (system prompt)
     system_prompt = """
@@ -50,14 +179,19 @@ def analyze_products(csv_file, api_key, keywords=None):
 
     # 用於儲存所有關鍵字的完整 API 回傳
     all_results = {}
+    payloads = []
+
+    # ※ 若不再需要 occurrence_years、相關產品等，可視需求刪除下列程式
+    # 所有關鍵字的出現年度以一次多關鍵字掃描求得，不再逐一掃描整個 DataFrame
+    occurrences = catalog.year_index.lookup(keywords)
 
     for keyword in keywords:
-        # ※ 若不再需要 occurrence_years、相關產品等，可視需求刪除下列程式
-        occurrence_years = df.columns[
-            df.apply(lambda col: col.astype(str).str.contains(keyword, na=False)).any()
-        ].tolist()
+        occurrence_years = occurrences[keyword]
 
-        product_list_str = "\n".join(all_products)
+        candidates = shortlist_products(product_index, all_products, keyword, shortlist_size)
+        product_list_str = "\n".join(candidates)
+        saved_tokens = full_list_tokens - count_tokens(product_list_str, MODEL)
+        print(f"關鍵字 {keyword}：候選產品 {len(candidates)}/{len(all_products)} 項，約省下 {saved_tokens} tokens")
         user_message = (
             f"請根據以下產品清單，找出與關鍵字「{keyword}」相關或相似的產品名稱（不包含關鍵字本身），"
             "並確保輸出格式符合系統指定的 JSON 格式。\n"
@@ -65,35 +199,107 @@ def analyze_products(csv_file, api_key, keywords=None):
         )
 
         data = {
-            "model": "gpt-4o",  # 請確認您有權限使用此模型名稱
+            "model": MODEL,
             "messages": [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_message}
             ],
             "temperature": 0.2
         }
+        payloads.append((keyword, data))
 
-        try:
-            response = requests.post(API_URL, headers=headers, json=data)
-            response.raise_for_status()
-            result = response.json()
+    output_dir = os.path.dirname(csv_file)
+    if log_path is None and write_output:
+        log_path = os.path.join(output_dir, "SimilarProduct_Output.jsonl")
+    log = ResultLog(log_path) if log_path else None
+    run_id = run_id or new_run_id()
+    keys = {keyword: completion_key(data) for keyword, data in payloads}
+    if log is not None:
+        log.start_run(run_id, [keyword for keyword, _ in payloads], MODEL)
 
-            # 將整個回傳存到 all_results
-            all_results[keyword] = result
+    def finish(keyword, data, result, source="api"):
+        """每個關鍵字完成時：記錄結果、寫入快取與紀錄檔 (中斷時已完成的部分不會遺失)。"""
+        all_results[keyword] = result
+        if use_cache and source == "api" and "error" not in result:
+            cache.put(data, result)
+        if log is not None:
+            log.append(run_id, keyword, keys[keyword], result, source)
 
-        except requests.exceptions.HTTPError as http_err:
-            print(f"HTTP error occurred for keyword {keyword}: {http_err}")
-            # 失敗的關鍵字也可在 all_results 中標示錯誤訊息
-            all_results[keyword] = {"error": str(http_err)}
-        except Exception as err:
-            print(f"An error occurred for keyword {keyword}: {err}")
-            all_results[keyword] = {"error": str(err)}
+    # 先沿用紀錄檔中已完成的關鍵字 (resume)，再從快取取回，只對其餘關鍵字呼叫 API
+    pending, resumed = payloads, 0
+    if resume and log is not None:
+        done = log.completed(keys.values())
+        pending = []
+        for keyword, data in payloads:
+            if keys[keyword] in done:
+                finish(keyword, data, done[keys[keyword]], "resume")
+            else:
+                pending.append((keyword, data))
+        resumed = len(payloads) - len(pending)
+        print(f"從紀錄檔續跑：略過已完成的 {resumed}/{len(payloads)} 個關鍵字")
 
-    # === 1) 將 all_results 寫到單一 JSON 檔 ===
-    output_dir = os.path.dirname(csv_file)
+    if use_cache:
+        cache = cache or get_default_cache()
+        uncached = []
+        for keyword, data in pending:
+            cached = cache.get(data)
+            if cached is not None:
+                finish(keyword, data, cached, "cache")
+            else:
+                uncached.append((keyword, data))
+        print(f"Completion 快取命中 {len(pending) - len(uncached)}/{len(pending)} 個關鍵字")
+        pending = uncached
+
+    try:
+        if concurrency > 1:
+            asyncio.run(
+                _run_keywords_async(api_url, headers, pending, concurrency, rpm_limit, tpm_limit, on_result=finish)
+            )
+
+        else:
+            for keyword, data in pending:
+                try:
+                    with tm.api_call("chat.completions", data["model"]) as span:
+                        result = oc.post_json(api_url, data, headers=headers, span=span)
+                        span.update(**tm.usage_fields(result.get("usage")))
+
+                    # 將整個回傳存到 all_results
+                    finish(keyword, data, result)
+
+                except oc.APIError as http_err:
+                    print(f"HTTP error occurred for keyword {keyword}: {http_err}")
+                    # 失敗的關鍵字也可在 all_results 中標示錯誤訊息
+                    finish(keyword, data, {"error": str(http_err)})
+                except Exception as err:
+                    print(f"An error occurred for keyword {keyword}: {err}")
+                    finish(keyword, data, {"error": str(err)})
+    except KeyboardInterrupt:
+        if log is not None:
+            print(f"\n已中斷：完成的 {len(all_results)}/{len(payloads)} 個關鍵字已寫入 {log_path}，"
+                  "可用 resume=True 續跑")
+        raise
+
+    failed = sum(1 for result in all_results.values() if "error" in result)
+    if log is not None:
+        log.end_run(run_id, failed)
+        # 最後的結果由紀錄檔組成 (與其他讀取端看到的內容一致)
+        all_results = log.run_results(run_id)
+
+    # 依輸入順序排列 (快取命中與新查詢的結果混合時)
+    all_results = {keyword: all_results[keyword] for keyword, _ in payloads}
+    tm.record(
+        "stage", "analyze_products", time.perf_counter() - start,
+        keywords=len(payloads), requested=len(pending),
+        failed=failed, resumed=resumed,
+    )
+    if not write_output:
+        return all_results
+
+    # === 1) 將 all_results 寫到單一 JSON 檔 (先寫暫存檔再取代，讀取端不會讀到一半) ===
     single_json_path = os.path.join(output_dir, "SimilarProduct_Output.json")
-    with open(single_json_path, "w", encoding="utf-8") as f:
+    with open(single_json_path + ".tmp", "w", encoding="utf-8") as f:
         json.dump(all_results, f, ensure_ascii=False, indent=2)
+    os.replace(single_json_path + ".tmp", single_json_path)
 
     # (1) print All_Responses.json存儲位置
     print(f"\n所有關鍵字的回應已寫入： {single_json_path}")
@@ -134,8 +340,11 @@ def analyze_products(csv_file, api_key, keywords=None):
         print(f"finish_reason: {finish_reason}\n")
         print(f"usage: {_usage}\n")
 
+    return all_results
+
 
 if __name__ == "__main__":
     csv_file_path = r"D:\CYCU\113_WebCrawler\CODE\data\format_clean.csv"
     api_key_input = os.getenv("OPENAI_API_KEY")
-    analyze_products(csv_file_path, api_key_input)
+    # python SimilarProduct.py --resume：沿用上次中斷前已完成的關鍵字
+    analyze_products(csv_file_path, api_key_input, resume="--resume" in sys.argv)
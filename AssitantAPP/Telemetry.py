@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import uuid
+import threading
+from typing import Dict, List, Optional
+
+##############################################################################
+# 執行階段量測 (各處理階段與每次 API 呼叫)
+#   - 預設關閉；關閉時 stage() / api_call() 回傳共用的空物件，幾乎沒有額外成本
+#   - 設定環境變數 TELEMETRY_PATH 或呼叫 enable(path) 後開始記錄：
+#     每個事件一行 JSON (耗時、位元組數、token 數、重試次數、預估費用)
+#   - print_summary() 依 (類型, 名稱) 彙總成表格
+#   - python Telemetry.py compare <log>：比較最近幾次執行的各階段總耗時
+##############################################################################
+
+# 每 1K tokens 的美元價格 (輸入, 輸出)，僅供估算，價格變動時請更新
+PRICES_PER_1K = {
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "text-embedding-ada-002": (0.0001, 0.0),
+    "text-embedding-3-small": (0.00002, 0.0),
+    "text-embedding-3-large": (0.00013, 0.0),
+}
+
+_SUMMED_FIELDS = ("prompt_tokens", "completion_tokens", "bytes_sent", "bytes_received", "retries", "cost_usd")
+
+_enabled = False
+_path: Optional[str] = None
+_run_id = ""
+_lock = threading.Lock()
+_totals: Dict[tuple, dict] = {}
+
+
+def estimate_cost(model: Optional[str], prompt_tokens: int = 0, completion_tokens: int = 0) -> Optional[float]:
+    prices = PRICES_PER_1K.get(model or "")
+    if prices is None:
+        return None
+    return prompt_tokens / 1000 * prices[0] + completion_tokens / 1000 * prices[1]
+
+
+def enable(path: Optional[str] = None) -> str:
+    """開始記錄；path 為 JSON lines 檔 (None 時只保留記憶體中的彙總)。回傳本次執行的 run id。"""
+    global _enabled, _path, _run_id
+    with _lock:
+        _enabled = True
+        _path = path
+        _run_id = uuid.uuid4().hex[:12]
+        _totals.clear()
+    if path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return _run_id
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def record(kind: str, name: str, seconds: float, **fields) -> None:
+    """記錄一個已量測好的事件 (例如子行程回傳的解析時間)。"""
+    if not _enabled:
+        return
+    if "cost_usd" not in fields and ("prompt_tokens" in fields or "completion_tokens" in fields):
+        cost = estimate_cost(fields.get("model"), fields.get("prompt_tokens", 0), fields.get("completion_tokens", 0))
+        if cost is not None:
+            fields["cost_usd"] = cost
+    event = {"run": _run_id, "ts": round(time.time(), 3), "kind": kind, "name": name, "seconds": round(seconds, 6)}
+    event.update(fields)
+
+    with _lock:
+        total = _totals.setdefault((kind, name), {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "errors": 0})
+        total["count"] += 1
+        total["seconds"] += seconds
+        total["max_seconds"] = max(total["max_seconds"], seconds)
+        total["errors"] += 1 if "error" in fields else 0
+        for field in _SUMMED_FIELDS:
+            value = fields.get(field)
+            if value:
+                total[field] = total.get(field, 0) + value
+        if _path:
+            with open(_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+
+class _Span:
+    """with 區塊結束時記錄耗時與 update() 設定的欄位；發生例外時記錄 error。"""
+
+    __slots__ = ("kind", "name", "fields", "_start")
+
+    def __init__(self, kind: str, name: str, fields: dict):
+        self.kind = kind
+        self.name = name
+        self.fields = fields
+
+    def update(self, **fields) -> None:
+        self.fields.update(fields)
+
+    def __enter__(self) -> "_Span":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is not None:
+            self.fields["error"] = exc_type.__name__
+        record(self.kind, self.name, time.perf_counter() - self._start, **self.fields)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def update(self, **fields) -> None:
+        pass
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def stage(name: str, **fields):
+    """量測一個處理階段：with stage("embed", chunks=n) as span: ..."""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span("stage", name, fields)
+
+
+def api_call(name: str, model: Optional[str] = None, **fields):
+    """量測一次 API 呼叫；以 span.update(prompt_tokens=..., retries=...) 補上結果。"""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span("api", name, dict(fields, model=model) if model else fields)
+
+
+def usage_fields(usage: Optional[dict]) -> dict:
+    """將 API 回應的 usage 轉為 record 欄位。"""
+    if not usage:
+        return {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "completion_tokens": usage.get("completion_tokens", 0),
+    }
+
+
+def summary_rows() -> List[dict]:
+    with _lock:
+        items = sorted(_totals.items(), key=lambda item: (item[0][0] != "stage", -item[1]["seconds"]))
+        return [dict({"kind": kind, "name": name}, **total) for (kind, name), total in items]
+
+
+def _format_table(rows: List[dict], columns: List[str]) -> str:
+    try:
+        from tabulate import tabulate
+    except ImportError:
+        tabulate = None
+    values = [[row.get(c, "") for c in columns] for row in rows]
+    if tabulate is not None:
+        return tabulate(values, headers=columns, floatfmt=".3f")
+    cells = [columns] + [[f"{v:.3f}" if isinstance(v, float) else str(v) for v in row] for row in values]
+    widths = [max(len(str(row[i])) for row in cells) for i in range(len(columns))]
+    return "\n".join("  ".join(str(v).rjust(w) for v, w in zip(row, widths)) for row in cells)
+
+
+def print_summary() -> None:
+    """印出本次執行的彙總表 (未啟用時不做任何事)。"""
+    if not _enabled:
+        return
+    columns = ["kind", "name", "count", "seconds", "max_seconds", "errors"] + list(_SUMMED_FIELDS)
+    rows = summary_rows()
+    for row in rows:
+        if "cost_usd" in row:
+            row["cost_usd"] = round(row["cost_usd"], 6)
+    print(f"\n===== 執行量測 (run {_run_id}) =====")
+    print(_format_table(rows, columns))
+    cost = sum(row.get("cost_usd", 0) for row in rows if row["kind"] == "api")
+    print(f"預估 API 費用：US$ {cost:.4f}" + (f"，明細：{_path}" if _path else ""))
+
+
+def compare_runs(path: str, last: int = 2) -> str:
+    """讀取 JSON lines 紀錄，列出最近 last 次執行各 (類型, 名稱) 的總耗時與變化。"""
+    runs: Dict[str, Dict[tuple, float]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            event = json.loads(line)
+            totals = runs.setdefault(event["run"], {})
+            key = (event["kind"], event["name"])
+            totals[key] = totals.get(key, 0.0) + event["seconds"]
+    run_ids = list(runs)[-last:]
+    keys = sorted({key for run in run_ids for key in runs[run]})
+    rows = []
+    for kind, name in keys:
+        row = {"kind": kind, "name": name}
+        values = [runs[run].get((kind, name)) for run in run_ids]
+        for run, value in zip(run_ids, values):
+            row[run] = round(value, 3) if value is not None else ""
+        if len(values) >= 2 and values[-2] and values[-1] is not None:
+            row["change"] = f"{(values[-1] - values[-2]) / values[-2]:+.1%}"
+        rows.append(row)
+    return _format_table(rows, ["kind", "name"] + run_ids + ["change"])
+
+
+if os.getenv("TELEMETRY_PATH"):
+    enable(os.getenv("TELEMETRY_PATH"))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="執行量測紀錄")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("compare", help="比較最近幾次執行的各階段耗時")
+    p.add_argument("path")
+    p.add_argument("--last", type=int, default=2)
+    args = parser.parse_args()
+
+    print(compare_runs(args.path, args.last))
@@ -0,0 +1,41 @@
+import re
+from functools import lru_cache
+from typing import Optional
+
+##############################################################################
+# Token 估算工具
+#   - 優先使用 tiktoken (requirements.txt 已列出)
+#   - 若 tiktoken 不可用 (未安裝或無法下載編碼檔)，改用字元數估算：
+#     中日韓文字約 1 字 1 token，其餘約 4 字元 1 token
+##############################################################################
+_CJK_PATTERN = re.compile(r"[　-鿿가-힯豈-﫿＀-￯]")
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        try:
+            return tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            return None
+    except Exception:
+        return None
+
+
+def estimate_tokens(text: str) -> int:
+    """不依賴 tiktoken 的保守估算。"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def count_tokens(text: str, model: Optional[str] = "text-embedding-ada-002") -> int:
+    encoding = get_encoding(model) if model else None
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
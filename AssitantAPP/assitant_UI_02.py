@@ -1,10 +1,16 @@
 import sys
 import pandas as pd
+from PyQt5.QtCore import Qt, QThread, pyqtSignal
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QLabel, QComboBox, QPushButton,
-    QVBoxLayout, QHBoxLayout, QWidget, QTextEdit,
+    QVBoxLayout, QHBoxLayout, QWidget, QTextEdit, QLineEdit, QListWidget, QListWidgetItem,
 )
 from PyQt5.QtGui import QIcon
+from CatalogIndex import CatalogIndex, CATEGORY_COLUMN, CODE_COLUMN
+from CatalogSearch import CatalogSearch
+from DataStore import load_dataset
+from PriceStats import PriceStats
+import Telemetry as tm
 """使用 價量調查品項111-112.csv和 價量調查品項108-110.csv"""
 # 資料讀取和合併
 # file_111_112 = "./CODE/data/價量調查品項111-112.csv"
@@ -18,18 +24,87 @@ from PyQt5.QtGui import QIcon
 
 """使用 價量調查品項108-112.csv"""
 file_108_112 = "D:/CYCU/113_WebCrawler/CODE/data/價量調查品項111-112_FINAL.csv"
+SEARCH_PLACEHOLDER = "品名 / 型號規格 / 申請者 / 許可證字號"
+
+
+class DataLoader(QThread):
+    """
+    在背景執行緒讀取資料 (有二進位快取時直接讀快取，見 DataStore.py) 並建立查詢索引、
+    支付點數統計與搜尋索引，讓主視窗不必等資料載入完成即可顯示。
+    查詢索引與統計完成後先送出 loaded (選單即可使用)，建立較久的搜尋索引之後再送出 search_ready。
+    """
+    loaded = pyqtSignal(object)
+    search_ready = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, csv_path, parent=None):
+        super().__init__(parent)
+        self.csv_path = csv_path
+
+    def run(self):
+        try:
+            with tm.stage("gui_load"):
+                data = load_dataset(self.csv_path)
+                # 載入時建立查詢索引，下拉選單與查詢只取對應的列
+                catalog = CatalogIndex(data)
+                stats = PriceStats(catalog.data)
+            self.loaded.emit((catalog, stats))
+            with tm.stage("gui_search_index"):
+                search = CatalogSearch(catalog.data)
+            self.search_ready.emit(search)
+        except Exception as e:
+            self.failed.emit(str(e))
+
+
+class DaemonAskWorker(QThread):
+    """
+    將關鍵字交給常駐查詢服務 (QueryDaemon.py serve) 做產品分析與 PDF 檢索，
+    GUI 本身不載入產品目錄與 PDF 索引。
+    """
+    answered = pyqtSignal(str)
+    failed = pyqtSignal(str)
+
+    def __init__(self, keywords, parent=None):
+        super().__init__(parent)
+        self.keywords = keywords
+
+    def run(self):
+        # 只在使用時才匯入，不影響視窗的啟動時間
+        import httpx
+        from DaemonClient import DaemonClient, DaemonError
+        client = DaemonClient()
+        try:
+            with tm.stage("daemon_ask", keywords=len(self.keywords)):
+                result = client.ask(self.keywords)
+            self.answered.emit(result["answer"])
+        except httpx.TransportError:
+            self.failed.emit(f"無法連線到常駐查詢服務 ({client.url})，請先執行 python QueryDaemon.py serve")
+        except DaemonError as e:
+            self.failed.emit(str(e))
+        except Exception as e:
+            # 任何錯誤都要通知視窗，否則「AI 分析」按鈕會一直停用
+            self.failed.emit(f"AI 分析失敗：{e}")
+        finally:
+            client.close()
 
-data_108_112 = pd.read_csv(file_108_112)
-combined_data = data_108_112
-combined_data["特材代碼前五碼"] = combined_data["特材代碼前五碼"].astype(str)
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, csv_path=file_108_112):
         super().__init__()
         self._filtered_data = None  # 儲存篩選後的資料
+        self.catalog = None  # 背景載入完成後才會設定
+        self.stats = None
+        self.search = None
         self.setWindowTitle("AI議價工具 GUI")
         self.setGeometry(100, 100, 600, 500)
         self.init_ui()
+        self.set_loading(True)
+
+        self._loader = DataLoader(csv_path, self)
+        self._loader.loaded.connect(self.on_data_loaded)
+        self._loader.search_ready.connect(self.on_search_ready)
+        self._loader.failed.connect(self.on_load_failed)
+        self._loader.start()
 
     def init_ui(self):
         # 主佈局
@@ -37,10 +112,23 @@ class MainWindow(QMainWindow):
         # Icon 部分
         self.setWindowIcon(QIcon("./data/AIBrain.png"))
 
+        # 搜尋框：輸入品名、型號/規格、申請者或許可證字號，點選結果即帶入下方選項
+        search_label = QLabel("搜尋")
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText(SEARCH_PLACEHOLDER)
+        self.search_edit.textChanged.connect(self.update_search_results)
+        search_layout = QHBoxLayout()
+        search_layout.addWidget(search_label)
+        search_layout.addWidget(self.search_edit)
+        main_layout.addLayout(search_layout)
+        self.search_results = QListWidget()
+        self.search_results.setMaximumHeight(120)
+        self.search_results.itemClicked.connect(self.select_search_result)
+        main_layout.addWidget(self.search_results)
+
         # 特材代碼前五碼選項
         code_label = QLabel("特材代碼前五碼")
         self.code_combo = QComboBox()
-        self.code_combo.addItems(sorted(combined_data["特材代碼前五碼"].unique()))
         self.code_combo.currentTextChanged.connect(self.update_category_options)
         code_layout = QHBoxLayout()
         code_layout.addWidget(code_label)
@@ -67,15 +155,76 @@ class MainWindow(QMainWindow):
         main_layout.addWidget(result_label)
         main_layout.addWidget(self.result_display)
 
+        # AI 分析：關鍵字交給常駐查詢服務 (QueryDaemon)
+        ai_label = QLabel("AI 分析關鍵字")
+        self.ai_keywords_edit = QLineEdit()
+        self.ai_keywords_edit.setPlaceholderText("以逗號分隔，例如：骨水泥, 人工關節")
+        self.ai_button = QPushButton("AI 分析")
+        self.ai_button.clicked.connect(self.ask_daemon)
+        ai_layout = QHBoxLayout()
+        ai_layout.addWidget(ai_label)
+        ai_layout.addWidget(self.ai_keywords_edit)
+        ai_layout.addWidget(self.ai_button)
+        main_layout.addLayout(ai_layout)
+        self.ai_display = QTextEdit()
+        self.ai_display.setReadOnly(True)
+        main_layout.addWidget(self.ai_display)
+
         # 設置中央小部件
         central_widget = QWidget()
         central_widget.setLayout(main_layout)
         self.setCentralWidget(central_widget)
 
+    def set_loading(self, loading):
+        """資料載入期間停用選單與按鈕 (搜尋框在搜尋索引建立完成後才啟用，見 on_search_ready)"""
+        for widget in (self.code_combo, self.param_combo, self.result_button):
+            widget.setEnabled(not loading)
+        if loading:
+            self.search_edit.setEnabled(False)
+            self.search_edit.setPlaceholderText("搜尋索引建立中...")
+            self.result_display.setText("資料載入中...")
+
+    def on_data_loaded(self, loaded):
+        """查詢索引與統計載入完成：填入特材代碼選項並啟用選單"""
+        catalog, self.stats = loaded
+        self.catalog = catalog
+        self.code_combo.addItems(catalog.codes)
+        self.set_loading(False)
+        self.result_display.clear()
+
+    def on_search_ready(self, search):
+        """搜尋索引建立完成：啟用搜尋框"""
+        self.search = search
+        self.search_edit.setPlaceholderText(SEARCH_PLACEHOLDER)
+        self.search_edit.setEnabled(True)
+
+    def on_load_failed(self, message):
+        self.result_display.setText(f"資料載入失敗：{message}")
+
+    def update_search_results(self, text):
+        """每次輸入都重新查詢，列出最相符的品項"""
+        self.search_results.clear()
+        if self.search is None:
+            return
+        data = self.search.data
+        with tm.stage("catalog_search", chars=len(text)):
+            for pos, score in self.search.search_positions(text, top_n=20):
+                row = data.iloc[pos]
+                label = " | ".join(str(row[c]) for c in self.search.columns)
+                item = QListWidgetItem(f"{label}  ({row[CODE_COLUMN]} / {row[CATEGORY_COLUMN]})")
+                item.setData(Qt.UserRole, pos)
+                self.search_results.addItem(item)
+
+    def select_search_result(self, item):
+        """將搜尋結果的特材代碼與核價類別帶入選單並顯示結果"""
+        row = self.search.data.iloc[item.data(Qt.UserRole)]
+        self.code_combo.setCurrentText(str(row[CODE_COLUMN]))
+        self.param_combo.setCurrentText(str(row[CATEGORY_COLUMN]))
+        self.show_results()
+
     def update_category_options(self, selected_code):
         """根據選擇的特材代碼更新核價類別選項"""
-        filtered_data = combined_data[combined_data["特材代碼前五碼"] == selected_code]
-        categories = sorted(filtered_data["核價類別名稱"].unique())
+        categories = self.catalog.categories(selected_code)
         self.param_combo.clear()
         self.param_combo.addItems(categories)
 
@@ -84,26 +233,48 @@ class MainWindow(QMainWindow):
         selected_code = self.code_combo.currentText()
         selected_category = self.param_combo.currentText()
 
-        self._filtered_data = combined_data[
-            (combined_data["特材代碼前五碼"] == selected_code) &
-            (combined_data["核價類別名稱"] == selected_category)
-        ]
+        self._filtered_data = self.catalog.rows(selected_code, selected_category)
 
         if self._filtered_data.empty:
             self.result_display.setText("沒有找到相關數據")
         else:
             results = self._filtered_data[["年份", "支付點數", "申請者簡稱", "許可證字號"]]
-            result_text = results.to_string(index=False, header=True)
+            summary = self.stats.summary(selected_code, selected_category)
+            summary = summary.assign(年增率=summary["年增率"].map(lambda v: "-" if pd.isna(v) else f"{v:+.1%}"))
+            applicants = self.stats.applicants(selected_code, selected_category)
+            result_text = "\n\n".join([
+                "支付點數統計：\n" + summary.to_string(index=False, header=True, float_format=lambda v: f"{v:,.2f}"),
+                "申請者件數：\n" + applicants.to_string(),
+                "明細：\n" + results.to_string(index=False, header=True),
+            ])
             self.result_display.setText(result_text)
             print(f"filtered_data:\n type:{type(self._filtered_data)}\n {self._filtered_data}")
     
+    def ask_daemon(self):
+        """在背景執行緒向常駐查詢服務提問，完成前停用按鈕"""
+        keywords = [k.strip() for k in self.ai_keywords_edit.text().split(",") if k.strip()]
+        if not keywords:
+            self.ai_display.setText("請輸入關鍵字")
+            return
+        self.ai_button.setEnabled(False)
+        self.ai_display.setText("分析中...")
+        self._ask_worker = DaemonAskWorker(keywords, self)
+        self._ask_worker.answered.connect(self.on_daemon_answer)
+        self._ask_worker.failed.connect(self.on_daemon_answer)
+        self._ask_worker.start()
+
+    def on_daemon_answer(self, text):
+        self.ai_display.setText(text)
+        self.ai_button.setEnabled(True)
+
     def get_filtered_data(self):
         """提供外部存取 filtered_data 的方法"""
         return self._filtered_data
 
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = MainWindow()
-    window.show()
+    with tm.stage("gui_show"):
+        app = QApplication(sys.argv)
+        window = MainWindow()
+        window.show()
     sys.exit(app.exec_())
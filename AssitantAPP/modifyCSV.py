@@ -1,19 +1,201 @@
-import pandas as pd
+import os
 import csv
-# 讀取 CSV 檔案
+import time
+import sqlite3
+import tempfile
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+from typing import Iterator, List, Optional
+
+from EmbeddingCache import CACHE_DIR
+from DataStore import apply_dtypes, iter_frames, read_header, source_signature, write_frames
+
+##############################################################################
+# 價量調查 CSV 清理 (串流處理)
+#   - 以 chunk 讀取 CSV，記憶體用量與檔案大小無關
+#   - 所有文字欄位去除前後空白 (含全形空白)，例如「特材代碼」「中英文品名」「單位」
+#     「核價類別名稱」開頭的空白；「年份」「支付點數」轉為數值
+#   - 每個輸入檔清理後存成各自的 .pkb (CACHE_DIR/clean/，檔名含完整路徑的雜湊)，內容沒變動的檔案不會重新處理
+#   - 合併所有年度檔並去除重複列，輸出 DataStore 的 .pkb 格式 (可選擇另存 CSV)；
+#     已出現過的列以 64-bit 雜湊存在暫存的 SQLite 檔 (磁碟)，記憶體用量不隨列數增加
+#   - 輸入與參數都沒變時不做任何事，重複執行結果相同
+##############################################################################
 input_file = 'D:/CYCU/113_WebCrawler/CODE/data/價量調查品項108-112.csv'  # 輸入檔案名稱
-output_file = 'D:/CYCU/113_WebCrawler/CODE/data/AfterModify.csv'  # 輸出檔案名稱
+output_file = 'D:/CYCU/113_WebCrawler/CODE/data/價量調查品項_clean.pkb'  # 輸出檔案名稱 (DataStore 格式)
+
+CHUNK_ROWS = 50_000
+CLEAN_DIR = os.path.join(CACHE_DIR, "clean")
+CLEAN_VERSION = 1  # 清理規則變更時遞增，已清理的檔案會重新處理
+_SQL_BATCH = 500
+
+_WHITESPACE = " \t\r\n\u3000\ufeff"
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def clean_chunk(df: pd.DataFrame) -> pd.DataFrame:
+    """去除欄名與文字欄位的前後空白，並將「年份」「支付點數」轉為數值。"""
+    df.columns = [str(column).strip(_WHITESPACE) for column in df.columns]
+    for column in df.columns:
+        values = df[column].astype("string").str.strip(_WHITESPACE)
+        df[column] = values.mask(values == "")
+
+    if "年份" in df.columns:
+        # 接受「111」「111年」等寫法
+        df["年份"] = pd.to_numeric(df["年份"].str.extract(r"(\d+)", expand=False), errors="coerce")
+    if "支付點數" in df.columns:
+        df["支付點數"] = pd.to_numeric(df["支付點數"].str.replace(",", "", regex=False), errors="coerce")
+    return apply_dtypes(df)
+
+
+def iter_clean_chunks(csv_path: str, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    # 全部以字串讀入，避免代碼被轉成數字 (例如前導 0 消失)
+    reader = pd.read_csv(csv_path, encoding="utf-8-sig", dtype=str, keep_default_na=False, chunksize=chunk_rows)
+    for chunk in reader:
+        yield clean_chunk(chunk)
+
+
+def clean_file(csv_path: str, clean_dir: str = CLEAN_DIR, chunk_rows: int = CHUNK_ROWS) -> str:
+    """
+    清理單一 CSV 並存成 clean_dir/<檔名>-<路徑雜湊>.pkb，回傳該路徑。
+    (不同資料夾中同名的檔案各自有自己的清理結果)
+    已清理過且內容 (SHA-256) 沒變動時直接回傳舊檔。
+    """
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    path_hash = hashlib.sha256(os.path.abspath(csv_path).encode("utf-8")).hexdigest()[:12]
+    part_path = os.path.join(clean_dir, f"{name}-{path_hash}.pkb")
+    signature = source_signature(csv_path)
+
+    header = read_header(part_path)
+    if header is not None and header.get("version") == CLEAN_VERSION:
+        if header.get("source") == signature:
+            print(f"未變動，略過：{csv_path}")
+            return part_path
+        sha256 = _file_sha256(csv_path)
+        if header.get("sha256") == sha256:
+            # 只有修改時間改變，內容相同：更新 header 即可
+            write_frames(part_path, iter_frames(part_path), dict(header, source=signature))
+            print(f"內容未變動，略過：{csv_path}")
+            return part_path
+    else:
+        sha256 = _file_sha256(csv_path)
+
+    start = time.perf_counter()
+    rows = write_frames(
+        part_path,
+        iter_clean_chunks(csv_path, chunk_rows),
+        {"version": CLEAN_VERSION, "input": os.path.abspath(csv_path), "source": signature, "sha256": sha256},
+    )
+    print(f"已清理 {csv_path}：{rows} 列 ({time.perf_counter() - start:.2f} s)")
+    return part_path
+
+
+def iter_merged(part_paths: List[str], work_dir: str = CLEAN_DIR) -> Iterator[pd.DataFrame]:
+    """
+    依序讀出各檔清理結果並去除重複列。
+    已出現過的列雜湊 (64-bit) 存在 work_dir 下的暫存 SQLite 檔，每次只處理一個區塊，
+    記憶體用量與總列數無關；結束後刪除暫存檔。
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    fd, db_path = tempfile.mkstemp(prefix="merge-", suffix=".sqlite", dir=work_dir)
+    os.close(fd)
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("CREATE TABLE seen (hash INTEGER PRIMARY KEY)")
+        columns = None
+        for part_path in part_paths:
+            for frame in iter_frames(part_path):
+                if columns is None:
+                    columns = list(frame.columns)
+                frame = frame.reindex(columns=columns)
+                # SQLite 的整數為有號 64-bit
+                hashes = pd.util.hash_pandas_object(frame.astype("string"), index=False).to_numpy().view(np.int64)
+                keep = ~pd.Series(hashes).duplicated().to_numpy()  # 區塊內的重複列
+                unique = hashes[keep].tolist()
+                seen = set()
+                for i in range(0, len(unique), _SQL_BATCH):
+                    part = unique[i:i + _SQL_BATCH]
+                    marks = ",".join("?" * len(part))
+                    seen.update(h for (h,) in conn.execute(f"SELECT hash FROM seen WHERE hash IN ({marks})", part))
+                if seen:
+                    keep &= ~np.isin(hashes, np.fromiter(seen, dtype=np.int64, count=len(seen)))
+                conn.executemany("INSERT INTO seen (hash) VALUES (?)", ((h,) for h in hashes[keep].tolist()))
+                if keep.any():
+                    yield frame[keep].reset_index(drop=True)
+    finally:
+        conn.close()
+        os.remove(db_path)
+
+
+def normalize_csv(
+    input_files: List[str],
+    output_path: str = output_file,
+    csv_output: Optional[str] = None,
+    clean_dir: str = CLEAN_DIR,
+    chunk_rows: int = CHUNK_ROWS,
+) -> str:
+    """
+    清理並合併多個年度的價量調查 CSV，輸出 .pkb (可用 DataStore.load_dataset 讀取)。
+    只有輸入檔內容、清單或清理規則 (CLEAN_VERSION) 變動時才重新合併
+    (只有修改時間改變的輸入檔不會觸發重新合併)。
+    """
+    start = time.perf_counter()
+    part_paths = [clean_file(path, clean_dir, chunk_rows) for path in input_files]
+    parts = []
+    for path in part_paths:
+        part_header = read_header(path)
+        parts.append({
+            "path": path,
+            "sha256": part_header["sha256"],
+            "version": part_header["version"],
+        })
+
+    header = read_header(output_path)
+    if (
+        header is not None
+        and header.get("version") == CLEAN_VERSION
+        and header.get("parts") == parts
+        and (csv_output is None or os.path.exists(csv_output))
+    ):
+        print(f"輸出已是最新：{output_path}")
+        return output_path
+
+    frames = iter_merged(part_paths, clean_dir)
+    if csv_output:
+        frames = _tee_csv(frames, csv_output)
+    rows = write_frames(output_path, frames, {"version": CLEAN_VERSION, "parts": parts})
+    print(f"已合併 {len(part_paths)} 個檔案：{rows} 列 -> {output_path} ({time.perf_counter() - start:.2f} s)")
+    return output_path
+
 
-# 讀取 CSV，假設檔案使用 UTF-8 編碼
-df = pd.read_csv(input_file, encoding='utf-8')
+def _tee_csv(frames: Iterator[pd.DataFrame], csv_path: str) -> Iterator[pd.DataFrame]:
+    """寫入 .pkb 的同時另存一份 CSV (逐區塊附加)。"""
+    tmp_path = csv_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        header = True
+        for frame in frames:
+            frame.to_csv(f, index=False, header=header, quoting=csv.QUOTE_MINIMAL)
+            header = False
+            yield frame
+    os.replace(tmp_path, csv_path)
 
-# 去除「核價類別名稱」欄位前方的空白字元
-if '核價類別名稱' in df.columns:
-    df['核價類別名稱'] = df['核價類別名稱'].astype(str).str.lstrip()
-else:
-    print("找不到 '核價類別名稱' 欄位")
 
-# 儲存修改後的 CSV 檔案
-df.to_csv(output_file, index=False, encoding='utf-8')
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="清理、合併價量調查 CSV 並輸出 .pkb")
+    parser.add_argument("inputs", nargs="*", default=[input_file], help="一或多個年度 CSV")
+    parser.add_argument("-o", "--output", default=output_file, help="輸出 .pkb 路徑")
+    parser.add_argument("--csv", default=None, help="另存清理後的 CSV")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
 
-print(f"已移除前置空白，並儲存至 {output_file}")
\ No newline at end of file
+    normalize_csv(args.inputs, args.output, csv_output=args.csv, chunk_rows=args.chunk_rows)